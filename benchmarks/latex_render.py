@@ -0,0 +1,110 @@
+"""
+Микро-бенчмарк latex_to_codeblock: старая реализация (цепочка re.sub) против
+нового однопроходного рендерера из bot/utils.py.
+
+Корпус — настоящие главы из bot/textbooks: формулы в тексте учебника
+(C5H12, CH3COOH, ...) переписываются в LaTeX так, как их присылает GPT
+в лекциях ($C_{5}H_{12}$, \\[ ... \\rightarrow ... \\]).
+
+Запуск из корня проекта:
+    python -m benchmarks.latex_render [--repeat 20]
+"""
+import argparse
+import re
+import time
+
+from bot.utils import TEXTBOOK_CONTENT, latex_to_codeblock, render_formula
+
+_FORMULA_WORD = re.compile(r"\b(?:[A-Z][a-z]?\d*){2,}\b")
+_DIGITS = re.compile(r"(\d+)")
+
+
+def _to_latex(formula: str) -> str:
+    return "$" + _DIGITS.sub(r"_{\1}", formula) + "$"
+
+
+def build_corpus():
+    """{глава: текст лекции с LaTeX-формулами}"""
+    corpus = {}
+    for topic, chunks in TEXTBOOK_CONTENT.items():
+        parts = []
+        for chunk in chunks:
+            formulas = _FORMULA_WORD.findall(chunk)
+            parts.append(_FORMULA_WORD.sub(lambda m: _to_latex(m.group(0)), chunk))
+            if len(formulas) >= 2:
+                lhs, rhs = formulas[0], formulas[1]
+                parts.append(
+                    "\\[ " + _DIGITS.sub(r"_{\1}", lhs) + " + H_2O \\xrightarrow{H^+, t} "
+                    + _DIGITS.sub(r"_{\1}", rhs) + " + OH^{-} \\]"
+                )
+        corpus[topic] = "\n\n".join(parts)
+    return corpus
+
+
+# ───────── Старая реализация (до однопроходного рендерера) ─────────
+_OLD_SUB = {str(i): chr(0x2080 + i) for i in range(10)}
+_OLD_SUP = {
+    '0':'⁰','1':'¹','2':'²','3':'³','4':'⁴',
+    '5':'⁵','6':'⁶','7':'⁷','8':'⁸','9':'⁹',
+    '+':'⁺','-':'⁻'
+}
+
+
+def legacy_latex_to_codeblock(text: str) -> str:
+    def _convert(match: re.Match) -> str:
+        frm = match.group(1)
+        frm = re.sub(r'\\text\{([^}]*)\}', r'\1', frm)
+        frm = re.sub(
+            r'_(?:\{)?(\d+)(?:\})?',
+            lambda m: ''.join(_OLD_SUB.get(ch, ch) for ch in m.group(1)),
+            frm
+        )
+        frm = re.sub(
+            r'\^(?:\{)?([^}]+)(?:\})?',
+            lambda m: ''.join(_OLD_SUP.get(ch, ch) for ch in m.group(1)),
+            frm
+        )
+        frm = re.sub(r'\\(?:rightarrow|to|longrightarrow|xrightarrow)', '→', frm)
+        frm = re.sub(r'\\equiv', '≡', frm)
+        frm = frm.replace('{', '').replace('}', '')
+        frm = frm.replace('\\,', '')
+        frm = frm.strip()
+        return f"```\n{frm}\n```"
+
+    text = re.sub(r'\\\[([\s\S]*?)\\\]', _convert, text, flags=re.DOTALL)
+    text = re.sub(r'\$([^$]+)\$', _convert, text)
+    return text
+
+
+def _bench(fn, corpus, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in corpus.values():
+            fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    corpus = build_corpus()
+    formulas = sum(len(re.findall(r"\$[^$]+\$|\\\[", t)) for t in corpus.values())
+    print(f"Корпус: {len(corpus)} глав, {sum(map(len, corpus.values()))} символов, {formulas} формул")
+
+    old = _bench(legacy_latex_to_codeblock, corpus, args.repeat)
+    render_formula.cache_clear()
+    cold = _bench(latex_to_codeblock, corpus, 1)
+    new = _bench(latex_to_codeblock, corpus, args.repeat)
+    print(f"старый рендерер:          {old * 1000:8.2f} мс на весь курс")
+    print(f"новый (холодный кэш):     {cold * 1000:8.2f} мс  (x{old / cold:.1f})")
+    print(f"новый (тёплый кэш):       {new * 1000:8.2f} мс  (x{old / new:.1f})")
+    per_chapter = new / len(corpus) * 1000
+    print(f"в среднем на главу:       {per_chapter:8.3f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""
+Набор микро-бенчмарков горячих функций бота (в духе pytest-benchmark):
+каждая функция калибруется (сколько вызовов нужно на один раунд), затем
+меряется несколько раундов — min / median / mean / stddev на один вызов.
+Результат можно сохранить в JSON и сравнить с прошлым прогоном: если
+какой-то бенчмарк стал медленнее порога, команда завершается с кодом 1.
+
+Запуск из корня проекта:
+    python -m benchmarks.suite                               # все бенчмарки
+    python -m benchmarks.suite -k latex --rounds 20
+    python -m benchmarks.suite --save .bench/main.json       # базовая линия (до изменений)
+    python -m benchmarks.suite --compare .bench/main.json --threshold 15
+
+Фикстуры собираются во временной папке: корпус из bot/textbooks (как в
+benchmarks.latex_render), синтетическая tests1.db (TEST_TYPES тестов по
+QUESTIONS_PER_TEST заданий), база ответов с историей ученика и голосовое —
+запись из BENCH_AUDIO=путь.ogg или синтетический сигнал (нужен ffmpeg).
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from functools import cached_property
+from typing import Callable, Dict, List, Tuple
+
+TEST_TYPES = 28
+QUESTIONS_PER_TEST = 20
+AUDIO_SECONDS = 75        # два сегмента Whisper
+MIN_ROUND = 0.05          # секунд на раунд: быстрые функции вызываются в цикле
+MAX_TIME = 3.0            # примерный бюджет на раунды одного бенчмарка, с
+DEFAULT_THRESHOLD = 20.0  # % замедления, после которого --compare считает регрессией
+
+
+class Skip(Exception):
+    """Бенчмарк нельзя запустить в этом окружении (например, нет ffmpeg)."""
+
+
+# ───────── Фикстуры ─────────
+class Fixtures:
+    """Данные для бенчмарков; собираются лениво, один раз на прогон."""
+
+    def __init__(self, workdir: str):
+        self.workdir = workdir
+
+    @cached_property
+    def corpus(self) -> Dict[str, str]:
+        from benchmarks.latex_render import build_corpus
+        return build_corpus()
+
+    @cached_property
+    def gpt_answer(self) -> str:
+        """Ответ GPT как он приходит в analyze_answer: Markdown + HTML + формулы, ~3–4 тыс. символов."""
+        from bot.utils import TEXTBOOK_CONTENT
+        chunk = next(iter(TEXTBOOK_CONTENT.values()))[0][:2500]
+        paragraphs = [p for p in chunk.split("\n") if p.strip()] or [chunk]
+        parts = ["### Разбор ответа", "**Сильные стороны:**"]
+        parts += [f"- {p[:160]}" for p in paragraphs[:5]]
+        parts += ["<b>Неточности:</b>", "<ul><li>Перепутана формула: $C_{5}H_{12}$</li><li>Нет реакции Вюрца</li></ul>"]
+        parts += paragraphs[5:]
+        parts += ["```\nCH3-CH2-CH3 + Cl2 → CH3-CHCl-CH3 + HCl\n```", "💡 <i>Повтори изомерию</i> &amp; номенклатуру."]
+        return "\n\n".join(parts)
+
+    @cached_property
+    def tests_db(self) -> str:
+        rng = random.Random(1)
+        with sqlite3.connect(os.environ["TESTS_DB"]) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS tests (
+                    id INTEGER PRIMARY KEY, type INTEGER, question TEXT, options TEXT,
+                    correct_answer TEXT, explanation TEXT, hint TEXT, detailed_explanation TEXT
+                )
+            ''')
+            conn.execute("DELETE FROM tests")
+            conn.executemany(
+                "INSERT INTO tests VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        t * 1000 + i, t,
+                        "Из предложенного перечня выберите два вещества, " * rng.randint(2, 6),
+                        "\n".join(f"{k}) вещество {k}" for k in range(1, 6)),
+                        str(rng.randint(10, 55)),
+                        "Пояснение к ответу. " * rng.randint(5, 30),
+                        "Подсказка.",
+                        "Подробное решение. " * rng.randint(0, 40),
+                    )
+                    for t in range(1, TEST_TYPES + 1) for i in range(QUESTIONS_PER_TEST)
+                ],
+            )
+        return os.environ["TESTS_DB"]
+
+    @cached_property
+    def question_ids(self) -> List[int]:
+        self.tests_db
+        return [t * 1000 + i for t in range(1, TEST_TYPES + 1) for i in range(QUESTIONS_PER_TEST)]
+
+    @cached_property
+    def answers_db(self) -> str:
+        """База ответов: один ученик прошёл все тесты (для отчёта)."""
+        from bot.services import answer_db
+        answer_db.init_db()
+        rng = random.Random(2)
+        with sqlite3.connect(answer_db.DB_FILE) as conn:
+            conn.executemany(
+                "INSERT INTO test_answers (user_id, username, answer_time, test_type, question_id, "
+                "question_text, user_answer, correct_answer, is_correct) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (1, "bench", "2025-01-01 10:00:00", t, t * 1000 + i, "Вопрос", "12", "12", rng.random() < 0.6)
+                    for t in range(1, TEST_TYPES + 1) for i in range(QUESTIONS_PER_TEST)
+                ],
+            )
+        return answer_db.DB_FILE
+
+    @cached_property
+    def sheet_records(self) -> List[dict]:
+        from bot.utils import ALL_TOPICS
+        return [
+            {"Тема": topic, "Дата и время": "2025-01-01 10:00", "Комментарий GPT": self.gpt_answer[:600]}
+            for topic in ALL_TOPICS[:6]
+        ]
+
+    @cached_property
+    def voice_file(self) -> str:
+        path = os.getenv("BENCH_AUDIO")
+        if path:
+            return path
+        path = os.path.join(self.workdir, "voice.ogg")
+        try:
+            from pydub.generators import Sine
+            Sine(220).to_audio_segment(duration=AUDIO_SECONDS * 1000).set_frame_rate(16000).export(path, format="ogg")
+        except Exception as e:
+            raise Skip(f"нет голосового (BENCH_AUDIO) и не удалось сделать синтетическое: {e}")
+        return path
+
+
+# ───────── Бенчмарки ─────────
+# Функция получает фикстуры, делает подготовку и возвращает то, что меряем (вызов без аргументов).
+BENCHMARKS: List[Tuple[str, Callable]] = []
+
+
+def benchmark(name: str):
+    def register(fn):
+        BENCHMARKS.append((name, fn))
+        return fn
+    return register
+
+
+@benchmark("utils.latex_to_codeblock[course]")
+def bench_latex_course(fx):
+    from bot.utils import latex_to_codeblock
+    texts = list(fx.corpus.values())
+    return lambda: [latex_to_codeblock(t) for t in texts]
+
+
+@benchmark("utils.latex_to_codeblock[course,cold]")
+def bench_latex_course_cold(fx):
+    from bot.utils import latex_to_codeblock, render_formula
+    texts = list(fx.corpus.values())
+
+    def run():
+        render_formula.cache_clear()
+        return [latex_to_codeblock(t) for t in texts]
+    return run
+
+
+@benchmark("utils.clean_html[answer]")
+def bench_clean_html(fx):
+    from bot.utils import clean_html
+    text = fx.gpt_answer
+    return lambda: clean_html(text)
+
+
+@benchmark("utils.to_telegram_html[answer]")
+def bench_to_telegram_html(fx):
+    from bot.utils import to_telegram_html
+    text = fx.gpt_answer
+    return lambda: to_telegram_html(text)
+
+
+@benchmark("utils.split_html[course chapter]")
+def bench_split_html(fx):
+    from bot.utils import split_html, to_telegram_html
+    html = to_telegram_html(max(fx.corpus.values(), key=len))
+    return lambda: split_html(html)
+
+
+@benchmark("test_sql.get_question_by_id")
+def bench_get_question_by_id(fx):
+    from bot.services.test_sql import get_question_by_id
+    ids = fx.question_ids
+    i = itertools.count()
+    return lambda: get_question_by_id(ids[next(i) % len(ids)])
+
+
+@benchmark("question_bank.question")
+def bench_question_bank(fx):
+    from bot.services.question_bank import QuestionBank
+    bank = QuestionBank(fx.tests_db)
+    bank.load()
+    ids = fx.question_ids
+    i = itertools.count()
+    return lambda: bank.question(ids[next(i) % len(ids)])
+
+
+@benchmark("answer_db.save_test_answer")
+def bench_save_test_answer(fx):
+    from bot.services.answer_db import save_test_answer
+    fx.answers_db
+    return lambda: save_test_answer(2, "bench", 5, 5001, "Вопрос", "24", "24", True)
+
+
+@benchmark("pdf_generator.make_report")
+def bench_make_report(fx):
+    from bot.services.pdf_generator import make_report
+    fx.answers_db
+    records = fx.sheet_records
+    path = os.path.join(fx.workdir, "report.pdf")
+    return lambda: make_report(1, "Ученик Бенчмарков", records, filename=path)
+
+
+@benchmark(f"gpt_service.split_audio[decode+export {AUDIO_SECONDS}s]")
+def bench_split_audio(fx):
+    from pydub import AudioSegment
+    from bot.services.gpt_service import split_audio
+    path = fx.voice_file
+    return lambda: split_audio(AudioSegment.from_file(path, format="ogg"))
+
+
+# ───────── Замер ─────────
+def _time(fn, loops: int) -> float:
+    gc_was_enabled = gc.isenabled()
+    gc.disable()  # как timeit: сборщик мусора не должен попадать в случайный раунд
+    try:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        return time.perf_counter() - start
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def measure(fn, rounds: int) -> dict:
+    fn()  # прогрев: импорты, кэши, первое подключение к базе
+    loops = 1
+    while True:
+        elapsed = _time(fn, loops)
+        if elapsed >= MIN_ROUND or loops >= 1_000_000:
+            break
+        loops *= 10 if elapsed < MIN_ROUND / 10 else 2
+    rounds = max(3, min(rounds, int(MAX_TIME / max(elapsed, 1e-9))))
+    samples = [_time(fn, loops) / loops for _ in range(rounds)]
+    median = statistics.median(samples)
+    return {
+        "min": min(samples),
+        "median": median,
+        "mean": statistics.fmean(samples),
+        "stddev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "rounds": rounds,
+        "loops": loops,
+        "ops": 1 / median if median else 0.0,
+    }
+
+
+def _fmt(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.3f} с"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.3f} мс"
+    return f"{seconds * 1e6:.2f} мкс"
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10,
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def compare(results: Dict[str, dict], baseline: dict, stat: str, threshold: float) -> List[str]:
+    """Печатает сравнение и возвращает имена бенчмарков, замедлившихся больше threshold %."""
+    old = baseline.get("benchmarks", {})
+    regressions = []
+    print()
+    print(f"Сравнение с {baseline.get('commit') or '?'} ({baseline.get('datetime', '?')}), {stat}, порог {threshold:.0f}%:")
+    for name, res in results.items():
+        if name not in old:
+            print(f"  {name:<50} {_fmt(res[stat]):>12}   новый")
+            continue
+        before, after = old[name][stat], res[stat]
+        change = (after - before) / before * 100 if before else 0.0
+        mark = ""
+        if change > threshold:
+            mark = "  ✗ регрессия"
+            regressions.append(name)
+        elif change < -threshold:
+            mark = "  ✓ быстрее"
+        print(f"  {name:<50} {_fmt(before):>12} → {_fmt(after):>12}  {change:+6.1f}%{mark}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Микро-бенчмарки горячих функций бота")
+    parser.add_argument("-k", dest="select", help="только бенчмарки, в имени которых есть эта строка")
+    parser.add_argument("--rounds", type=int, default=10, help="раундов на бенчмарк (не больше MAX_TIME секунд)")
+    parser.add_argument("--list", action="store_true", help="показать список бенчмарков")
+    parser.add_argument("--save", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="сравнить с сохранённым JSON (exit 1 при регрессии)")
+    parser.add_argument("--stat", choices=("min", "median", "mean"), default="median", help="что сравнивать")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="порог регрессии, %%")
+    args = parser.parse_args(argv)
+
+    selected = [(n, f) for n, f in BENCHMARKS if not args.select or args.select in n]
+    if args.list:
+        for name, _ in selected:
+            print(name)
+        return 0
+
+    # базы — во временной папке; пути читаются модулями бота при импорте
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    os.environ.update({
+        "TESTS_DB": os.path.join(workdir, "tests1.db"),
+        "ANSWERS_DB": os.path.join(workdir, "test_answers.db"),
+        "STATE_DB": os.path.join(workdir, "state.db"),
+        "TRACE_FILE": "",
+    })
+    fx = Fixtures(workdir)
+
+    results, failed = {}, []
+    print(f"{'бенчмарк':<50} {'median':>12} {'min':>12} {'± stddev':>12} {'раунды × вызовы':>16}")
+    for name, setup in selected:
+        try:
+            res = measure(setup(fx), args.rounds)
+        except Skip as e:
+            print(f"{name:<50} пропущен: {e}")
+            continue
+        except Exception as e:
+            print(f"{name:<50} ошибка: {type(e).__name__}: {e}")
+            failed.append(name)
+            continue
+        results[name] = res
+        print(
+            f"{name:<50} {_fmt(res['median']):>12} {_fmt(res['min']):>12} {_fmt(res['stddev']):>12}"
+            f" {res['rounds']:>8} × {res['loops']:<6}"
+        )
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({
+                "commit": _commit(),
+                "datetime": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpu": platform.processor()},
+                "benchmarks": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\nСохранено: {args.save}")
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.stat, args.threshold)
+        if regressions:
+            print(f"\nРегрессии ({len(regressions)}): {', '.join(regressions)}")
+    return 1 if regressions or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
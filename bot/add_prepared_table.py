@@ -1,18 +1,6 @@
-import sqlite3
+from bot.services.lecture_db import init_lectures_table
 
-DB_FILE = "prepared_lectures.db"
-
-with sqlite3.connect(DB_FILE) as conn:
-    c = conn.cursor()
-    # Создаём ТОЛЬКО новую таблицу, если её нет
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS prepared_lectures (
-            topic TEXT,
-            chunk_idx INTEGER,
-            orig_text TEXT,
-            lecture TEXT,
-            PRIMARY KEY (topic, chunk_idx)
-        )
-    """)
-    conn.commit()
+# Создаём ТОЛЬКО новую таблицу, если её нет (старым базам добавляется колонка orig_hash)
+init_lectures_table()
 print("Таблица prepared_lectures успешно добавлена! Старые данные сохранены.")
+print("Заполнить её лекциями: python -m bot.prepare_lectures")
@@ -0,0 +1,77 @@
+"""
+Рассылки ученикам. Отправляет сам запущенный бот (не быстрее BROADCAST_RPS
+в секунду, с продолжением после перезапуска), эта команда только создаёт
+рассылки и показывает их статус.
+
+Запуск из корня проекта (там же, где запускается бот):
+    python -m bot.broadcast create --audience unfinished:12 --text "Не забудь дорешать Тест 12!"
+    python -m bot.broadcast create --audience all --file announce.html --dry-run
+    python -m bot.broadcast list
+    python -m bot.broadcast cancel 3
+
+Аудитории: all, unfinished, unfinished:<тест>, answered:<тест>, inactive:<дней>
+(подробнее — bot/services/broadcast.py). Текст — HTML, как и остальные сообщения бота.
+"""
+import argparse
+import sys
+
+from bot.services.broadcast import (
+    BROADCAST_RPS, init_broadcast_tables, count_audience, create_broadcast, cancel_broadcast, get_broadcasts
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Рассылки ученикам")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    create = sub.add_parser("create", help="создать рассылку")
+    create.add_argument("--audience", required=True, help="all | unfinished[:тест] | answered:тест | inactive:дней")
+    text = create.add_mutually_exclusive_group(required=True)
+    text.add_argument("--text", help="текст сообщения")
+    text.add_argument("--file", help="файл с текстом сообщения")
+    create.add_argument("--dry-run", action="store_true", help="только посчитать получателей")
+
+    sub.add_parser("list", help="последние рассылки и их статус")
+
+    cancel = sub.add_parser("cancel", help="остановить рассылку")
+    cancel.add_argument("id", type=int)
+
+    args = parser.parse_args(argv)
+    init_broadcast_tables()
+
+    if args.cmd == "create":
+        message = args.text
+        if args.file:
+            with open(args.file, encoding="utf-8") as f:
+                message = f.read()
+        try:
+            total = count_audience(args.audience)
+        except ValueError as e:
+            parser.error(str(e))
+        minutes = total / BROADCAST_RPS / 60
+        if args.dry_run:
+            print(f"Получателей: {total} (≈ {minutes:.1f} мин)")
+            return 0
+        broadcast_id, total = create_broadcast(args.audience, message)
+        print(f"Рассылка #{broadcast_id} создана: {total} получателей, ≈ {minutes:.1f} мин. Отправит запущенный бот.")
+        return 0
+
+    if args.cmd == "list":
+        for b in get_broadcasts():
+            print(
+                f"#{b['id']} {b['created_at']} [{b['status']}] {b['audience']}: "
+                f"отправлено {b['sent'] or 0}/{b['total']}, заблокировали {b['blocked'] or 0}, "
+                f"ошибки {b['failed'] or 0}, в очереди {b['pending'] or 0}"
+            )
+        return 0
+
+    if args.cmd == "cancel":
+        if not cancel_broadcast(args.id):
+            print(f"Рассылка #{args.id} не найдена или уже завершена")
+            return 1
+        print(f"Рассылка #{args.id} отменена")
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
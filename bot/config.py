@@ -0,0 +1,25 @@
+# bot/config.py
+"""
+Настройки запуска бота (читаются из .env). Общие для polling и webhook:
+режим выбирается при деплое переменной RUN_MODE.
+"""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BOT_TOKEN = os.getenv("BOT_TOKEN")  # токен из .env
+
+# polling — один процесс с long polling (как раньше);
+# webhook — aiohttp-приложение, апдейты раздаются воркерам по user_id
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+
+# --- webhook ---
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")          # https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")              # X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 1)))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8100"))  # воркеры слушают 127.0.0.1:8100, 8101…
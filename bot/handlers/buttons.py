@@ -0,0 +1,104 @@
+# bot/handlers/buttons.py
+"""
+Кнопки reply-клавиатуры и команды — через таблицу вместо цепочки фильтров.
+
+Раньше каждый текст по очереди сравнивался с десятками
+`lambda m: m.text == "..."` во всех роутерах. Теперь такие обработчики
+регистрируются в ButtonRouter:
+
+    router = ButtonRouter()
+
+    @router.button("📝 Тесты")
+    @router.command("tests")
+    async def show_tests_types_menu(m: types.Message): ...
+
+install_buttons(dp) при старте собирает таблицы всех ButtonRouter в порядке
+include_router (первый зарегистрированный обработчик выигрывает, как и раньше)
+и вешает на диспетчер один обработчик: поиск нужного — один dict-lookup.
+Перекрытые обработчики (один текст в двух местах) пишутся в лог при старте.
+
+Кнопки срабатывают раньше обработчиков-«состояний» (ответ на тест, вопрос
+по курсу, свободный текст): нажатие кнопки меню — всегда навигация.
+"""
+import logging
+from typing import Any, Callable, Dict, Optional, Union
+
+from aiogram import Router, types
+from aiogram.dispatcher.event.handler import HandlerObject
+
+logger = logging.getLogger(__name__)
+
+
+def _handler_name(handler: HandlerObject) -> str:
+    callback = handler.callback
+    return f"{callback.__module__}.{callback.__qualname__}"
+
+
+def button_key(message: types.Message) -> Optional[str]:
+    """Ключ таблицы: текст кнопки или «/команда» (без @имя_бота и аргументов)."""
+    text = message.text
+    if not text:
+        return None
+    if text[0] == "/":
+        return text.split(maxsplit=1)[0].split("@", 1)[0]
+    return text
+
+
+class ButtonRouter(Router):
+    """Router с таблицей {текст кнопки / "/команда": обработчик}."""
+
+    def __init__(self, *, name: Optional[str] = None):
+        super().__init__(name=name)
+        self.buttons: Dict[str, HandlerObject] = {}
+
+    def _add(self, key: str, handler: HandlerObject):
+        if key in self.buttons:
+            logger.warning(
+                f"Кнопка «{key}»: {_handler_name(handler)} перекрыт "
+                f"{_handler_name(self.buttons[key])} в том же роутере"
+            )
+            return
+        self.buttons[key] = handler
+
+    def button(self, *texts: str, **flags: Any) -> Callable:
+        """Обработчик для кнопок с этими текстами (flags — как у router.message)."""
+        def decorator(callback: Callable) -> Callable:
+            handler = HandlerObject(callback=callback, flags=flags)
+            for text in texts:
+                self._add(text, handler)
+            return callback
+        return decorator
+
+    def command(self, *commands: str, **flags: Any) -> Callable:
+        """Обработчик для команд: router.command("start") ловит /start, /start@bot, /start payload."""
+        return self.button(*(f"/{c}" for c in commands), **flags)
+
+
+def install_buttons(dp: Router) -> Dict[str, HandlerObject]:
+    """
+    Собирает таблицы всех ButtonRouter под dp (в порядке подключения) и
+    регистрирует на dp один обработчик, который по таблице вызывает нужный.
+    Вызывать после всех include_router.
+    """
+    table: Dict[str, HandlerObject] = {}
+    for router in dp.chain_tail:
+        for key, handler in getattr(router, "buttons", {}).items():
+            winner = table.get(key)
+            if winner is None:
+                table[key] = handler
+            elif winner is not handler:
+                logger.warning(
+                    f"Кнопка «{key}»: {_handler_name(handler)} никогда не вызовется — "
+                    f"раньше подключён {_handler_name(winner)}"
+                )
+
+    async def match(message: types.Message) -> Union[bool, Dict[str, Any]]:
+        handler = table.get(button_key(message))
+        return {"button_handler": handler} if handler is not None else False
+
+    async def dispatch(message: types.Message, button_handler: HandlerObject, **kwargs: Any):
+        return await button_handler.call(message, **kwargs)
+
+    dp.message.register(dispatch, match)
+    logger.info(f"Кнопок и команд в таблице: {len(table)}")
+    return table
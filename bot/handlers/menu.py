@@ -1,14 +1,15 @@
-from aiogram import Router, types
+from aiogram import types
 from aiogram.types import (
-    ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+    ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 )
 from bot.utils import LEARNING_TOPICS, user_learning_state
-from bot.services.spreadsheet import fetch_user_records
-from bot.services.pdf_generator import make_report
+from bot.handlers.buttons import ButtonRouter
+from bot.handlers.report import send_report
+from bot.keyboards.keyboards import chapters_kb
 
 # если main_kb используется в других файлах — импортируй там: from bot.handlers.menu import main_kb
 
-router = Router()
+router = ButtonRouter()
 
 # Главное меню
 main_kb = types.ReplyKeyboardMarkup(
@@ -31,7 +32,8 @@ main_kb = types.ReplyKeyboardMarkup(
 )   # <-- Скобка!
 
 
-@router.message(lambda m: m.text == "/start" or m.text == "Меню")
+@router.command("start")
+@router.button("Меню")
 async def cmd_start(m: types.Message):
     await m.answer(
         "👋 Добро пожаловать! Я помогу тебе разобраться в органической химии.\n\n"
@@ -43,30 +45,21 @@ async def cmd_start(m: types.Message):
         reply_markup=main_kb
 )
 
-@router.message(lambda m: m.text == "🌱 Курс по органике")
+@router.button("🌱 Курс по органике")
 async def on_learning_start(m: types.Message):
     # Показываем список глав курса как inline-кнопки
-    buttons = [
-        [InlineKeyboardButton(text=topic, callback_data=f"learn_topic_{i}")]
-        for i, topic in enumerate(LEARNING_TOPICS)
-    ]
-    kb = InlineKeyboardMarkup(inline_keyboard=buttons)
     await m.answer(
         "🌱 Добро пожаловать на курс по органической химии!\n\n"
         "Здесь ты можешь проходить главы, изучать теорию и выполнять задания.\n"
         "Чтобы начать — выбери тему из списка ниже.",
-        reply_markup=kb
+        reply_markup=chapters_kb()
     )
 
-@router.message(lambda m: m.text == "📈 Получить отчёт")
+@router.button("📈 Получить отчёт")
 async def get_report(m: types.Message):
-    records = fetch_user_records(m.from_user.id)
-    if not records:
-        return await m.answer("Ты ещё не сдал ни одной темы.")
-    pdf_path = make_report(m.from_user.id, m.from_user.full_name, records)
-    await m.answer_document(FSInputFile(pdf_path), caption="Вот твой PDF-отчёт!")
+    await send_report(m, caption="Вот твой PDF-отчёт!")
 
-@router.message(lambda m: m.text == "ℹ️ Как работает бот")
+@router.button("ℹ️ Как работает бот")
 async def how_bot_works(m: types.Message):
     await m.answer(
         "ℹ️ Я — учебный бот по органической химии:\n"
@@ -77,7 +70,7 @@ async def how_bot_works(m: types.Message):
         "Можно возвращаться в меню через кнопку Меню."
     )
 
-@router.message(lambda m: m.text == "▶️ Продолжить")
+@router.button("▶️ Продолжить")
 async def resume_course(m: types.Message):
     # Проверяем, есть ли сохранённое состояние курса для пользователя
     state = user_learning_state.get(m.from_user.id)
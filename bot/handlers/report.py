@@ -1,17 +1,60 @@
-from aiogram import Router, types
+import os
+import asyncio
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import FSInputFile
-from aiogram.filters import Command
 
 from bot.services.spreadsheet import fetch_user_records
 from bot.services.pdf_generator import make_report
+from bot.services.jobs import Job, job_queue
+from bot.services.single_flight import flights
+from bot.handlers.buttons import ButtonRouter
 
-router = Router()
+router = ButtonRouter()
 
-@router.message(lambda m: m.text == "📄 Получить отчёт")
-@router.message(Command("report"))
-async def btn_report(m: types.Message):
-    records = fetch_user_records(m.from_user.id)
+BUILDING = "⏳ Собираю отчёт…"
+
+# pyplot не потокобезопасен: графики отчётов рисуются по одному
+_render_lock = asyncio.Lock()
+
+async def send_report(m: types.Message, caption: str = None):
+    """
+    Отчёт собирается фоновым заданием (таблица + PDF), ученик сразу видит «Собираю».
+    Повторные нажатия, пока отчёт собирается, ничего не запускают: придёт тот же PDF.
+    """
+    await flights.do(("report", m.from_user.id), lambda: _enqueue_report(m, caption, f"report:{m.from_user.id}"))
+
+async def _enqueue_report(m: types.Message, caption: str, key: str):
+    if await job_queue.active(key):
+        flights.deduped["report"] += 1
+        return
+    ack = await m.answer(BUILDING)
+    await job_queue.enqueue("report", m.from_user.id, m.chat.id, {
+        "message_id": ack.message_id,
+        "full_name": m.from_user.full_name,
+        "caption": caption,
+    }, dedupe_key=key)
+
+@job_queue.job("report", failed="😔 Не получилось собрать отчёт, попробуй позже.")
+async def report_job(bot, job: Job):
+    ack = job.message(bot, text=BUILDING)
+    records = await asyncio.to_thread(fetch_user_records, job.user_id)
     if not records:
-        return await m.answer("Ты ещё не сдал ни одной темы.")
-    pdf_path = make_report(m.from_user.id, m.from_user.full_name, records)
-    await m.answer_document(FSInputFile(pdf_path))
+        await ack.edit_text("Ты ещё не сдал ни одной темы.")
+        return
+    pdf_path = f"report_{job.user_id}_{job.id}.pdf"
+    async with _render_lock:
+        await asyncio.to_thread(make_report, job.user_id, job.payload["full_name"], records, pdf_path)
+    try:
+        await bot.send_document(job.chat_id, FSInputFile(pdf_path), caption=job.payload["caption"])
+    finally:
+        os.remove(pdf_path)
+    try:
+        await ack.delete()
+    except TelegramBadRequest:
+        pass
+
+@router.button("📄 Получить отчёт")
+@router.command("report")
+async def btn_report(m: types.Message):
+    await send_report(m)
@@ -1,6 +1,5 @@
-from aiogram import Router, types
+from aiogram import types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from aiogram.filters import Command
 import html  # Стандартная библиотека для экранирования HTML
 
 # --- Импортируем все функции работы с базой ---
@@ -14,50 +13,47 @@ from bot.services.answer_db import (
     log_question_started,
     log_question_answered
 )
-from bot.services.test_sql import get_all_tests_types, get_questions_by_type, get_question_by_id
+from bot.services.db_writer import db_writer  # записи в базу ответов — в фоне
+from bot.services.question_bank import question_bank
+from bot.keyboards.keyboards import (
+    tests_types_kb as get_tests_types_kb, stop_test_kb as get_stop_test_kb, question_card,
+    TEST_FOOTER, MISTAKE_FOOTER
+)
+from bot.services.state_store import StateDict
 
 from bot.handlers.menu import main_kb  # Импорт клавиатуры главного меню
+from bot.utils import SESSION_MAXSIZE
+from bot.handlers.buttons import ButtonRouter
 
-router = Router()
-user_test_state = {}
+router = ButtonRouter()
+TEST_SESSION_TTL = 24 * 3600  # брошенный тест через сутки уходит в test_progress
 
-# =========================
-# 1. Клавиатура для выбора тестов
-# =========================
-def get_tests_types_kb(with_menu=False):
-    types = get_all_tests_types()
-    keyboard = [
-        [InlineKeyboardButton(text=f"Тест {t}", callback_data=f"choose_test_{t}")]
-        for t in types if t not in (None, '')
-    ]
-    # --- Кнопка "Работа над ошибками"
-    keyboard.append([InlineKeyboardButton(text="💡 Работа над ошибками", callback_data="work_on_mistakes")])
-    if with_menu:
-        keyboard.append([InlineKeyboardButton(text="⬅️ В главное меню", callback_data="to_main_menu")])
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+def _spill_test_session(user_id, state):
+    """
+    Сессия теста вытеснена из памяти — сохраняем прогресс, чтобы потом
+    можно было нажать «▶️ Продолжить». Работа над ошибками не сохраняется.
+    """
+    if "q_ids" in state:
+        db_writer.submit(save_test_progress, user_id, state["type"], state["idx"], state["q_ids"])
+
+
+user_test_state = StateDict(
+    "tests", ttl=TEST_SESSION_TTL, maxsize=SESSION_MAXSIZE, on_evict=_spill_test_session
+)
 
 # =========================
-# 2. Клавиатура для вопроса теста: Подсказка и Стоп тест
+# 1-2. Клавиатуры выбора теста и под вопросом — готовые, из bot/keyboards/keyboards.py
 # =========================
-def get_stop_test_kb(q_id):
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="💡 Подсказка", callback_data=f"hint_{q_id}")],
-            [InlineKeyboardButton(text="⏹️ Стоп тест", callback_data="stop_test")]
-        ]
-    )
 
 # =========================
 # 3. Показываем меню тестов
 # =========================
-@router.message(lambda m: m.text == "📝 Тесты")
+@router.button("📝 Тесты")
+@router.command("tests")
 async def show_tests_types_menu(m: types.Message):
     await m.answer("Выбери номер теста:", reply_markup=get_tests_types_kb())
 
-@router.message(Command("tests"))
-async def show_tests_menu_cmd(m: types.Message):
-    await show_tests_types_menu(m)
-
 # =========================
 # 4. Начать тест (по callback-кнопке) с проверкой прогресса
 # =========================
@@ -69,6 +65,7 @@ async def start_test(cb: CallbackQuery):
         await cb.answer("Ошибка: неверный номер теста.")
         return
 
+    await db_writer.flush()
     idx, q_ids = load_test_progress(cb.from_user.id, test_type)
     if idx is not None and q_ids:
         kb = InlineKeyboardMarkup(
@@ -85,17 +82,17 @@ async def start_test(cb: CallbackQuery):
         return
 
     # --- Если прогресса нет — стандартное поведение ---
-    questions = get_questions_by_type(test_type)
-    if not questions:
+    q_ids = question_bank.question_ids(test_type)
+    if not q_ids:
         await cb.message.answer("Нет вопросов для этого теста.")
         await cb.answer()
         return
     user_test_state[cb.from_user.id] = {
         "type": test_type,
         "idx": 0,
-        "q_ids": [q["id"] for q in questions]
+        "q_ids": q_ids
     }
-    clear_test_progress(cb.from_user.id, test_type)
+    db_writer.submit(clear_test_progress, cb.from_user.id, test_type)
     await send_next_test_question(cb.from_user.id, cb.message, is_callback=True)
     await cb.answer()
 
@@ -103,6 +100,7 @@ async def start_test(cb: CallbackQuery):
 @router.callback_query(lambda c: c.data.startswith("continue_test_"))
 async def continue_test(cb: CallbackQuery):
     test_type = int(cb.data.split("_")[-1])
+    await db_writer.flush()
     idx, q_ids = load_test_progress(cb.from_user.id, test_type)
     if idx is not None and q_ids:
         user_test_state[cb.from_user.id] = {
@@ -119,17 +117,17 @@ async def continue_test(cb: CallbackQuery):
 @router.callback_query(lambda c: c.data.startswith("restart_test_"))
 async def restart_test(cb: CallbackQuery):
     test_type = int(cb.data.split("_")[-1])
-    questions = get_questions_by_type(test_type)
-    if not questions:
+    q_ids = question_bank.question_ids(test_type)
+    if not q_ids:
         await cb.message.answer("Нет вопросов для этого теста.")
         await cb.answer()
         return
     user_test_state[cb.from_user.id] = {
         "type": test_type,
         "idx": 0,
-        "q_ids": [q["id"] for q in questions]
+        "q_ids": q_ids
     }
-    clear_test_progress(cb.from_user.id, test_type)
+    db_writer.submit(clear_test_progress, cb.from_user.id, test_type)
     await send_next_test_question(cb.from_user.id, cb.message, is_callback=True)
     await cb.answer()
 
@@ -144,19 +142,14 @@ async def send_next_test_question(user_id, message_obj, is_callback=False):
     q_ids = state["q_ids"]
     if idx >= len(q_ids):
         user_test_state.pop(user_id, None)
+        # тест пройден — сохранённый прогресс (если продолжали после «Стоп») больше не нужен
+        db_writer.submit(clear_test_progress, user_id, state["type"])
         await message_obj.answer("Тест завершён! Возвращаюсь в меню.")
         return
-    q = get_question_by_id(q_ids[idx])
-    log_question_started(user_id, state["type"], q["id"])  # --- ЛОГИРОВАНИЕ СТАРТА ---
-    options = q['options'].split('\n')
-    msg = (
-        f"Вопрос {idx+1} из {len(q_ids)} (Тест {state['type']})\n\n"
-        f"{q['question']}\n\n" +
-        "\n".join([f"{i+1}. {opt}" for i, opt in enumerate(options)]) +
-        "\n\nВведите номер(а) ответа (например: 2 или 13):"
-    )
-    kb = get_stop_test_kb(q['id'])
-    await message_obj.answer(msg, reply_markup=kb)
+    q_id = q_ids[idx]
+    db_writer.submit(log_question_started, user_id, state["type"], q_id)  # --- ЛОГИРОВАНИЕ СТАРТА ---
+    msg = f"Вопрос {idx+1} из {len(q_ids)} (Тест {state['type']})\n\n" + question_card(q_id)
+    await message_obj.answer(msg, reply_markup=get_stop_test_kb(q_id))
 
 # =========================
 # 6. Обработчик: Стоп тест (универсально для обоих режимов)
@@ -171,7 +164,7 @@ async def stop_test(cb: CallbackQuery):
             reply_markup=get_tests_types_kb(with_menu=True)
         )
     elif state:
-        save_test_progress(cb.from_user.id, state["type"], state["idx"], state["q_ids"])
+        db_writer.submit(save_test_progress, cb.from_user.id, state["type"], state["idx"], state["q_ids"])
         await cb.message.answer(
             "Тест прерван! Выбери тест для прохождения:",
             reply_markup=get_tests_types_kb(with_menu=True)
@@ -197,7 +190,7 @@ async def to_main_menu(cb: CallbackQuery):
 @router.callback_query(lambda c: c.data.startswith("hint_"))
 async def show_hint(cb: CallbackQuery):
     q_id = int(cb.data.split("_")[-1])
-    q = get_question_by_id(q_id)
+    q = question_bank.question(q_id)
     hint = q.get('hint', '')
     if hint and hint.strip():
         await cb.message.answer(html.escape(f"💡 Подсказка:\n{hint}"), parse_mode="HTML")
@@ -213,13 +206,14 @@ async def check_test_answer(m: types.Message):
     state = user_test_state.get(m.from_user.id)
     idx = state["idx"]
     q_ids = state["q_ids"]
-    q = get_question_by_id(q_ids[idx])
+    q = question_bank.question(q_ids[idx])
     user_answer = ''.join(filter(str.isdigit, m.text))
     correct = ''.join(filter(str.isdigit, str(q.get("correct_answer", ""))))
     is_correct = user_answer == correct
-    log_question_answered(m.from_user.id, q["id"], m.text, is_correct)  # --- ЛОГИРОВАНИЕ ОТВЕТА ---
+    db_writer.submit(log_question_answered, m.from_user.id, q["id"], m.text, is_correct)  # --- ЛОГИРОВАНИЕ ОТВЕТА ---
 
-    save_test_answer(
+    db_writer.submit(
+        save_test_answer,
         m.from_user.id,
         getattr(m.from_user, "username", None) or m.from_user.full_name,
         state["type"],
@@ -249,6 +243,7 @@ async def check_test_answer(m: types.Message):
 @router.callback_query(lambda c: c.data == "work_on_mistakes")
 async def work_on_mistakes_menu(cb: CallbackQuery):
     user_id = cb.from_user.id
+    await db_writer.flush()
     mistakes = get_mistake_questions(user_id)
     if not mistakes:
         await cb.message.answer("У тебя нет ошибок для исправления! Молодец!")
@@ -271,6 +266,7 @@ async def work_on_mistakes_menu(cb: CallbackQuery):
 async def start_mistake_test(cb: CallbackQuery):
     test_type = int(cb.data.split("_")[-1])
     user_id = cb.from_user.id
+    await db_writer.flush()
     mistakes = [row for row in get_mistake_questions(user_id) if row[0] == test_type]
     if not mistakes:
         await cb.message.answer("Нет ошибок в этом тесте.")
@@ -294,17 +290,9 @@ async def send_next_mistake_question(user_id, message_obj):
         await message_obj.answer("Все ошибки в этом тесте исправлены! 👍")
         return
     q_id = q_ids[idx]
-    q = get_question_by_id(q_id)
-    log_question_started(user_id, state["type"], q_id)  # --- ЛОГИРОВАНИЕ СТАРТА ---
-    options = q['options'].split('\n')
-    msg = (
-        f"Ошибка {idx+1} из {len(q_ids)} (Тест {state['type']})\n\n"
-        f"{q['question']}\n\n" +
-        "\n".join([f"{i+1}. {opt}" for i, opt in enumerate(options)]) +
-        "\n\nПовтори попытку: введи номер(а) ответа:"
-    )
-    kb = get_stop_test_kb(q_id)
-    await message_obj.answer(msg, reply_markup=kb)
+    db_writer.submit(log_question_started, user_id, state["type"], q_id)  # --- ЛОГИРОВАНИЕ СТАРТА ---
+    msg = f"Ошибка {idx+1} из {len(q_ids)} (Тест {state['type']})\n\n" + question_card(q_id, MISTAKE_FOOTER)
+    await message_obj.answer(msg, reply_markup=get_stop_test_kb(q_id))
 
 # --- Проверка ответа пользователя на ошибочный вопрос ---
 @router.message(lambda m: m.from_user.id in user_test_state and "mistake_q_ids" in user_test_state[m.from_user.id])
@@ -313,17 +301,17 @@ async def check_mistake_answer(m: types.Message):
     idx = state["idx"]
     q_ids = state["mistake_q_ids"]
     q_id = q_ids[idx]
-    q = get_question_by_id(q_id)
+    q = question_bank.question(q_id)
     user_answer = ''.join(filter(str.isdigit, m.text))
     correct = ''.join(filter(str.isdigit, str(q.get("correct_answer", ""))))
     if user_answer == correct:
         resp = "✅ Теперь верно! Ошибка исправлена."
-        set_answer_correct(m.from_user.id, q_id)
-        log_question_answered(m.from_user.id, q_id, m.text, True)  # --- ЛОГИРОВАНИЕ ОТВЕТА ---
+        db_writer.submit(set_answer_correct, m.from_user.id, q_id)
+        db_writer.submit(log_question_answered, m.from_user.id, q_id, m.text, True)  # --- ЛОГИРОВАНИЕ ОТВЕТА ---
         user_test_state[m.from_user.id]["idx"] += 1
     else:
         resp = f"❌ Пока неверно. Попробуй ещё раз!"
-        log_question_answered(m.from_user.id, q_id, m.text, False)  # --- ЛОГИРОВАНИЕ ОТВЕТА ---
+        db_writer.submit(log_question_answered, m.from_user.id, q_id, m.text, False)  # --- ЛОГИРОВАНИЕ ОТВЕТА ---
     await m.answer(resp)
     await send_next_mistake_question(m.from_user.id, m)
 
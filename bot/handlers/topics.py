@@ -1,6 +1,7 @@
 import os
-import sqlite3
-from aiogram import Router, types
+import asyncio
+import html
+from aiogram import types
 from aiogram.types import (
     ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove,
     InlineKeyboardMarkup, InlineKeyboardButton
@@ -9,27 +10,29 @@ from aiogram.enums import ParseMode
 from bot.handlers.menu import main_kb
 from bot.utils import (
     ALL_TOPICS, clean_html, user_topics, LEARNING_TOPICS,
-    user_learning_state, TEXTBOOK_CONTENT, latex_to_codeblock
+    user_learning_state, TEXTBOOK_CONTENT
 )
 from bot.services.gpt_service import (
-    classify_topic, analyze_answer, transcribe_audio,
-    teach_material, answer_student_question
+    classify_topic, analyze_answer_stream, transcribe_audio,
+    teach_material, answer_student_question_stream
 )
+from bot.services.streaming import stream_into, stream_reply
+from bot.services.outbound import editable
+from bot.services.tracing import span
 from bot.services.spreadsheet import save_answer
+from bot.services.retrieval import retrieve_context
+from bot.services.lecture_store import lecture_store
+from bot.services.jobs import Job, job_queue
+from bot.services.single_flight import flights
+from bot.handlers.buttons import ButtonRouter
+from bot.keyboards.keyboards import chapters_kb
 
-router = Router()
+router = ButtonRouter()
 
-# --- ДОБАВЛЕНА ФУНКЦИЯ ДЛЯ БЫСТРОГО ПОЛУЧЕНИЯ ЛЕКЦИИ ИЗ БАЗЫ ---
-def get_prepared_lecture(topic, idx):
-    """
-    Получает готовую лекцию из базы по теме и номеру chunk'а.
-    Возвращает текст лекции, либо None если не найдено.
-    """
-    with sqlite3.connect("prepared_lectures.db") as conn:
-        c = conn.cursor()
-        c.execute("SELECT lecture FROM prepared_lectures WHERE topic=? AND chunk_idx=?", (topic, idx))
-        row = c.fetchone()
-        return row[0] if row else None
+CHECKING = "⏳ Проверяю ответ…"
+LISTENING = "⏳ Слушаю вопрос…"
+DEFERRED = "⏳ Сервис проверки сейчас перегружен — пришлю комментарий, как только он ответит."
+NAV_WINDOW = 1.0   # секунд: повторные «👍 Понятно» / «◀️ Назад» в этом окне — одно нажатие
 
 # --- Клавиатуры для обычных тем ---
 topics_kb = ReplyKeyboardMarkup(
@@ -57,11 +60,11 @@ choose_chapter_kb = ReplyKeyboardMarkup(
 )
 
 # === 1. Обычные темы ===
-@router.message(lambda m: m.text == "🧪 Устный зачет")
+@router.button("🧪 Устный зачет")
 async def show_topics(m: types.Message):
     await m.answer("Выберите тему по органической химии:", reply_markup=topics_kb)
 
-@router.message(lambda m: m.text in ALL_TOPICS)
+@router.button(*ALL_TOPICS)
 async def ask_questions(m: types.Message):
     user_topics[m.from_user.id] = m.text
     questions = (
@@ -72,31 +75,16 @@ async def ask_questions(m: types.Message):
     await m.answer(questions, reply_markup=after_topic_kb)
     await m.answer("Запишите голосовой ответ на эти вопросы:")
 
-@router.message(lambda m: m.text == "⬅️ К темам")
+@router.button("⬅️ К темам")
 async def back_to_topics(m: types.Message):
     await m.answer("Выберите тему по органической химии:", reply_markup=topics_kb)
 
-@router.message(lambda m: m.text == "⬅️ В меню")
+@router.button("⬅️ В меню")
 async def back_to_menu(m: types.Message):
     await m.answer("Главное меню:", reply_markup=main_kb)
 
 # === 2. Курс по органике ===
-
-@router.message(lambda m: m.text == "🌱 Курс по органике")
-async def on_learning_start(m: types.Message):
-    buttons = [
-        [InlineKeyboardButton(text=topic, callback_data=f"learn_topic_{i}")]
-        for i, topic in enumerate(LEARNING_TOPICS)
-    ]
-    kb = InlineKeyboardMarkup(inline_keyboard=buttons)
-    await m.answer(
-        "Выберите главу для курса по органике:",
-        reply_markup=kb
-    )
-    await m.answer(
-        "Можешь в любой момент вернуться в меню:",
-        reply_markup=choose_chapter_kb
-    )
+# (кнопка «🌱 Курс по органике» и «▶️ Продолжить» — в menu.py)
 
 @router.callback_query(lambda c: c.data.startswith("learn_topic_"))
 async def on_topic_chosen(cb: types.CallbackQuery, bot):
@@ -109,7 +97,7 @@ async def on_topic_chosen(cb: types.CallbackQuery, bot):
 async def send_next_chunk(user_id: int, bot):
     """
     Показывает следующий chunk теории пользователю.
-    Теперь лекция берётся из базы (а не генерируется каждый раз через GPT)!
+    Лекция берётся из кэша готовых лекций (а не генерируется каждый раз через GPT)!
     """
     st = user_learning_state.get(user_id)
     if not st:
@@ -134,12 +122,11 @@ async def send_next_chunk(user_id: int, bot):
     # --- БЫЛО ---
     # raw = await teach_material(chunks[idx])
     # --- СТАЛО ---
-    raw = get_prepared_lecture(topic, idx)
-    if not raw:
+    formatted = lecture_store.get(topic, idx)
+    if not formatted:
         await bot.send_message(user_id, "Лекция пока не подготовлена. Обратитесь к администратору.")
         return
 
-    formatted = latex_to_codeblock(raw)
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(text="◀️ Назад", callback_data="learn_back"),
@@ -158,24 +145,39 @@ async def send_next_chunk(user_id: int, bot):
         parse_mode=ParseMode.MARKDOWN
     )
 
+async def coalesced(cb: types.CallbackQuery, step):
+    """
+    Нажатие кнопки листания: повторы в окне NAV_WINDOW отбрасываются, а пока
+    порция отправляется — ждут её (index сдвигается один раз, порции не путаются).
+    """
+    key = (cb.data, cb.from_user.id)
+    if not flights.coalesce(key, NAV_WINDOW):
+        await cb.answer()
+        return
+    await flights.do(key, step)
+
 @router.callback_query(lambda c: c.data == "learn_ok")
 async def on_learning_ok(cb: types.CallbackQuery, bot):
-    st = user_learning_state.get(cb.from_user.id)
-    if not st:
-        return
-    st["index"] += 1
-    await send_next_chunk(cb.from_user.id, bot)
+    async def step():
+        st = user_learning_state.get(cb.from_user.id)
+        if not st:
+            return
+        st["index"] += 1
+        await send_next_chunk(cb.from_user.id, bot)
+    await coalesced(cb, step)
 
 @router.callback_query(lambda c: c.data == "learn_back")
 async def on_learning_back(cb: types.CallbackQuery, bot):
-    st = user_learning_state.get(cb.from_user.id)
-    if not st:
-        return
-    if st["index"] == 0:
-        await cb.answer("Вы на первой порции.", show_alert=True)
-    else:
-        st["index"] -= 1
-        await send_next_chunk(cb.from_user.id, bot)
+    async def step():
+        st = user_learning_state.get(cb.from_user.id)
+        if not st:
+            return
+        if st["index"] == 0:
+            await cb.answer("Вы на первой порции.", show_alert=True)
+        else:
+            st["index"] -= 1
+            await send_next_chunk(cb.from_user.id, bot)
+    await coalesced(cb, step)
 
 @router.callback_query(lambda c: c.data == "learn_ask")
 async def on_learning_ask(cb: types.CallbackQuery, bot):
@@ -196,37 +198,69 @@ async def on_learning_stop(cb: types.CallbackQuery, bot):
 
 @router.callback_query(lambda c: c.data == "learn_to_chapters")
 async def to_chapters(cb: types.CallbackQuery, bot):
-    buttons = [
-        [InlineKeyboardButton(text=topic, callback_data=f"learn_topic_{i}")]
-        for i, topic in enumerate(LEARNING_TOPICS)
-    ]
-    kb = InlineKeyboardMarkup(inline_keyboard=buttons)
     user_learning_state.pop(cb.from_user.id, None)
-    await bot.send_message(cb.from_user.id, "Выберите главу для курса по органике:", reply_markup=kb)
+    await bot.send_message(cb.from_user.id, "Выберите главу для курса по органике:", reply_markup=chapters_kb())
     await bot.send_message(cb.from_user.id, "Можешь в любой момент вернуться в меню:", reply_markup=choose_chapter_kb)
 
 
 # === Работа с голосом и текстом для любого режима ===
-@router.message(lambda m: m.voice is not None)
+# Проверка ответа занимает десятки секунд (Whisper + GPT + таблица), поэтому
+# хендлер только отвечает «⏳ Проверяю ответ…» и ставит фоновое задание
+# (bot/services/jobs.py), а результат дописывается в это же сообщение.
+# Задание может повториться после сбоя, поэтому распознанный текст, комментарий
+# GPT, запись в таблицу и сдвиг порции отмечаются через job.checkpoint —
+# повтор не платит за них второй раз и не листает курс дважды.
+# Флаг quota — дневные лимиты и частота запросов ученика (bot/services/quotas.py).
+@router.message(lambda m: m.voice is not None, flags={"quota": "voice"})
 async def on_voice(m: types.Message, bot):
-    file = await bot.get_file(m.voice.file_id)
-    path = f"audio_{m.from_user.id}.ogg"
-    await bot.download_file(file.file_path, path)
-    try:
-        txt = await transcribe_audio(path)
-        st = user_learning_state.get(m.from_user.id)
-        if st and st.get("awaiting_question"):
-            answer = await answer_student_question(st["topic"], txt.strip())
-            st["awaiting_question"] = False
-            st["index"] += 1
-            await m.answer(answer)
-            await send_next_chunk(m.from_user.id, bot)
+    uid = m.from_user.id
+    st = user_learning_state.get(uid)
+    question = bool(st and st.get("awaiting_question"))
+    with editable():
+        if question:
+            ack = await m.answer(LISTENING)
         else:
-            await process_answer(m, txt.strip())
-    finally:
-        os.remove(path)
+            ack = await m.answer(CHECKING, reply_markup=main_kb)
+    await job_queue.enqueue("voice", uid, m.chat.id, {
+        "file_id": m.voice.file_id,
+        "duration": m.voice.duration,
+        "size": m.voice.file_size,
+        "message_id": ack.message_id,
+        "full_name": m.from_user.full_name,
+        "question": question,
+        "topic": st["topic"] if question else user_topics.pop(uid, None),
+    })
+
+@job_queue.job("voice", failed="😔 Не получилось разобрать голосовое, запиши ответ ещё раз.", deferred=DEFERRED)
+async def voice_job(bot, job: Job):
+    p = job.payload
+    if "transcript" not in p:
+        path = f"audio_{job.user_id}_{job.id}.ogg"
+        with span("voice.download", seconds=p["duration"], size=p["size"]):
+            file = await bot.get_file(p["file_id"])
+            await bot.download_file(file.file_path, path)
+        try:
+            txt = (await transcribe_audio(path)).strip()
+        finally:
+            os.remove(path)
+        await job.checkpoint(transcript=txt)
+    txt = p["transcript"]
+    if not p["question"]:
+        await grade_answer(bot, job, txt)
+        return
+    if not p.get("answered"):
+        await stream_into(job.message(bot, text=LISTENING), answer_student_question_stream(p["topic"], txt, job.user_id))
+        await job.checkpoint(answered=True)
+    st = user_learning_state.get(job.user_id)
+    if not st:
+        return
+    if not p.get("advanced"):
+        st["awaiting_question"] = False
+        st["index"] += 1
+        await job.checkpoint(advanced=True)
+    await send_next_chunk(job.user_id, bot)
 
-@router.message(lambda m: m.text and not m.text.startswith("/"))
+@router.message(lambda m: m.text and not m.text.startswith("/"), flags={"quota": "gpt"})
 async def on_text(m: types.Message, bot):
     st = user_learning_state.get(m.from_user.id)
     if st and st.get("awaiting_question"):
@@ -236,36 +270,48 @@ async def on_text(m: types.Message, bot):
 
 async def process_answer(m: types.Message, transcript: str):
     uid = m.from_user.id
-    topic = user_topics.pop(uid, None) or await classify_topic(transcript)
-    ctx = "\n\n".join(TEXTBOOK_CONTENT.get(topic, [])[:3])
-    feedback = await analyze_answer(transcript, topic, ctx)
-    clean = clean_html(feedback)
-    save_answer(uid, m.from_user.full_name, topic, transcript, clean)
-    from bot.handlers.menu import main_kb
-    await m.answer(
-        f"📘 Тема: <b>{topic}</b>\n"
-        f"📝 Ответ: {transcript}\n\n"
-        f"💬 Комментарий:\n{clean}",
-        reply_markup=main_kb
-    )
+    with editable():
+        ack = await m.answer(CHECKING, reply_markup=main_kb)
+    await job_queue.enqueue("answer", uid, m.chat.id, {
+        "transcript": transcript,
+        "message_id": ack.message_id,
+        "full_name": m.from_user.full_name,
+        "topic": user_topics.pop(uid, None),
+    })
+
+@job_queue.job("answer", failed="😔 Не получилось проверить ответ, отправь его ещё раз.", deferred=DEFERRED)
+async def answer_job(bot, job: Job):
+    await grade_answer(bot, job, job.payload["transcript"])
 
-@router.message(lambda m: m.text and m.from_user.id in user_learning_state and user_learning_state[m.from_user.id].get("awaiting_question"))
+async def grade_answer(bot, job: Job, transcript: str):
+    """Комментарий GPT дописывается в «⏳ Проверяю ответ…» по мере генерации, ответ — в таблицу."""
+    uid = job.user_id
+    p = job.payload
+    if not p["topic"]:
+        await job.checkpoint(topic=await classify_topic(transcript, uid))
+    topic = p["topic"]
+    if "feedback" not in p:
+        with span("retrieval.retrieve_context", topic=topic):
+            ctx = retrieve_context(transcript, topic)
+        feedback = await stream_into(
+            job.message(bot, text=CHECKING),
+            analyze_answer_stream(transcript, topic, ctx, uid),
+            header=(
+                f"📘 Тема: <b>{html.escape(topic)}</b>\n"
+                f"📝 Ответ: {html.escape(transcript)}\n\n"
+                f"💬 Комментарий:\n"
+            ),
+        )
+        await job.checkpoint(feedback=clean_html(feedback))
+    if not p.get("saved"):
+        await asyncio.to_thread(save_answer, uid, p["full_name"], topic, transcript, p["feedback"])
+        await job.checkpoint(saved=True)
+
+@router.message(lambda m: m.text and m.from_user.id in user_learning_state and user_learning_state[m.from_user.id].get("awaiting_question"), flags={"quota": "gpt"})
 async def on_student_question(m: types.Message, bot):
     st = user_learning_state[m.from_user.id]
     topic = st["topic"]
-    answer = await answer_student_question(topic, m.text.strip())
+    await stream_reply(bot, m.chat.id, answer_student_question_stream(topic, m.text.strip(), m.from_user.id))
     st["awaiting_question"] = False
     st["index"] += 1
-    await m.answer(answer)
     await send_next_chunk(m.from_user.id, bot)
-
-@router.message(lambda m: m.text == "▶️ Продолжить")
-async def resume_course(m: types.Message):
-    # Проверяем, есть ли сохранённое состояние курса для пользователя
-    state = user_learning_state.get(m.from_user.id)
-    if not state:
-        await m.answer("Ты ещё не начинал курс. Выбери 'Курс по органике' для старта.", reply_markup=main_kb)
-        return
-    # Если состояние есть — показываем следующий chunk
-    from bot.handlers.topics import send_next_chunk  # импорт функции показа следующей порции
-    await send_next_chunk(m.from_user.id, m.bot)
\ No newline at end of file
@@ -0,0 +1,94 @@
+# bot/keyboards/keyboards.py
+"""
+Готовые клавиатуры и карточки вопросов.
+
+Всё здесь неизменяемое: меню тестов, клавиатура под вопросом, список глав
+курса, текст вопроса с вариантами. Поэтому каждый объект собирается один
+раз и дальше берётся из кэша. Кэш сбрасывается целиком, когда меняется
+банк вопросов (question_bank.version) или набор глав учебника.
+"""
+from typing import Any, Callable, Dict, Hashable
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from bot.utils import LEARNING_TOPICS
+from bot.services.question_bank import question_bank
+
+TEST_FOOTER = "\n\nВведите номер(а) ответа (например: 2 или 13):"
+MISTAKE_FOOTER = "\n\nПовтори попытку: введи номер(а) ответа:"
+
+_cache: Dict[Hashable, Any] = {}
+_cache_version = None
+
+
+def _cached(key: Hashable, build: Callable[[], Any]) -> Any:
+    global _cache_version
+    version = (question_bank.version, tuple(LEARNING_TOPICS))
+    if version != _cache_version:
+        _cache.clear()
+        _cache_version = version
+    value = _cache.get(key)
+    if value is None:
+        value = _cache[key] = build()
+    return value
+
+
+def invalidate():
+    """Сбросить все готовые клавиатуры и карточки."""
+    global _cache_version
+    _cache.clear()
+    _cache_version = None
+
+
+# =========================
+# Тесты
+# =========================
+def tests_types_kb(with_menu=False) -> InlineKeyboardMarkup:
+    """Меню выбора теста (+ «Работа над ошибками», по желанию «В главное меню»)."""
+    def build():
+        keyboard = [
+            [InlineKeyboardButton(text=f"Тест {t}", callback_data=f"choose_test_{t}")]
+            for t in question_bank.types()
+        ]
+        keyboard.append([InlineKeyboardButton(text="💡 Работа над ошибками", callback_data="work_on_mistakes")])
+        if with_menu:
+            keyboard.append([InlineKeyboardButton(text="⬅️ В главное меню", callback_data="to_main_menu")])
+        return InlineKeyboardMarkup(inline_keyboard=keyboard)
+    return _cached(("tests_types", with_menu), build)
+
+
+def stop_test_kb(q_id) -> InlineKeyboardMarkup:
+    """Клавиатура под вопросом: Подсказка и Стоп тест."""
+    return _cached(("stop_test", q_id), lambda: InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="💡 Подсказка", callback_data=f"hint_{q_id}")],
+            [InlineKeyboardButton(text="⏹️ Стоп тест", callback_data="stop_test")]
+        ]
+    ))
+
+
+def question_card(q_id, footer: str = TEST_FOOTER) -> str:
+    """
+    Текст вопроса с пронумерованными вариантами и подсказкой, как отвечать.
+    Заголовок («Вопрос 3 из 10 …») зависит от прохождения и добавляется при отправке.
+    """
+    def build():
+        q = question_bank.question(q_id)
+        options = q["options"].split("\n")
+        return (
+            f"{q['question']}\n\n" +
+            "\n".join([f"{i+1}. {opt}" for i, opt in enumerate(options)]) +
+            footer
+        )
+    return _cached(("card", q_id, footer), build)
+
+
+# =========================
+# Курс по органике
+# =========================
+def chapters_kb() -> InlineKeyboardMarkup:
+    """Список глав курса inline-кнопками."""
+    return _cached("chapters", lambda: InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=topic, callback_data=f"learn_topic_{i}")]
+        for i, topic in enumerate(LEARNING_TOPICS)
+    ]))
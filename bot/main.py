@@ -2,25 +2,68 @@ import asyncio
 import logging
 from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommand
-from aiogram.fsm.storage.memory import MemoryStorage
+from bot.services.fsm_storage import StateStoreStorage
+from bot.services.state_store import purge_expired
 from bot.services.answer_db import init_db, init_progress_table
-init_db()
-init_progress_table() 
+from bot.services.lecture_store import lecture_store
+from bot.services.question_bank import question_bank
+from bot.services.spreadsheet import init_sheet_mirror
+from bot.services.quotas import quotas, install_quotas
 from bot.handlers.menu import router as menu_router
 from bot.handlers.topics import router as topics_router
 from bot.handlers.tests import router as tests_router
 from bot.handlers.report import router as report_router
+from bot.handlers.buttons import install_buttons
+from bot.services.outbound import outbound
+from bot.services.broadcast import broadcaster
+from bot.services.db_writer import db_writer
+from bot.services.gpt_service import scheduler as gpt_scheduler
+from bot.services.metrics import registry, install_metrics, start_metrics_server
+from bot.services.loop_watchdog import watchdog
+from bot.services.jobs import job_queue
+from bot.handlers.tests import user_test_state
+from bot.utils import user_learning_state, user_topics
 
-# --- Конфиг и токен ---
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
-BOT_TOKEN = os.getenv("BOT_TOKEN")  # токен из .env
+# --- Конфиг и токен (общий для polling и webhook) ---
+from bot.config import BOT_TOKEN, RUN_MODE
 
 # --- Настройка логирования ---
 logging.basicConfig(level=logging.INFO)
 
+# --- Метрики очередей и сессий (вместе с временем хендлеров — на /metrics) ---
+_SESSIONS = {"learning": user_learning_state, "topics": user_topics, "tests": user_test_state}
+_GPT_CLASSES = {0: "interactive", 1: "grading", 2: "batch"}
+registry.gauge("bot_sessions_live", "Сессий в памяти процесса", lambda: {n: s.live for n, s in _SESSIONS.items()})
+registry.gauge("bot_sessions_evicted", "Сессий вытеснено из памяти (ttl / lru)", lambda: {
+    f"{n}_{kind}": s.stats()[f"evicted_{kind}"] for n, s in _SESSIONS.items() for kind in ("ttl", "lru")
+})
+registry.gauge("bot_gpt_queue", "Запросов к GPT в очереди планировщика", lambda: {
+    _GPT_CLASSES.get(p, p): n for p, n in gpt_scheduler.queued().items()
+})
+registry.gauge("bot_outbound", "Очередь исходящих сообщений Telegram", outbound.stats)
+registry.gauge("bot_db_writer_pending", "Фоновых записей в базу ответов в очереди", lambda: db_writer.pending)
+
+_initialized = False
+
+
+def init():
+    """
+    Таблицы, лекции, банк вопросов, счётчики лимитов — один раз на процесс.
+    Не при импорте: webhook-воркер импортирует этот модуль заново, а
+    соединения с базами должен открывать уже сам процесс.
+    """
+    global _initialized
+    if _initialized:
+        return
+    init_db()
+    init_progress_table()
+    init_sheet_mirror()
+    quotas.load()
+    lecture_store.load()
+    question_bank.load()
+    purge_expired()  # сессии, просроченные, пока бот был выключен
+    _initialized = True
+
 async def set_bot_commands(bot: Bot):
     commands = [
         BotCommand(command="start", description="Начать работу с ботом"),
@@ -32,10 +75,16 @@ async def set_bot_commands(bot: Bot):
     ]
     await bot.set_my_commands(commands)
 
-async def main():
-    # --- Инициализация бота и диспетчера ---
-    bot = Bot(token=BOT_TOKEN, parse_mode="HTML")
-    dp = Dispatcher(storage=MemoryStorage())
+def create_bot(session=None) -> Bot:
+    """session — своя сессия aiogram (нагрузочный тест подставляет фейковый Telegram)."""
+    bot = Bot(token=BOT_TOKEN, parse_mode="HTML", session=session)
+    # все исходящие запросы с chat_id — через очереди с лимитами Telegram
+    bot.session.middleware(outbound)
+    return bot
+
+def create_dispatcher() -> Dispatcher:
+    """Диспетчер со всеми роутерами (роутер можно подключить только один раз на процесс)."""
+    dp = Dispatcher(storage=StateStoreStorage())
 
     # --- Подключение роутеров ---
     dp.include_router(menu_router)
@@ -43,12 +92,35 @@ async def main():
     dp.include_router(topics_router)
     dp.include_router(report_router)
 
+    # --- Кнопки и команды: одна таблица на весь диспетчер ---
+    install_buttons(dp)
+    # --- Время и ошибки каждого хендлера ---
+    install_metrics(dp)
+    # --- Лимиты ученика на голосовые и GPT ---
+    install_quotas(dp)
+    return dp
+
+async def main():
+    # --- Инициализация бота и диспетчера ---
+    init()
+    bot = create_bot()
+    dp = create_dispatcher()
+
     # --- Установка команд ---
     await set_bot_commands(bot)
 
     # --- Запуск polling ---
     print("Бот запущен!")
+    await bot.delete_webhook()  # если раньше работали через webhook
+    broadcaster.start(bot)      # незавершённые рассылки продолжаются после перезапуска
+    job_queue.start(bot)        # проверка ответов и отчёты — в фоне, прерванные продолжаются
+    await start_metrics_server()
+    watchdog.start()            # синхронные блокировки event loop → лог и /metrics
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if RUN_MODE == "webhook":
+        from bot.webhook import run_webhook
+        run_webhook()
+    else:
+        asyncio.run(main())
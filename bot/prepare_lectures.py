@@ -0,0 +1,108 @@
+"""
+Заполняет prepared_lectures.db готовыми лекциями по всем порциям bot/textbooks/*.json.
+
+Запуск из корня проекта (там же, где запускается бот):
+    python -m bot.prepare_lectures                  # всё, что ещё не готово или изменилось
+    python -m bot.prepare_lectures --topic Алканы   # только одна глава
+    python -m bot.prepare_lectures --force          # перегенерировать всё
+    python -m bot.prepare_lectures --dry-run        # только показать, что будет сделано
+
+Каждая лекция сохраняется сразу после генерации, поэтому прерванный запуск
+можно просто повторить: готовые порции с тем же хэшем исходника пропускаются.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+from bot.utils import TEXTBOOK_CONTENT
+from bot.services.gpt_service import teach_material
+from bot.services.lecture_db import (
+    init_lectures_table, get_lecture_hashes, save_lecture, delete_lectures_from, text_hash
+)
+
+logger = logging.getLogger("prepare_lectures")
+
+
+def plan_jobs(topics, force=False):
+    """
+    Возвращает список (topic, chunk_idx, text) порций, для которых лекцию нужно (пере)генерировать.
+    """
+    done = {} if force else get_lecture_hashes()
+    jobs = []
+    for topic in topics:
+        for idx, text in enumerate(TEXTBOOK_CONTENT[topic]):
+            if done.get((topic, idx)) != text_hash(text):
+                jobs.append((topic, idx, text))
+    return jobs
+
+
+async def run_jobs(jobs, concurrency):
+    """
+    Генерирует лекции параллельно (не больше concurrency запросов одновременно).
+    Возвращает число ошибок.
+    """
+    sem = asyncio.Semaphore(concurrency)
+    failed = 0
+    finished = 0
+    started = time.monotonic()
+
+    async def worker(topic, idx, text):
+        nonlocal failed, finished
+        async with sem:
+            try:
+                lecture = await teach_material(text)
+            except Exception as e:
+                failed += 1
+                logger.error(f"❌ {topic} #{idx}: {e}")
+                return
+        save_lecture(topic, idx, text, lecture)
+        finished += 1
+        elapsed = time.monotonic() - started
+        logger.info(f"✅ [{finished}/{len(jobs)}] {topic} #{idx} ({elapsed:.0f}с)")
+
+    await asyncio.gather(*(worker(*job) for job in jobs))
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Генерация готовых лекций для курса по органике")
+    parser.add_argument("--topic", action="append", help="только эта глава (можно повторять)")
+    parser.add_argument("--concurrency", type=int, default=8, help="одновременных запросов к GPT")
+    parser.add_argument("--force", action="store_true", help="перегенерировать даже готовые лекции")
+    parser.add_argument("--dry-run", action="store_true", help="только показать план")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    topics = args.topic or list(TEXTBOOK_CONTENT)
+    unknown = [t for t in topics if t not in TEXTBOOK_CONTENT]
+    if unknown:
+        parser.error(f"нет таких глав: {', '.join(unknown)}")
+
+    init_lectures_table()
+    for topic in topics:
+        removed = 0 if args.dry_run else delete_lectures_from(topic, len(TEXTBOOK_CONTENT[topic]))
+        if removed:
+            logger.info(f"🧹 {topic}: удалено {removed} лишних лекций")
+
+    jobs = plan_jobs(topics, force=args.force)
+    total = sum(len(TEXTBOOK_CONTENT[t]) for t in topics)
+    logger.info(f"📚 Порций всего: {total}, нужно сгенерировать: {len(jobs)}")
+    if args.dry_run:
+        for topic, idx, _ in jobs:
+            print(f"{topic} #{idx}")
+        return 0
+    if not jobs:
+        return 0
+
+    failed = asyncio.run(run_jobs(jobs, args.concurrency))
+    if failed:
+        logger.error(f"Не удалось сгенерировать {failed} лекций — запусти команду ещё раз")
+        return 1
+    logger.info("🎉 Все лекции готовы")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
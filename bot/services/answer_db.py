@@ -1,7 +1,10 @@
+import os
 import sqlite3
 from datetime import datetime
 
-DB_FILE = "../shared/test_answers.db"
+from bot.services.metrics import timed
+
+DB_FILE = os.getenv("ANSWERS_DB", "../shared/test_answers.db")
   # Имя файла с базой данных
 
 # 1. Создаём таблицу ответов (вызывается один раз при запуске)
@@ -27,6 +30,7 @@ def init_db():
     init_activity_table()
 
 # 2. Запись одного ответа в таблицу test_answers
+@timed("answer_db.save_test_answer")
 def save_test_answer(user_id, username, test_type, question_id, question_text, user_answer, correct_answer, is_correct):
     with sqlite3.connect(DB_FILE) as conn:
         c = conn.cursor()
@@ -48,6 +52,7 @@ def save_test_answer(user_id, username, test_type, question_id, question_text, u
         conn.commit()
 
 # 3. Сохраняем прогресс теста (таблица test_progress)
+@timed("answer_db.save_test_progress")
 def save_test_progress(user_id, test_type, idx, q_ids):
     """
     Сохраняет прогресс теста: пользователя, номер теста, текущий вопрос и список id вопросов.
@@ -70,6 +75,7 @@ def save_test_progress(user_id, test_type, idx, q_ids):
         ''', (user_id, test_type, idx, q_ids_str))
         conn.commit()
 
+@timed("answer_db.load_test_progress")
 def load_test_progress(user_id, test_type):
     """
     Возвращает (idx, q_ids) — номер текущего вопроса и список id вопросов, если пользователь уже проходил этот тест.
@@ -85,6 +91,7 @@ def load_test_progress(user_id, test_type):
             return idx, q_ids
         return None, None
 
+@timed("answer_db.clear_test_progress")
 def clear_test_progress(user_id, test_type):
     """
     Очищает прогресс прохождения теста (когда пользователь начинает заново).
@@ -115,6 +122,7 @@ def init_progress_table():
 #   РАБОТА НАД ОШИБКАМИ
 # ========================
 
+@timed("answer_db.get_mistake_questions")
 def get_mistake_questions(user_id):
     """
     Возвращает список кортежей (test_type, question_id, question_text, user_answer, correct_answer)
@@ -129,6 +137,7 @@ def get_mistake_questions(user_id):
         """, (user_id,))
         return c.fetchall()
 
+@timed("answer_db.set_answer_correct")
 def set_answer_correct(user_id, question_id):
     """
     Помечает ошибку как исправленную (is_correct=1) для user_id и question_id.
@@ -164,6 +173,7 @@ def init_activity_table():
         ''')
         conn.commit()
 
+@timed("answer_db.log_question_started")
 def log_question_started(user_id, test_type, question_id):
     """
     Логируем начало показа вопроса пользователю: user_id, test_type, question_id, started_at=now.
@@ -183,6 +193,7 @@ def log_question_started(user_id, test_type, question_id):
         ))
         conn.commit()
 
+@timed("answer_db.log_question_answered")
 def log_question_answered(user_id, question_id, user_answer, is_correct):
     """
     Когда пользователь ответил — обновляем запись: answered_at, user_answer, is_correct
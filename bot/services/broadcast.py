@@ -0,0 +1,299 @@
+# bot/services/broadcast.py
+"""
+Рассылки всем ученикам (напоминания, анонсы новых глав).
+
+Рассылка создаётся командой `python -m bot.broadcast create ...`: аудитория
+сразу выбирается из test_answers / test_progress и записывается в таблицу
+broadcast_recipients, так что список получателей не меняется по ходу.
+Отправляет запущенный бот (BroadcastRunner): пачками по BATCH человек, не
+быстрее BROADCAST_RPS сообщений в секунду — остальной лимит Telegram (см.
+bot/services/outbound.py) остаётся ученикам, которые сейчас работают с ботом.
+Статус каждого получателя сохраняется после каждой пачки, поэтому после
+перезапуска бот продолжает с того же места (повторно могут уйти не больше
+одной пачки сообщений, отправленных прямо перед падением).
+
+Аудитории:
+    all             — все, кто решал тесты или начинал их
+    unfinished      — у кого есть незавершённый тест (test_progress)
+    unfinished:12   — незавершённый Тест 12
+    answered:12     — все, кто отвечал на Тест 12
+    inactive:7      — кто не отвечал на тесты 7 дней и больше
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+
+from bot.services.answer_db import DB_FILE
+from bot.services.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_RPS = float(os.getenv("BROADCAST_RPS", "20"))            # сообщений в секунду на рассылки
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))  # запросов к Telegram одновременно
+BATCH = 50                # получателей за один подход (и между сохранениями статуса)
+MAX_ATTEMPTS = 3          # попыток на получателя при сетевых ошибках
+POLL_INTERVAL = 10.0      # секунд между проверками новых рассылок
+
+TIME_FMT = "%Y-%m-%d %H:%M:%S"
+
+
+def _now() -> str:
+    return datetime.now().strftime(TIME_FMT)
+
+
+# ========================
+#   ТАБЛИЦЫ
+# ========================
+def init_broadcast_tables():
+    """
+    Создаёт таблицы рассылок и получателей, если их ещё нет.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT,
+                audience TEXT,
+                text TEXT,
+                status TEXT,            -- pending | running | done | cancelled
+                total INTEGER,
+                finished_at TEXT
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                broadcast_id INTEGER,
+                user_id INTEGER,
+                status TEXT,            -- pending | sent | blocked | failed
+                attempts INTEGER DEFAULT 0,
+                error TEXT,
+                sent_at TEXT,
+                PRIMARY KEY (broadcast_id, user_id)
+            )
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status
+            ON broadcast_recipients (broadcast_id, status)
+        ''')
+        conn.commit()
+
+
+# ========================
+#   АУДИТОРИИ
+# ========================
+def _audience_query(audience: str) -> Tuple[str, tuple]:
+    """SQL, выбирающий user_id для аудитории (см. описание модуля)."""
+    kind, _, arg = audience.partition(":")
+    if kind == "all":
+        return "SELECT user_id FROM test_answers UNION SELECT user_id FROM test_progress", ()
+    if kind == "unfinished":
+        if arg:
+            return "SELECT DISTINCT user_id FROM test_progress WHERE test_type=?", (int(arg),)
+        return "SELECT DISTINCT user_id FROM test_progress", ()
+    if kind == "answered" and arg:
+        return "SELECT DISTINCT user_id FROM test_answers WHERE test_type=?", (int(arg),)
+    if kind == "inactive" and arg:
+        since = (datetime.now() - timedelta(days=int(arg))).strftime(TIME_FMT)
+        return (
+            "SELECT user_id FROM test_answers GROUP BY user_id HAVING MAX(answer_time) < ?",
+            (since,),
+        )
+    raise ValueError(f"Неизвестная аудитория: {audience}")
+
+
+def count_audience(audience: str) -> int:
+    sql, params = _audience_query(audience)
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute(f"SELECT COUNT(*) FROM ({sql})", params)
+        return c.fetchone()[0]
+
+
+def create_broadcast(audience: str, text: str) -> Tuple[int, int]:
+    """
+    Создаёт рассылку и фиксирует список получателей. Возвращает (id, число получателей).
+    """
+    sql, params = _audience_query(audience)
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO broadcasts (created_at, audience, text, status, total) VALUES (?, ?, ?, 'pending', 0)",
+            (_now(), audience, text),
+        )
+        broadcast_id = c.lastrowid
+        c.execute(f'''
+            INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, user_id, status)
+            SELECT ?, user_id, 'pending' FROM ({sql}) WHERE user_id IS NOT NULL
+        ''', (broadcast_id, *params))
+        total = c.rowcount
+        c.execute("UPDATE broadcasts SET total=? WHERE id=?", (total, broadcast_id))
+        conn.commit()
+        return broadcast_id, total
+
+
+def cancel_broadcast(broadcast_id: int) -> bool:
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute(
+            "UPDATE broadcasts SET status='cancelled', finished_at=? WHERE id=? AND status IN ('pending', 'running')",
+            (_now(), broadcast_id),
+        )
+        conn.commit()
+        return c.rowcount > 0
+
+
+def get_broadcasts(limit: int = 20) -> List[dict]:
+    """
+    Последние рассылки со счётчиками статусов получателей.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute('''
+            SELECT b.id, b.created_at, b.audience, b.status, b.total, b.finished_at,
+                   SUM(r.status='sent'), SUM(r.status='blocked'), SUM(r.status='failed'), SUM(r.status='pending')
+            FROM broadcasts b LEFT JOIN broadcast_recipients r ON r.broadcast_id = b.id
+            GROUP BY b.id ORDER BY b.id DESC LIMIT ?
+        ''', (limit,))
+        keys = ("id", "created_at", "audience", "status", "total", "finished_at",
+                "sent", "blocked", "failed", "pending")
+        return [dict(zip(keys, row)) for row in c.fetchall()]
+
+
+def _next_broadcast() -> Optional[Tuple[int, str]]:
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, text FROM broadcasts WHERE status IN ('running', 'pending') ORDER BY id LIMIT 1")
+        return c.fetchone()
+
+
+def _broadcast_status(broadcast_id: int) -> Optional[str]:
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute("SELECT status FROM broadcasts WHERE id=?", (broadcast_id,))
+        row = c.fetchone()
+        return row[0] if row else None
+
+
+def _set_status(broadcast_id: int, status: str):
+    """Меняет статус незавершённой рассылки (отменённую не трогает)."""
+    with sqlite3.connect(DB_FILE) as conn:
+        finished = _now() if status == "done" else None
+        conn.execute(
+            "UPDATE broadcasts SET status=?, finished_at=? WHERE id=? AND status IN ('pending', 'running')",
+            (status, finished, broadcast_id),
+        )
+        conn.commit()
+
+
+def _pending_batch(broadcast_id: int, size: int) -> List[Tuple[int, int]]:
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT user_id, attempts FROM broadcast_recipients WHERE broadcast_id=? AND status='pending' LIMIT ?",
+            (broadcast_id, size),
+        )
+        return c.fetchall()
+
+
+def _save_results(broadcast_id: int, results: List[tuple]):
+    """results: (user_id, status, attempts, error)."""
+    now = _now()
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.executemany('''
+            UPDATE broadcast_recipients
+            SET status=?, attempts=?, error=?, sent_at=?
+            WHERE broadcast_id=? AND user_id=?
+        ''', [
+            (status, attempts, error, now if status == "sent" else None, broadcast_id, user_id)
+            for user_id, status, attempts, error in results
+        ])
+        conn.commit()
+
+
+# ========================
+#   ОТПРАВКА
+# ========================
+class BroadcastRunner:
+    """Фоновая задача бота: по очереди доводит до конца все незавершённые рассылки."""
+
+    def __init__(self, rps: float = BROADCAST_RPS, concurrency: int = BROADCAST_CONCURRENCY):
+        self.bucket = TokenBucket(rate=rps, capacity=max(1.0, rps))
+        self.concurrency = concurrency
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, bot):
+        """Запустить в текущем event loop (при старте бота)."""
+        init_broadcast_tables()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop(bot))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _loop(self, bot):
+        while True:
+            try:
+                job = await asyncio.to_thread(_next_broadcast)
+                if job is None:
+                    await asyncio.sleep(POLL_INTERVAL)
+                    continue
+                await self.run(bot, *job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка в рассылке, повторю позже")
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def _deliver(self, bot, user_id: int, attempts: int, text: str) -> tuple:
+        await self.bucket.acquire()
+        attempts += 1
+        try:
+            await bot.send_message(user_id, text)
+            return user_id, "sent", attempts, None
+        except TelegramForbiddenError as e:
+            # бот заблокирован или аккаунт удалён — больше не пытаемся
+            return user_id, "blocked", attempts, str(e)
+        except TelegramBadRequest as e:
+            return user_id, "failed", attempts, str(e)
+        except Exception as e:
+            status = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+            return user_id, status, attempts, str(e)
+
+    async def run(self, bot, broadcast_id: int, text: str):
+        """Отправить рассылку всем оставшимся получателям."""
+        await asyncio.to_thread(_set_status, broadcast_id, "running")
+        logger.info(f"📣 Рассылка #{broadcast_id}: старт")
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def deliver(user_id, attempts):
+            async with sem:
+                return await self._deliver(bot, user_id, attempts, text)
+
+        sent = 0
+        while True:
+            if await asyncio.to_thread(_broadcast_status, broadcast_id) == "cancelled":
+                logger.info(f"📣 Рассылка #{broadcast_id}: отменена")
+                return
+            batch = await asyncio.to_thread(_pending_batch, broadcast_id, BATCH)
+            if not batch:
+                break
+            results = await asyncio.gather(*(deliver(uid, attempts) for uid, attempts in batch))
+            await asyncio.to_thread(_save_results, broadcast_id, results)
+            sent += sum(1 for r in results if r[1] == "sent")
+            logger.info(f"📣 Рассылка #{broadcast_id}: доставлено {sent}")
+        await asyncio.to_thread(_set_status, broadcast_id, "done")
+        logger.info(f"📣 Рассылка #{broadcast_id}: завершена")
+
+
+broadcaster = BroadcastRunner()
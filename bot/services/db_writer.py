@@ -0,0 +1,94 @@
+# bot/services/db_writer.py
+"""
+Запись в базу ответов в фоне.
+
+Журнал ответов, активность по вопросам и прогресс тестов нужны для отчётов
+и статистики, но ученику ждать их записи незачем. Хендлер кладёт запись в
+очередь (submit) и сразу отвечает; один фоновый поток выполняет записи
+строго по порядку (INSERT «вопрос показан» всегда раньше UPDATE «ответил»).
+
+Перед чтением таблиц, которые пишутся отсюда (прогресс, ошибки), вызывай
+await db_writer.flush() — иначе можно не увидеть свои же последние записи.
+"""
+import asyncio
+import atexit
+import logging
+import queue
+import threading
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def _resolve(loop: asyncio.AbstractEventLoop, future: asyncio.Future):
+    """Метка flush(): всё, что было в очереди до неё, уже записано."""
+    def done():
+        if not future.done():
+            future.set_result(None)
+    try:
+        loop.call_soon_threadsafe(done)
+    except RuntimeError:
+        pass  # loop уже закрыт — ждать некому
+
+
+class DBWriter:
+    def __init__(self, name: str = "db-writer"):
+        self.name = name
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                fn, args, kwargs = item
+                try:
+                    fn(*args, **kwargs)
+                except Exception:
+                    logger.exception(f"Фоновая запись {fn.__name__} не удалась")
+            finally:
+                self._queue.task_done()
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        """Поставить запись в очередь (не блокирует)."""
+        if self._thread is None:
+            self._start()
+        self._queue.put((fn, args, kwargs))
+
+    @property
+    def pending(self) -> int:
+        return self._queue.unfinished_tasks
+
+    async def flush(self):
+        """
+        Дождаться записей, поставленных до этого вызова. Записи, которые другие
+        ученики ставят после, не ждём: в очередь кладётся метка, поток дойдёт
+        до неё, выполнив всё, что было раньше, и разбудит ожидающего.
+        """
+        if not self._queue.unfinished_tasks:
+            return
+        loop = asyncio.get_running_loop()
+        reached = loop.create_future()
+        self.submit(_resolve, loop, reached)
+        await reached
+
+    def close(self):
+        """Дописать очередь и остановить поток (вызывается при выходе)."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+
+db_writer = DBWriter()
+atexit.register(db_writer.close)
@@ -0,0 +1,44 @@
+# bot/services/fsm_storage.py
+"""
+FSM aiogram поверх того же бэкенда, что и состояния пользователей (state_store).
+"""
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+from bot.services.state_store import StateDict
+
+
+class StateStoreStorage(BaseStorage):
+    """Хранилище FSM для Dispatcher(storage=...), замена MemoryStorage."""
+
+    def __init__(self, store=None):
+        self.states = StateDict("fsm_state", store, key_type=str)
+        self.data = StateDict("fsm_data", store, key_type=str)
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id}:{key.destiny}"
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        state = state.state if isinstance(state, State) else state
+        if state is None:
+            self.states.pop(self._key(key), None)
+        else:
+            self.states[self._key(key)] = state
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self.states.get(self._key(key))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        if data:
+            self.data[self._key(key)] = dict(data)
+        else:
+            self.data.pop(self._key(key), None)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict(self.data.get(self._key(key)) or {})
+
+    async def close(self) -> None:
+        pass
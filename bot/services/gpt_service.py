@@ -1,13 +1,22 @@
 import os
 import logging
 import asyncio
-from typing import List
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 import openai
 import httpx
 from pydub import AudioSegment
 from dotenv import load_dotenv  # Для .env
 
+from bot.services.rate_limit import TokenBucket
+from bot.services.metrics import timed
+from bot.services.tracing import span
+from bot.services.resilience import Policy, ServiceUnavailable
+from bot.services import prompts
+from bot.services.quotas import quotas
+
 # 1. Загружаем переменные из .env
 load_dotenv()
 # 2. Передаём ключ OpenAI библиотеке
@@ -21,44 +30,275 @@ if FFMPEG_BIN:
 # Логгер и ключ API
 logger = logging.getLogger(__name__)
 openai.api_key = os.getenv("OPENAI_API_KEY")
+# Адрес API (для нагрузочного теста — локальная заглушка, см. loadtest/)
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1").rstrip("/")
+openai.api_base = OPENAI_API_BASE
+
+
+# ───────── Планировщик запросов к OpenAI ─────────
+# Классы приоритета: чем меньше число, тем раньше запрос уходит в API
+INTERACTIVE = 0   # вопросы ученика во время курса
+GRADING = 1       # определение темы и проверка устных ответов
+BATCH = 2         # массовая генерация лекций (teach_material)
+
+# Лимиты аккаунта OpenAI: запросы и токены в минуту
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "30000"))
+
+# Какую долю ведра приоритет обязан оставить более срочным классам
+_RESERVE = {INTERACTIVE: 0.0, GRADING: 0.1, BATCH: 0.3}
+
+# Сроки: на ответ GPT вместе с очередью и повторами; пакетной генерации спешить некуда
+GPT_DEADLINE = float(os.getenv("GPT_DEADLINE", "45"))
+GPT_STREAM_IDLE = float(os.getenv("GPT_STREAM_IDLE", "20"))      # тишина в стриме между чанками
+WHISPER_DEADLINE = float(os.getenv("WHISPER_DEADLINE", "90"))    # на один сегмент вместе с повторами
+_DEADLINES = {INTERACTIVE: GPT_DEADLINE, GRADING: GPT_DEADLINE, BATCH: 10 * GPT_DEADLINE}
+
+
+def _openai_retryable(e: BaseException) -> bool:
+    if isinstance(e, (
+        openai.error.RateLimitError, openai.error.Timeout, openai.error.APIConnectionError,
+        openai.error.ServiceUnavailableError, openai.error.TryAgain,
+    )):
+        return True
+    return isinstance(e, openai.error.APIError) and (e.http_status or 500) >= 500
+
+
+def _whisper_retryable(e: BaseException) -> bool:
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return isinstance(e, httpx.TransportError)
 
 
-async def classify_topic(transcript: str) -> str:
+# Дедлайны, повторы с jitter и предохранители (bot/services/resilience.py)
+GPT = Policy("openai", deadline=GPT_DEADLINE, attempts=4, base_delay=1.0, retryable=_openai_retryable)
+WHISPER = Policy("whisper", deadline=WHISPER_DEADLINE, attempts=3, retryable=_whisper_retryable)
+
+
+class _Ticket:
+    """Место в очереди планировщика: ждёт, пока под него не спишут лимиты."""
+
+    def __init__(self, priority: int, user_id, tokens: int):
+        self.priority = priority
+        self.user_id = user_id
+        self.tokens = tokens
+        self.granted = asyncio.get_running_loop().create_future()
+
+
+class GPTScheduler:
     """
-    Определить тему ответа ученика на основе его текста.
+    Единая очередь всех запросов к chat completions.
+      - строгий приоритет классов INTERACTIVE > GRADING > BATCH;
+      - внутри класса — round-robin по пользователям (никто не забивает очередь);
+      - два token bucket: запросы/мин и токены/мин; младшие классы оставляют
+        резерв ведра старшим, так что интерактив не ждёт пакетную генерацию.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket.per_minute(rpm)
+        self.tokens = TokenBucket.per_minute(tpm)
+        # priority -> {user_id: deque[_Ticket]}; порядок ключей = порядок round-robin
+        self._queues: Dict[int, Dict[object, deque]] = {p: {} for p in _RESERVE}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+
+    def _ensure_runner(self):
+        if self._runner is None or self._runner.done():
+            self._wakeup = asyncio.Event()
+            self._runner = asyncio.create_task(self._run())
+
+    async def acquire(self, priority: int, user_id, tokens: int):
+        """Встать в очередь и дождаться своей очереди на запрос."""
+        self._ensure_runner()
+        ticket = _Ticket(priority, user_id, tokens)
+        self._queues[priority].setdefault(user_id, deque()).append(ticket)
+        self._wakeup.set()
+        await ticket.granted
+
+    def settle(self, estimated: int, actual: int):
+        """Поправить ведро токенов на разницу между оценкой и реальным расходом."""
+        self.tokens.take(actual - estimated)
+
+    def penalize(self):
+        """Получили 429 — опустошаем ведро запросов, чтобы все притормозили."""
+        self.requests.take(self.requests.tokens)
+
+    def queued(self) -> Dict[int, int]:
+        """Сколько запросов ждёт в очереди, по приоритетам."""
+        return {p: sum(len(q) for q in users.values()) for p, users in self._queues.items()}
+
+    def _next_ticket(self) -> Optional[_Ticket]:
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            if users:
+                user_id, q = next(iter(users.items()))
+                return q[0]
+        return None
+
+    def _pop(self, ticket: _Ticket):
+        users = self._queues[ticket.priority]
+        q = users.pop(ticket.user_id)
+        q.popleft()
+        if q:
+            users[ticket.user_id] = q  # пользователь уходит в конец round-robin
+
+    async def _run(self):
+        while True:
+            ticket = self._next_ticket()
+            if ticket is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if ticket.granted.done():  # вызывающий уже отменён
+                self._pop(ticket)
+                continue
+            reserve = _RESERVE[ticket.priority]
+            wait = max(
+                self.requests.wait_time(1, reserve),
+                self.tokens.wait_time(ticket.tokens, reserve),
+            )
+            if wait > 0:
+                # ждём пополнения, но просыпаемся, если пришёл более срочный запрос
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.requests.take(1)
+            self.tokens.take(ticket.tokens)
+            self._pop(ticket)
+            ticket.granted.set_result(None)
+
+
+scheduler = GPTScheduler(OPENAI_RPM, OPENAI_TPM)
+
+
+async def _acquire(priority: int, user_id, tokens: int, end: float):
+    """Очередь планировщика, но не дольше дедлайна запроса и не при разомкнутом предохранителе."""
+    GPT.breaker.fail_fast()
+    try:
+        await asyncio.wait_for(scheduler.acquire(priority, user_id, tokens), max(0.0, end - time.monotonic()))
+    except asyncio.TimeoutError:
+        raise ServiceUnavailable("openai", "очередь планировщика не дошла до запроса за дедлайн") from None
+
+
+async def _acreate(priority: int, user_id, tokens: int, end: float, **kwargs):
+    """
+    Одна попытка запроса к gpt-4o: очередь планировщика и сам вызов. GPT.call
+    повторяет её целиком, поэтому повтор после 429/5xx тоже ждёт лимитов
+    планировщика, а не уходит в OpenAI в обход них. Попытка, не получившая
+    ответа, возвращает в ведро свою оценку: иначе каждый повтор держал бы
+    там лишнюю оценку и тормозил остальных.
+    """
+    await _acquire(priority, user_id, tokens, end)
+    try:
+        return await openai.ChatCompletion.acreate(model="gpt-4o", **kwargs)
+    except BaseException as e:  # и отмена по дедлайну GPT.call
+        scheduler.settle(tokens, 0)
+        if isinstance(e, openai.error.RateLimitError):
+            scheduler.penalize()  # 429 — притормаживаем всех, а не только этот запрос
+        raise
+
+
+async def _chat(
+    messages: list[dict],
+    priority: int,
+    user_id=None,
+    max_completion: int = 800,
+    op: str = "chat",
+    **kwargs,
+):
+    """
+    Запрос к gpt-4o через планировщик: ждём своей очереди (на каждой попытке), делаем вызов
+    (повторы и предохранитель — GPT), поправляем бюджет токенов по resp.usage.
+    Всё вместе — не дольше дедлайна приоритета, иначе ServiceUnavailable.
+    op — имя операции в логе и метриках расхода токенов.
     """
-    prompt = (
-        "Определи тему по органической химии из этого ответа:\n\n"
-        f"{transcript}"
+    prompt_tokens = prompts.count_messages(messages)
+    estimate = prompt_tokens + max_completion
+    end = time.monotonic() + _DEADLINES[priority]
+    resp = await GPT.call(
+        _acreate, priority, user_id, estimate, end,
+        messages=messages, deadline=max(0.0, end - time.monotonic()), **kwargs,
     )
-    resp = await openai.ChatCompletion.acreate(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
+    scheduler.settle(estimate, resp.usage.total_tokens)
+    prompts.record_usage(op, prompt_tokens, 0, usage=resp.usage)
+    quotas.charge_tokens(user_id, resp.usage.total_tokens)
+    return resp
+
+
+async def _stream_chat(
+    messages: list[dict],
+    priority: int,
+    user_id=None,
+    temperature: float = 0.7,
+    max_completion: int = 800,
+    op: str = "chat",
+) -> AsyncIterator[str]:
+    """
+    Потоковый запрос к gpt-4o через планировщик: отдаёт текст по кусочкам
+    (delta.content) по мере генерации. usage в стриме нет — расход считаем локально.
+    """
+    prompt_tokens = prompts.count_messages(messages)
+    end = time.monotonic() + _DEADLINES[priority]
+    stream = await GPT.call(
+        _acreate, priority, user_id, prompt_tokens + max_completion, end,
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+        deadline=max(0.0, end - time.monotonic()),
+    )
+    generated: List[str] = []
+    chunks = stream.__aiter__()
+    try:
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), GPT_STREAM_IDLE)
+            except StopAsyncIteration:
+                break
+            except asyncio.TimeoutError:
+                GPT.breaker.failure()
+                raise ServiceUnavailable("openai", f"стрим молчит дольше {GPT_STREAM_IDLE:.0f} с") from None
+            delta = chunk.choices[0].delta.get("content")
+            if delta:
+                generated.append(delta)
+                yield delta
+    finally:
+        completion = prompts.count_tokens("".join(generated)) if generated else 0
+        scheduler.settle(prompt_tokens + max_completion, prompt_tokens + completion)
+        prompts.record_usage(op, prompt_tokens, completion)
+        quotas.charge_tokens(user_id, prompt_tokens + completion)
+
+
+@timed("gpt_service.classify_topic")
+async def classify_topic(transcript: str, user_id=None) -> str:
+    """
+    Определить тему ответа ученика на основе его текста.
+    """
+    resp = await _chat(
+        prompts.classify_messages(transcript),
+        GRADING, user_id, max_completion=20, op="classify_topic",
     )
     topic = resp.choices[0].message.content.strip().capitalize()
     logger.info(f"📚 Тема определена: {topic}")
     return topic
 
 
+@timed("gpt_service.analyze_answer")
 async def analyze_answer(
     transcript: str,
     topic: str,
-    textbook_context: str
+    textbook_context: str,
+    user_id=None,
 ) -> str:
     """
     Проанализировать ответ ученика, сверив его с текстом учебника:
     сильные стороны, ошибки, несоответствия.
     """
-    prompt = (
-        f"У тебя есть текст учебника по теме «{topic}»:\n\n"
-        f"{textbook_context}\n\n"
-        f"Ученик дал такой ответ:\n\"{transcript}\"\n\n"
-        "Сверь этот ответ с учебником: отметь, где он точно повторил текст, "
-        "где допустил неточности или упустил важное. Ответь тёплым комментарием от учителя."
-    )
-    resp = await openai.ChatCompletion.acreate(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
+    resp = await _chat(
+        prompts.analyze_messages(transcript, topic, textbook_context),
+        GRADING, user_id, op="analyze_answer",
         temperature=0.7,
     )
     feedback = resp.choices[0].message.content.strip()
@@ -66,11 +306,55 @@ async def analyze_answer(
     return feedback
 
 
+@timed("gpt_service.analyze_answer_stream")
+async def analyze_answer_stream(
+    transcript: str,
+    topic: str,
+    textbook_context: str,
+    user_id=None,
+) -> AsyncIterator[str]:
+    """
+    То же, что analyze_answer, но отдаёт комментарий кусками по мере генерации.
+    """
+    async for delta in _stream_chat(
+        prompts.analyze_messages(transcript, topic, textbook_context), GRADING, user_id,
+        op="analyze_answer",
+    ):
+        yield delta
+    logger.info("💬 Ответ ученику с учётом учебника сгенерирован (стрим)")
+
+
+# ───────── Запасные ответы на вопросы ученика ─────────
+# Пока OpenAI недоступен, на уже звучавший вопрос отвечаем из кэша удачных ответов.
+ANSWER_CACHE_SIZE = 1024
+UNAVAILABLE_ANSWER = (
+    "😔 Сейчас не получается связаться с ИИ-преподавателем. "
+    "Задай вопрос ещё раз через пару минут."
+)
+_answer_cache: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+
+
+def _question_key(topic: str, question: str) -> Tuple[str, str]:
+    return topic, " ".join(question.lower().split())
+
+
+def _remember_answer(topic: str, question: str, answer: str):
+    key = _question_key(topic, question)
+    _answer_cache[key] = answer
+    _answer_cache.move_to_end(key)
+    while len(_answer_cache) > ANSWER_CACHE_SIZE:
+        _answer_cache.popitem(last=False)
+
+
+def _fallback_answer(topic: str, question: str) -> str:
+    return _answer_cache.get(_question_key(topic, question), UNAVAILABLE_ANSWER)
+
+
 async def _transcribe_chunk(file_bytes: bytes) -> str:
     """
     Транскрибирует один кусок аудио через Whisper API.
     """
-    url = "https://api.openai.com/v1/audio/transcriptions"
+    url = f"{OPENAI_API_BASE}/audio/transcriptions"
     # Указываем таймауты connect/read/write/pool
     timeout = httpx.Timeout(connect=30.0, read=60.0, write=60.0, pool=60.0)
     files = {
@@ -89,29 +373,49 @@ async def _transcribe_chunk(file_bytes: bytes) -> str:
         return resp.text.strip()
 
 
+SEGMENT_MS = 60 * 1000  # Whisper получает аудио кусками по 60 секунд
+
+
+def split_audio(audio: AudioSegment) -> List[Tuple[int, int, bytes]]:
+    """
+    Режет аудио на сегменты по SEGMENT_MS и кодирует каждый обратно в ogg.
+    Возвращает [(начало мс, конец мс, байты ogg)]. Синхронно (pydub + ffmpeg).
+    """
+    segments = []
+    for start in range(0, len(audio), SEGMENT_MS):
+        end = min(start + SEGMENT_MS, len(audio))
+        buf = audio[start:end].export(format="ogg")
+        try:
+            segments.append((start, end, buf.read()))
+        finally:
+            buf.close()
+    return segments
+
+
+@timed("gpt_service.transcribe_audio")
 async def transcribe_audio(file_path: str) -> str:
     """
     Разбивает аудио на 60-секундные сегменты, транскрибирует каждый
-    и возвращает объединённый текст.
+    и возвращает объединённый текст. ServiceUnavailable — Whisper не ответил.
     """
     logger.info(f"🔍 Начало транскрипции (с резкой на сегменты): {file_path}")
 
-    audio = AudioSegment.from_file(file_path, format="ogg")
-    duration_ms = len(audio)
-    chunk_length_ms = 60 * 1000  # 60 секунд
+    with span("whisper.decode") as s:
+        audio = AudioSegment.from_file(file_path, format="ogg")
+        if s is not None:
+            s.tag(seconds=len(audio) // 1000)
+    with span("whisper.split"):
+        segments = split_audio(audio)
 
     transcripts: List[str] = []
-    for start in range(0, duration_ms, chunk_length_ms):
-        end = min(start + chunk_length_ms, duration_ms)
-        chunk = audio[start:end]
-        buf = chunk.export(format="ogg")
-        data = buf.read()
-        buf.close()
-
+    for start, end, data in segments:
         logger.info(f"  → Чанк {start//1000}-{end//1000}s, байт {len(data)}")
         try:
-            txt = await _transcribe_chunk(data)
+            with span("whisper.segment", segment=f"{start//1000}-{end//1000}s", bytes=len(data)):
+                txt = await WHISPER.call(_transcribe_chunk, data)
             transcripts.append(txt)
+        except ServiceUnavailable:
+            raise  # Whisper недоступен — не выдаём обрывок за ответ, задание проверки отложится
         except Exception as e:
             logger.warning(f"Ошибка при транскрипции чанка {start//1000}-{end//1000}: {e}")
             transcripts.append("")
@@ -122,33 +426,14 @@ async def transcribe_audio(file_path: str) -> str:
     return full
 
 
+@timed("gpt_service.teach_material")
 async def teach_material(chunk: str) -> str:
     """
     Преобразует фрагмент учебника в компактную, связанную лекцию для Telegram, с красивым форматированием.
     """
-    system = (
-        "Ты — опытный преподаватель по органической химии."
-        "Твоя задача — объяснять теорию простыми словами,,без приветствий, без сложных терминов, с примерами из жизни, как если бы рассказывал ученику на уроке."
-        "Преобразуй данный фрагмент учебника в связную, логичную часть большой лекции по теме, для подготовки к ЕГЭ по химии, чтобы все части курса, прочитанные подряд, легко складывались в одно целое и не повторялись."
-        "Пиши дружелюбно, последовательно, избегай длинных и сложных предложений."
-        "Текст будет отправлен через Телеграм."
-        ""
-        "ОФОРМЛЕНИЕ:"
-        "— Делай короткие абзацы (максимум 3–4 строки)."
-        "— Формулы и химические реакции выделяй отдельно, в отдельной строке, между пустыми строками."
-        "— Формулы пиши в моноширинном стиле: обрами их тройными обратными кавычками (```)."
-        "— Важные мысли отмечай эмодзи, например: 📌, 🔥, ⚡, 💡."
-        "— Не делай простыню — разбивай объяснение на блоки: определение, пример, вывод, реакция."
-        "— Если встречаются сложные термины — объясняй их простым языком."
-        "В конце спроси: Всё ли понятно? Если остались вопросы — обязательно спрашивай!"
-    )
-
-    resp = await openai.ChatCompletion.acreate(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user",   "content": chunk},
-        ],
+    resp = await _chat(
+        prompts.teach_messages(chunk),
+        BATCH, max_completion=1500, op="teach_material",
         temperature=0.7,
     )
     lecture = resp.choices[0].message.content.strip()
@@ -156,19 +441,44 @@ async def teach_material(chunk: str) -> str:
     return lecture
 
 
-async def answer_student_question(topic: str, question: str) -> str:
+@timed("gpt_service.answer_student_question")
+async def answer_student_question(topic: str, question: str, user_id=None) -> str:
     """
     Роль: преподаватель по теме. Дать понятный, краткий ответ на вопрос ученика.
     """
-    system = f"Ты — преподаватель по теме «{topic}». Отвечай очень понятно и коротко."
-    resp = await openai.ChatCompletion.acreate(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user",   "content": question},
-        ],
-        temperature=0.7,
-    )
+    try:
+        resp = await _chat(
+            prompts.question_messages(topic, question),
+            INTERACTIVE, user_id, op="answer_question",
+            temperature=0.7,
+        )
+    except ServiceUnavailable as e:
+        logger.warning(f"❓ OpenAI недоступен ({e}), ответ из кэша")
+        return _fallback_answer(topic, question)
     ans = resp.choices[0].message.content.strip()
+    _remember_answer(topic, question, ans)
     logger.info("❓ Вопрос ученика обработан и ответ сгенерирован")
     return ans
+
+
+@timed("gpt_service.answer_student_question_stream")
+async def answer_student_question_stream(topic: str, question: str, user_id=None) -> AsyncIterator[str]:
+    """
+    То же, что answer_student_question, но отдаёт ответ кусками по мере генерации.
+    """
+    parts: List[str] = []
+    try:
+        async for delta in _stream_chat(
+            prompts.question_messages(topic, question), INTERACTIVE, user_id, op="answer_question"
+        ):
+            parts.append(delta)
+            yield delta
+    except ServiceUnavailable as e:
+        logger.warning(f"❓ OpenAI недоступен ({e}), ответ из кэша")
+        if parts:
+            yield "\n\n⚠️ Ответ оборвался — спроси ещё раз чуть позже."
+        else:
+            yield _fallback_answer(topic, question)
+        return
+    _remember_answer(topic, question, "".join(parts).strip())
+    logger.info("❓ Вопрос ученика обработан и ответ сгенерирован (стрим)")
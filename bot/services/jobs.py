@@ -0,0 +1,405 @@
+# bot/services/jobs.py
+"""
+Фоновые задания: долгая работа (проверка голосового ответа, PDF-отчёт)
+выполняется не в хендлере, а пулом из JOB_WORKERS воркеров.
+
+Хендлер сразу отвечает ученику («⏳ Проверяю ответ…»), ставит задание и
+освобождает диспетчер; воркер выполняет его и сам доставляет результат.
+
+    @job_queue.job("report", failed="Не получилось собрать отчёт.")
+    async def report_job(bot, job: Job): ...
+
+    await job_queue.enqueue("report", m.from_user.id, m.chat.id, {"full_name": ...})
+
+Задания хранятся в таблице jobs базы ответов, поэтому переживают
+перезапуск: при старте прерванные (running) снова ставятся в очередь.
+Задания одного ученика выполняются строго по очереди. В webhook-режиме у
+каждого воркера свой shard — задание выполняет тот же процесс, куда
+приходят апдейты ученика (и где лежит его состояние в памяти).
+Упавшее задание повторяется до JOB_MAX_ATTEMPTS раз, потом ученику
+отправляется текст failed. Прерванные попытки тоже считаются: задание,
+которое роняет процесс, после JOB_MAX_ATTEMPTS перезапусков помечается failed.
+
+Повтор выполняет задание с начала, поэтому шаги, которые нельзя повторять
+(платный вызов GPT, запись в таблицу, сдвиг порции курса), отмечаются в
+payload через await job.checkpoint(feedback=...) — он сохраняется в базе,
+и следующая попытка такие шаги пропускает.
+
+dedupe_key (например "report:<user_id>"): пока задание с таким ключом в
+очереди или выполняется, enqueue не ставит новое, а возвращает его id.
+
+Если внешний сервис недоступен (ServiceUnavailable, см. resilience.py),
+задание не считается упавшим: оно откладывается на JOB_DEFER_DELAY секунд
+(или пока не остынет предохранитель), ученик один раз получает текст
+deferred. Через JOB_DEFER_HOURS откладывать перестаём — это уже failed.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram.types import Message
+
+from bot.services.answer_db import DB_FILE
+from bot.services.metrics import registry
+from bot.services.tracing import root_span
+from bot.services.resilience import ServiceUnavailable
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))            # заданий одновременно на процесс
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))  # попыток на задание (вместе с прерванными)
+JOB_DEFER_DELAY = float(os.getenv("JOB_DEFER_DELAY", "60"))  # пауза, если сервис недоступен, с
+JOB_DEFER_HOURS = float(os.getenv("JOB_DEFER_HOURS", "6"))   # дольше не откладываем
+JOB_KEEP_DAYS = 7         # сколько хранить выполненные задания
+POLL_INTERVAL = 5.0       # секунд между проверками очереди без сигнала
+
+TIME_FMT = "%Y-%m-%d %H:%M:%S"
+
+
+def _now() -> str:
+    return datetime.now().strftime(TIME_FMT)
+
+
+# ========================
+#   ТАБЛИЦА
+# ========================
+def init_jobs_table():
+    """
+    Создаёт таблицу заданий, если её ещё нет.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT,
+                shard INTEGER,
+                user_id INTEGER,
+                chat_id INTEGER,
+                payload TEXT,           -- JSON
+                status TEXT,            -- queued | running | done | failed
+                attempts INTEGER DEFAULT 0,
+                error TEXT,
+                created_at TEXT,
+                started_at TEXT,
+                finished_at TEXT,
+                dedupe_key TEXT
+            )
+        ''')
+        columns = [row[1] for row in c.execute("PRAGMA table_info(jobs)")]
+        for column, ddl in (("dedupe_key", "TEXT"), ("run_after", "TEXT"), ("deferrals", "INTEGER DEFAULT 0")):
+            if column not in columns:
+                c.execute(f"ALTER TABLE jobs ADD COLUMN {column} {ddl}")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (shard, status, id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs (dedupe_key, status)")
+        conn.commit()
+
+
+def _insert_job(kind: str, shard: int, user_id: int, chat_id: int, payload: dict,
+                dedupe_key: Optional[str] = None) -> Tuple[int, bool]:
+    """(id, True) — новое задание; (id, False) — уже есть активное с тем же dedupe_key."""
+    conn = sqlite3.connect(DB_FILE, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if dedupe_key is not None:
+            row = _active_job(conn, dedupe_key)
+            if row is not None:
+                conn.execute("COMMIT")
+                return row[0], False
+        c = conn.execute(
+            "INSERT INTO jobs (kind, shard, user_id, chat_id, payload, status, created_at, dedupe_key) "
+            "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+            (kind, shard, user_id, chat_id, json.dumps(payload, ensure_ascii=False), _now(), dedupe_key),
+        )
+        conn.execute("COMMIT")
+        return c.lastrowid, True
+    finally:
+        conn.close()
+
+
+def _active_job(conn, dedupe_key: str) -> Optional[tuple]:
+    return conn.execute(
+        "SELECT id FROM jobs WHERE dedupe_key=? AND status IN ('queued', 'running') LIMIT 1",
+        (dedupe_key,),
+    ).fetchone()
+
+
+def _find_active(dedupe_key: str) -> Optional[int]:
+    with sqlite3.connect(DB_FILE) as conn:
+        row = _active_job(conn, dedupe_key)
+        return row[0] if row else None
+
+
+def _claim_job(shard: int, max_attempts: int = JOB_MAX_ATTEMPTS) -> Optional[tuple]:
+    """
+    Забирает самое старое задание shard-а (queued → running), пропуская
+    учеников, у которых задание уже выполняется, и задания с исчерпанными
+    попытками (их помечает failed _recover).
+    """
+    conn = sqlite3.connect(DB_FILE, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute('''
+            SELECT id, kind, user_id, chat_id, payload, attempts, created_at, deferrals FROM jobs
+            WHERE shard=? AND status='queued' AND attempts < ? AND (run_after IS NULL OR run_after <= ?)
+              AND user_id NOT IN (SELECT user_id FROM jobs WHERE shard=? AND status='running')
+            ORDER BY id LIMIT 1
+        ''', (shard, max_attempts, _now(), shard)).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE jobs SET status='running', attempts=attempts+1, started_at=? WHERE id=?",
+                (_now(), row[0]),
+            )
+        conn.execute("COMMIT")
+        return row
+    finally:
+        conn.close()
+
+
+def _finish_job(job_id: int, status: str, error: Optional[str] = None):
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.execute(
+            "UPDATE jobs SET status=?, error=?, finished_at=? WHERE id=?",
+            (status, error, _now() if status in ("done", "failed") else None, job_id),
+        )
+        conn.commit()
+
+
+def _save_payload(job_id: int, payload: dict):
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.execute("UPDATE jobs SET payload=? WHERE id=?", (json.dumps(payload, ensure_ascii=False), job_id))
+        conn.commit()
+
+
+def _defer_job(job_id: int, delay: float, error: str):
+    """Обратно в очередь не раньше чем через delay секунд; попытка не засчитывается."""
+    run_after = (datetime.now() + timedelta(seconds=delay)).strftime(TIME_FMT)
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.execute('''
+            UPDATE jobs SET status='queued', attempts=attempts-1, deferrals=deferrals+1, run_after=?, error=?
+            WHERE id=?
+        ''', (run_after, error, job_id))
+        conn.commit()
+
+
+def _recover(shard: int, max_attempts: int = JOB_MAX_ATTEMPTS) -> Tuple[int, List[tuple]]:
+    """
+    Прерванные перезапуском задания — снова в очередь, а исчерпавшие попытки
+    (задание, видимо, и роняет процесс) — в failed; старые выполненные — удалить.
+    Возвращает (сколько в очереди, [(id, kind, chat_id) проваленных]).
+    """
+    cutoff = (datetime.now() - timedelta(days=JOB_KEEP_DAYS)).strftime(TIME_FMT)
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT id, kind, chat_id FROM jobs WHERE shard=? AND status IN ('queued', 'running') AND attempts >= ?",
+            (shard, max_attempts),
+        )
+        exhausted = c.fetchall()
+        c.executemany(
+            "UPDATE jobs SET status='failed', error=?, finished_at=? WHERE id=?",
+            [("прервано: попытки исчерпаны", _now(), job_id) for job_id, _, _ in exhausted],
+        )
+        c.execute("UPDATE jobs SET status='queued' WHERE shard=? AND status='running'", (shard,))
+        requeued = c.rowcount
+        c.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,))
+        conn.commit()
+        return requeued, exhausted
+
+
+def _count_jobs(shard: int) -> Dict[str, int]:
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE shard=? AND status IN ('queued', 'running') GROUP BY status",
+            (shard,),
+        )
+        return {"queued": 0, "running": 0, **dict(c.fetchall())}
+
+
+# ========================
+#   ОЧЕРЕДЬ
+# ========================
+class Job:
+    __slots__ = ("id", "kind", "user_id", "chat_id", "payload", "attempts", "created_at", "deferrals")
+
+    def __init__(self, id: int, kind: str, user_id: int, chat_id: int, payload: dict, attempts: int,
+                 created_at: str = "", deferrals: int = 0):
+        self.id = id
+        self.kind = kind
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.payload = payload
+        self.attempts = attempts
+        self.created_at = created_at
+        self.deferrals = deferrals
+
+    def may_defer(self) -> bool:
+        if not self.created_at:
+            return True
+        age = datetime.now() - datetime.strptime(self.created_at, TIME_FMT)
+        return age < timedelta(hours=JOB_DEFER_HOURS)
+
+    def message(self, bot, key: str = "message_id", text: str = "") -> Message:
+        """
+        Сообщение бота, id которого лежит в payload[key] (обычно «⏳ Проверяю…»),
+        как объект aiogram — чтобы править его и после перезапуска.
+        """
+        return Message.model_validate({
+            "message_id": self.payload[key],
+            "date": int(time.time()),
+            "chat": {"id": self.chat_id, "type": "private"},
+            "text": text,
+        }, context={"bot": bot})
+
+    async def checkpoint(self, **stages):
+        """Запомнить выполненные шаги в payload (и в базе): повтор задания их пропустит."""
+        self.payload.update(stages)
+        await asyncio.to_thread(_save_payload, self.id, self.payload)
+
+
+JobFn = Callable[..., Awaitable[None]]
+
+
+class JobQueue:
+    def __init__(self, workers: int = JOB_WORKERS, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.shard = 0
+        self._kinds: Dict[str, Tuple[JobFn, str, Optional[str]]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+
+    def job(self, kind: str, failed: str = "😔 Не получилось, попробуй ещё раз.", deferred: Optional[str] = None):
+        """
+        Декоратор: async fn(bot, job) выполняет задания вида kind.
+        deferred — что сказать ученику, когда задание впервые отложено (None — молча).
+        """
+        def decorator(fn: JobFn) -> JobFn:
+            self._kinds[kind] = (fn, failed, deferred)
+            return fn
+        return decorator
+
+    def start(self, bot, shard: int = 0):
+        """Запустить воркеры в текущем event loop (при старте бота)."""
+        if self._tasks:
+            return
+        self.shard = shard
+        self._wake = asyncio.Event()
+        init_jobs_table()
+        requeued, exhausted = _recover(shard, self.max_attempts)
+        if requeued:
+            logger.info(f"🧰 Задания: {requeued} прерванных снова в очереди")
+        self._tasks = [asyncio.create_task(self._worker(bot)) for _ in range(self.workers)]
+        if exhausted:
+            logger.warning(f"🧰 Задания: {len(exhausted)} прерванных исчерпали попытки — failed")
+            self._tasks.append(asyncio.create_task(self._notify_exhausted(bot, exhausted)))
+
+    async def _notify_exhausted(self, bot, exhausted: List[tuple]):
+        for job_id, kind, chat_id in exhausted:
+            await self._notify_failed(bot, job_id, chat_id, self._kinds.get(kind, (None, "", None))[1])
+
+    async def stop(self):
+        """Остановить воркеры; прерванные задания выполнятся после перезапуска."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, kind: str, user_id: int, chat_id: int, payload: dict,
+                      dedupe_key: Optional[str] = None) -> int:
+        """id нового задания или (при совпадении dedupe_key) уже стоящего в очереди."""
+        if kind not in self._kinds:
+            raise KeyError(f"Неизвестный вид задания: {kind}")
+        job_id, created = await asyncio.to_thread(
+            _insert_job, kind, self.shard, user_id, chat_id, payload, dedupe_key
+        )
+        if created and self._wake is not None:
+            self._wake.set()
+        return job_id
+
+    async def active(self, dedupe_key: str) -> Optional[int]:
+        """id задания с таким dedupe_key, если оно ещё в очереди или выполняется."""
+        return await asyncio.to_thread(_find_active, dedupe_key)
+
+    async def join(self, poll: float = 0.2):
+        """Дождаться, пока очередь shard-а опустеет (нагрузочный тест, остановка)."""
+        while True:
+            counts = await asyncio.to_thread(_count_jobs, self.shard)
+            if not counts["queued"] and not counts["running"]:
+                return
+            await asyncio.sleep(poll)
+
+    async def _worker(self, bot):
+        while True:
+            self._wake.clear()
+            try:
+                row = await asyncio.to_thread(_claim_job, self.shard, self.max_attempts)
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Очередь заданий недоступна: {e}")
+                row = None
+            if row is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            job_id, kind, user_id, chat_id, payload, attempts, created_at, deferrals = row
+            await self._run(bot, Job(
+                job_id, kind, user_id, chat_id, json.loads(payload), attempts + 1, created_at, deferrals or 0,
+            ))
+
+    async def _run(self, bot, job: Job):
+        fn, failed, deferred = self._kinds.get(job.kind, (None, "", None))
+        started = time.perf_counter()
+        error = None
+        unavailable = None
+        try:
+            if fn is None:
+                raise KeyError(f"Неизвестный вид задания: {job.kind}")
+            with root_span(f"job.{job.kind}", user=job.user_id, job=job.id, attempt=job.attempts):
+                await fn(bot, job)
+        except asyncio.CancelledError:
+            raise  # остановка бота: задание останется running и выполнится после перезапуска
+        except ServiceUnavailable as e:
+            error = unavailable = e
+        except Exception as e:
+            error = e
+            logger.exception(f"Задание #{job.id} ({job.kind}) упало, попытка {job.attempts}")
+        finally:
+            registry.observe("bot_job_seconds", "kind", job.kind, time.perf_counter() - started, error is not None)
+
+        if error is None:
+            await asyncio.to_thread(_finish_job, job.id, "done")
+        elif unavailable is not None and job.may_defer():
+            delay = max(JOB_DEFER_DELAY, unavailable.retry_after)
+            logger.warning(f"Задание #{job.id} ({job.kind}) отложено на {delay:.0f} с: {unavailable}")
+            await asyncio.to_thread(_defer_job, job.id, delay, repr(unavailable))
+            if deferred and not job.deferrals:
+                try:
+                    await bot.send_message(job.chat_id, deferred)
+                except Exception as e:
+                    logger.warning(f"Не удалось сообщить об отложенном задании #{job.id}: {e}")
+        elif unavailable is None and job.attempts < self.max_attempts and fn is not None:
+            await asyncio.to_thread(_finish_job, job.id, "queued", repr(error))
+        else:
+            await asyncio.to_thread(_finish_job, job.id, "failed", repr(error))
+            await self._notify_failed(bot, job.id, job.chat_id, failed)
+
+    async def _notify_failed(self, bot, job_id: int, chat_id: int, text: str):
+        if not text:
+            return
+        try:
+            await bot.send_message(chat_id, text)
+        except Exception as e:
+            logger.warning(f"Не удалось сообщить об ошибке задания #{job_id}: {e}")
+
+
+job_queue = JobQueue()
+registry.describe("bot_job_seconds", "Время выполнения фонового задания (проверка ответа, отчёт), с")
+registry.gauge("bot_jobs", "Фоновых заданий в очереди и в работе", lambda: _count_jobs(job_queue.shard))
@@ -0,0 +1,82 @@
+import os
+import sqlite3
+import hashlib
+
+DB_FILE = os.getenv("LECTURES_DB", "prepared_lectures.db")  # Готовые лекции (заполняются bot/prepare_lectures.py)
+
+
+def text_hash(text: str) -> str:
+    """
+    Хэш исходного текста порции: по нему видно, что учебник поменялся и лекцию пора перегенерировать.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def init_lectures_table():
+    """
+    Создаёт таблицу prepared_lectures, если её нет, и добавляет колонку orig_hash в старые базы.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS prepared_lectures (
+                topic TEXT,
+                chunk_idx INTEGER,
+                orig_text TEXT,
+                lecture TEXT,
+                orig_hash TEXT,
+                PRIMARY KEY (topic, chunk_idx)
+            )
+        """)
+        columns = [row[1] for row in c.execute("PRAGMA table_info(prepared_lectures)")]
+        if "orig_hash" not in columns:
+            c.execute("ALTER TABLE prepared_lectures ADD COLUMN orig_hash TEXT")
+        conn.commit()
+
+
+def get_lecture_hashes():
+    """
+    Возвращает {(topic, chunk_idx): orig_hash} для всех готовых лекций.
+    Для строк, заполненных до появления orig_hash, хэш считается по orig_text.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute("SELECT topic, chunk_idx, orig_text, orig_hash FROM prepared_lectures WHERE lecture IS NOT NULL")
+        return {
+            (topic, idx): orig_hash or text_hash(orig_text or "")
+            for topic, idx, orig_text, orig_hash in c.fetchall()
+        }
+
+
+def save_lecture(topic, chunk_idx, orig_text, lecture):
+    """
+    Сохраняет (или заменяет) готовую лекцию для порции учебника вместе с хэшем исходника.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute("""
+            INSERT OR REPLACE INTO prepared_lectures (topic, chunk_idx, orig_text, lecture, orig_hash)
+            VALUES (?, ?, ?, ?, ?)
+        """, (topic, chunk_idx, orig_text, lecture, text_hash(orig_text)))
+        conn.commit()
+
+
+def delete_lectures_from(topic, chunk_idx):
+    """
+    Удаляет лекции темы начиная с chunk_idx (глава в учебнике стала короче).
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM prepared_lectures WHERE topic=? AND chunk_idx>=?", (topic, chunk_idx))
+        conn.commit()
+        return c.rowcount
+
+
+def get_all_lectures():
+    """
+    Возвращает {(topic, chunk_idx): lecture} для всех готовых лекций.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute("SELECT topic, chunk_idx, lecture FROM prepared_lectures WHERE lecture IS NOT NULL")
+        return {(topic, idx): lecture for topic, idx, lecture in c.fetchall()}
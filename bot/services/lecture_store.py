@@ -0,0 +1,89 @@
+# bot/services/lecture_store.py
+"""
+Готовые к отправке лекции курса в памяти.
+
+При старте все лекции из prepared_lectures.db читаются один раз и сразу
+прогоняются через latex_to_codeblock, так что листание главы — это просто
+поиск в словаре. Если файл базы поменялся (например, отработал
+bot/prepare_lectures.py), кэш перечитывается в фоновом потоке: пока новые
+лекции читаются и форматируются, хендлеры получают старые, потом словарь
+подменяется целиком.
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+from bot.utils import latex_to_codeblock
+from bot.services import lecture_db
+
+logger = logging.getLogger(__name__)
+
+CHECK_INTERVAL = 5.0  # секунд между проверками mtime файла базы
+
+
+class LectureStore:
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._lectures: Dict[Tuple[str, int], str] = {}
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._reloading = False
+
+    def _db_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.db_file).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        """Перечитать все лекции из базы и отформатировать их для Telegram."""
+        mtime = self._db_mtime()
+        try:
+            raw = lecture_db.get_all_lectures() if mtime is not None else {}
+        except sqlite3.OperationalError as e:
+            # например: no such table — лекции ещё не готовили
+            logger.warning(f"Не удалось прочитать лекции: {e}")
+            raw = {}
+        # новый словарь собирается целиком и подменяет старый одним присваиванием
+        self._lectures = {key: latex_to_codeblock(text) for key, text in raw.items()}
+        self._mtime = mtime
+        self._checked_at = time.monotonic()
+        logger.info(f"🎓 Загружено готовых лекций: {len(self._lectures)}")
+
+    def invalidate(self):
+        """Сбросить кэш: лекции перечитаются при следующем обращении."""
+        self._checked_at = 0.0
+        self._mtime = -1.0
+
+    def _refresh_if_changed(self):
+        now = time.monotonic()
+        if now - self._checked_at < CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        if self._reloading or self._db_mtime() == self._mtime:
+            return
+        # не в хендлере: перечитать и отформатировать все лекции — это секунды работы
+        self._reloading = True
+        threading.Thread(target=self._reload, name="lecture-reload", daemon=True).start()
+
+    def _reload(self):
+        try:
+            self.load()
+        except Exception:
+            logger.exception("Не удалось перечитать лекции")
+        finally:
+            self._reloading = False
+
+    def get(self, topic: str, idx: int) -> Optional[str]:
+        """Отформатированная лекция по теме и номеру chunk'а, либо None если её нет."""
+        self._refresh_if_changed()
+        return self._lectures.get((topic, idx))
+
+    def __len__(self):
+        return len(self._lectures)
+
+
+lecture_store = LectureStore(lecture_db.DB_FILE)
@@ -0,0 +1,179 @@
+# bot/services/loop_watchdog.py
+"""
+Сторож event loop: находит синхронную работу, которая держит loop
+(sqlite, gspread, pydub, matplotlib, os.remove… прямо в async-хендлерах).
+
+Корутина-«пульс» в loop каждые interval секунд отмечает, что loop жив, и
+меряет его задержку. Отдельный поток смотрит на пульс: если его нет дольше
+LOOP_BLOCK_MS, снимает стек потока loop (sys._current_frames), по стеку
+находит хендлер (первый кадр из bot/handlers/) и пишет в лог. Когда loop
+отпускает, длительность блокировки уходит в метрики:
+
+    bot_loop_blocked_seconds{handler="topics.on_voice",quantile="0.95"} 0.41
+    bot_loop_lag_seconds 0.003
+
+Режимы (LOOP_WATCHDOG):
+    debug  — пульс каждые 20 мс, стек каждой блокировки, плюс asyncio debug
+             (slow_callback_duration = порог: asyncio сам называет колбэк);
+             включается по умолчанию при DEBUG=1
+    sample — по умолчанию: пульс раз в 100 мс, стек в лог не чаще раза в
+             LOOP_SAMPLE_COOLDOWN секунд на хендлер, счётчики — всегда
+    off    — выключен
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional, Tuple
+
+from bot.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DEBUG = os.getenv("DEBUG", "").lower() in ("1", "true", "yes")
+LOOP_WATCHDOG = os.getenv("LOOP_WATCHDOG", "debug" if DEBUG else "sample")
+LOOP_BLOCK_MS = float(os.getenv("LOOP_BLOCK_MS", "100"))         # порог блокировки, мс
+LOOP_SAMPLE_COOLDOWN = float(os.getenv("LOOP_SAMPLE_COOLDOWN", "60"))  # sample: пауза между стеками хендлера, с
+
+_INTERVALS = {"debug": 0.02, "sample": 0.1}   # шаг пульса, с
+_STACK_LIMIT = 30                               # кадров стека в логе
+
+_HANDLERS_DIR = os.path.join("bot", "handlers") + os.sep
+_BOT_DIR = "bot" + os.sep
+
+
+def _frame_name(frame) -> str:
+    module = frame.f_globals.get("__name__", "") or ""
+    code = frame.f_code
+    return f"{module.rsplit('.', 1)[-1]}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def blame(frame) -> str:
+    """
+    Кто держит loop: хендлер из bot/handlers/ (как в bot_handler_seconds),
+    иначе ближайшая к месту блокировки функция бота, иначе «other».
+    """
+    inner_bot = None
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if _HANDLERS_DIR in filename:
+            return _frame_name(frame)
+        if inner_bot is None and _BOT_DIR in filename and not filename.endswith("loop_watchdog.py"):
+            inner_bot = frame
+        frame = frame.f_back
+    return _frame_name(inner_bot) if inner_bot is not None else "other"
+
+
+class LoopWatchdog:
+    def __init__(self, mode: str = LOOP_WATCHDOG, threshold_ms: float = LOOP_BLOCK_MS,
+                 cooldown: float = LOOP_SAMPLE_COOLDOWN):
+        self.mode = mode if mode in _INTERVALS else "off"
+        self.threshold = threshold_ms / 1000
+        self.cooldown = cooldown
+        self.interval = _INTERVALS.get(self.mode, 0.1)
+        self.lag = 0.0                      # последняя измеренная задержка loop, с
+        self.blocks = 0                     # блокировок с запуска
+        self._lock = threading.Lock()
+        self._beat = 0.0                    # time.monotonic() последнего пульса
+        self._stall: Optional[Tuple[float, str]] = None  # (начало, хендлер) текущей блокировки
+        self._last_stack: Dict[str, float] = {}           # хендлер -> когда печатали стек
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        """Запустить в текущем (работающем) event loop. Повторный вызов ничего не делает."""
+        if self.mode == "off" or self._task is not None:
+            return
+        loop = asyncio.get_running_loop()
+        if self.mode == "debug":
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.threshold
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"🐕 Сторож event loop: режим {self.mode}, порог {self.threshold * 1000:.0f} мс")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._thread.join(timeout=1)
+
+    # ───────── в event loop ─────────
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lag = max(0.0, now - started - self.interval)
+            with self._lock:
+                self._beat = now
+                stall, self._stall = self._stall, None
+            if stall is not None:
+                self._finish(now - stall[0], stall[1])
+
+    def _finish(self, seconds: float, handler: str):
+        self.blocks += 1
+        registry.observe("bot_loop_blocked_seconds", "handler", handler, seconds)
+        # в sample каждая блокировка — только в метриках, стек уже был в логе
+        logger.log(
+            logging.WARNING if self.mode == "debug" else logging.DEBUG,
+            f"🐢 Event loop был заблокирован {seconds * 1000:.0f} мс ({handler})",
+        )
+
+    # ───────── в потоке сторожа ─────────
+    def _watch(self):
+        step = min(self.interval, self.threshold / 4)
+        while not self._stopped.wait(step):
+            with self._lock:
+                if self._stall is not None:
+                    continue
+                since = self._beat
+            # пульс опаздывает на interval + порог — loop занят чем-то синхронным
+            if time.monotonic() - since < self.interval + self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            handler = blame(frame)
+            with self._lock:
+                if self._beat != since:  # loop уже отпустило
+                    continue
+                self._stall = (since + self.interval, handler)
+            if self._should_log_stack(handler):
+                stack = "".join(traceback.format_stack(frame, limit=_STACK_LIMIT))
+                logger.warning(
+                    f"🐢 Event loop занят дольше {self.threshold * 1000:.0f} мс в {handler}:\n{stack}"
+                )
+
+    def _should_log_stack(self, handler: str) -> bool:
+        if self.mode == "debug":
+            return True
+        now = time.monotonic()
+        if now - self._last_stack.get(handler, -self.cooldown) < self.cooldown:
+            return False
+        self._last_stack[handler] = now
+        return True
+
+
+watchdog = LoopWatchdog()
+registry.describe("bot_loop_blocked_seconds", "Сколько event loop был заблокирован синхронным кодом, с")
+registry.gauge("bot_loop_lag_seconds", "Последняя задержка event loop, с", lambda: round(watchdog.lag, 6))
@@ -0,0 +1,271 @@
+# bot/services/metrics.py
+"""
+Метрики бота: время ответа хендлеров и внешних вызовов, ошибки, очереди.
+
+    @timed("gpt_service.analyze_answer")  # sync, async и async-генераторы
+    async def analyze_answer(...): ...
+
+MetricsMiddleware замеряет каждый хендлер (message / callback_query) и
+открывает для апдейта трассу (tracing.py).
+Всё отдаётся в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics:
+
+    bot_handler_seconds{handler="topics.on_voice",quantile="0.95"} 7.31
+    bot_operation_seconds{op="gpt_service.transcribe_audio",quantile="0.5"} 2.04
+    bot_operation_errors_total{op="spreadsheet.save_answer"} 3
+
+Квантили (p50/p95/p99) считаются по последним WINDOW замерам каждой серии,
+_sum/_count — за всё время работы процесса.
+"""
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from bot.services.tracing import root_span, span, start_span
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # 0 — не поднимать endpoint
+WINDOW = 2048                   # замеров на серию для квантилей
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class _Series:
+    __slots__ = ("count", "total", "errors", "window")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.window: deque = deque(maxlen=WINDOW)
+
+
+class Registry:
+    """Сводки по длительностям + gauges, которые вычисляются при каждом запросе /metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()  # замеры приходят и из фоновых потоков
+        # (metric, label, value) -> _Series
+        self._series: Dict[Tuple[str, str, str], _Series] = {}
+        self._help: Dict[str, str] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], Any]]] = {}
+
+    def describe(self, metric: str, help_text: str):
+        self._help[metric] = help_text
+
+    def observe(self, metric: str, label: str, value: str, seconds: float, error: bool = False):
+        key = (metric, label, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series()
+            series.count += 1
+            series.total += seconds
+            series.window.append(seconds)
+            if error:
+                series.errors += 1
+
+    def gauge(self, name: str, help_text: str, fn: Callable[[], Any]):
+        """
+        fn() возвращает число или {значение_метки: число} (метка — "name"),
+        например {"learning": 120, "tests": 35}.
+        """
+        self._gauges[name] = (help_text, fn)
+
+    def snapshot(self, metric: str) -> Dict[str, dict]:
+        """{значение метки: {"count", "errors", "p50", "p95", "p99"}} — для логов и бенчмарков."""
+        with self._lock:
+            items = [(k[2], s.count, s.errors, sorted(s.window)) for k, s in self._series.items() if k[0] == metric]
+        return {
+            value: {"count": count, "errors": errors, **{f"p{int(q * 100)}": _quantile(w, q) for q in QUANTILES}}
+            for value, count, errors, w in items
+        }
+
+    def render(self) -> str:
+        """Текст в формате Prometheus exposition 0.0.4."""
+        lines = []
+        with self._lock:
+            series = sorted(
+                (k, s.count, s.total, s.errors, sorted(s.window)) for k, s in self._series.items()
+            )
+        seen = set()
+        errors = []
+        for (metric, label, value), count, total, errs, window in series:
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# HELP {metric} {self._help.get(metric, metric)}")
+                lines.append(f"# TYPE {metric} summary")
+            lbl = f'{label}="{_escape(value)}"'
+            for q in QUANTILES:
+                lines.append(f'{metric}{{{lbl},quantile="{q}"}} {_quantile(window, q):.6f}')
+            lines.append(f"{metric}_sum{{{lbl}}} {total:.6f}")
+            lines.append(f"{metric}_count{{{lbl}}} {count}")
+            errors.append((metric.replace("_seconds", "_errors_total"), lbl, errs))
+        for metric in sorted({m for m, _, _ in errors}):
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(f"{m}{{{lbl}}} {n}" for m, lbl, n in errors if m == metric)
+        for name, (help_text, fn) in sorted(self._gauges.items()):
+            try:
+                value = fn()
+            except Exception:
+                logger.exception(f"Не удалось посчитать метрику {name}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                lines.extend(f'{name}{{name="{_escape(str(k))}"}} {v}' for k, v in sorted(value.items()))
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _quantile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Registry()
+registry.describe("bot_handler_seconds", "Время обработки апдейта хендлером, с")
+registry.describe("bot_operation_seconds", "Время вызова сервиса (GPT, Whisper, SQLite, Sheets, PDF), с")
+
+
+# ───────── Замер функций ─────────
+def timed(op: str) -> Callable:
+    """
+    Декоратор: время каждого вызова → bot_operation_seconds{op=...}, исключения →
+    bot_operation_errors_total, плюс спан op в текущей трассе (см. tracing.py).
+    Для async-генераторов (стриминг) замеряется время до последнего чанка.
+    """
+    def decorator(fn: Callable) -> Callable:
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def agen_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                trace_span = start_span(op)  # не текущий: между чанками работает вызывающий код
+                error = None
+                try:
+                    async for item in fn(*args, **kwargs):
+                        yield item
+                except BaseException as e:
+                    if not isinstance(e, (GeneratorExit, asyncio.CancelledError)):
+                        error = e
+                    raise
+                finally:
+                    if trace_span is not None:
+                        trace_span.finish(error)
+                    registry.observe("bot_operation_seconds", "op", op, time.perf_counter() - started, error is not None)
+            return agen_wrapper
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                failed = True
+                try:
+                    with span(op):
+                        result = await fn(*args, **kwargs)
+                    failed = False
+                    return result
+                except asyncio.CancelledError:
+                    failed = False  # отмена (пользователь ушёл, таймаут выше) — не ошибка сервиса
+                    raise
+                finally:
+                    registry.observe("bot_operation_seconds", "op", op, time.perf_counter() - started, failed)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def sync_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            failed = True
+            try:
+                with span(op):
+                    result = fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                registry.observe("bot_operation_seconds", "op", op, time.perf_counter() - started, failed)
+        return sync_wrapper
+    return decorator
+
+
+# ───────── Хендлеры aiogram ─────────
+def handler_name(data: Dict[str, Any]) -> str:
+    """«модуль.функция» хендлера, который обрабатывает апдейт (кнопки — см. buttons.py)."""
+    handler = data.get("button_handler") or data.get("handler")
+    callback = getattr(handler, "callback", None)
+    if callback is None:
+        return "unknown"
+    module = getattr(callback, "__module__", "") or ""
+    return f"{module.rsplit('.', 1)[-1]}.{getattr(callback, '__qualname__', callback)}"
+
+
+class MetricsMiddleware:
+    """
+    Inner-middleware: время и ошибки каждого хендлера → bot_handler_seconds,
+    и корневой спан трассы апдейта (tracing.py) с user и handler. (Без наследования от aiogram.BaseMiddleware: модуль импортируют и сервисы без aiogram.)
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        name = handler_name(data)
+        user = getattr(event, "from_user", None)
+        started = time.perf_counter()
+        failed = True
+        try:
+            with root_span(name, user=user.id if user else None, event=type(event).__name__):
+                result = await handler(event, data)
+            failed = False
+            return result
+        finally:
+            registry.observe("bot_handler_seconds", "handler", name, time.perf_counter() - started, failed)
+
+
+def install_metrics(dp) -> MetricsMiddleware:
+    """
+    Подключить MetricsMiddleware к диспетчеру: inner-middleware диспетчера
+    aiogram применяет и к хендлерам всех вложенных роутеров.
+    """
+    middleware = MetricsMiddleware()
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)
+    return middleware
+
+
+# ───────── HTTP endpoint ─────────
+async def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    """Поднять /metrics в текущем event loop (в фоне). port=0 — выключено."""
+    if not port:
+        return None
+    from aiohttp import web
+
+    async def handle(_request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    try:
+        await site.start()
+    except OSError as e:
+        logger.warning(f"Метрики недоступны: порт {host}:{port} занят ({e})")
+        await runner.cleanup()
+        return None
+    logger.info(f"📊 Метрики: http://{host}:{port}/metrics")
+    return runner
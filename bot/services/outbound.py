@@ -0,0 +1,226 @@
+# bot/services/outbound.py
+"""
+Очередь исходящих запросов к Telegram (middleware сессии aiogram).
+
+Хендлеры по-прежнему просто вызывают m.answer / bot.send_message /
+answer_document, а все запросы с chat_id проходят через планировщик:
+
+  • у каждого чата своя очередь — сообщения уходят строго по порядку;
+  • частота на чат ограничена (личка ~1/с, группы ~20/мин), а общая —
+    глобальным token bucket (~30/с), как требует Telegram;
+  • TelegramRetryAfter не долетает до хендлера: чат ставится на паузу
+    на retry_after секунд, и запрос повторяется;
+  • если в очереди чата скопилось несколько коротких текстовых сообщений,
+    они склеиваются в одно (все вызывающие получают одно и то же Message).
+
+Сообщения, которые потом будут редактироваться (заглушки стриминга),
+склеивать нельзя — их отправляют внутри `with editable():`.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, List, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from bot.services.rate_limit import TokenBucket
+from bot.services.tracing import span
+
+logger = logging.getLogger(__name__)
+
+TG_GLOBAL_RPS = float(os.getenv("TG_GLOBAL_RPS", "30"))   # запросов в секунду на всего бота
+TG_CHAT_RPS = float(os.getenv("TG_CHAT_RPS", "1"))        # в секунду на личный чат
+TG_GROUP_RPM = float(os.getenv("TG_GROUP_RPM", "20"))     # в минуту на группу
+CHAT_BURST = 3            # столько сообщений в чат можно отправить подряд без паузы
+MAX_RETRIES = 5           # повторов после TelegramRetryAfter
+MERGE_MAX_LEN = 500       # склеиваем только сообщения не длиннее
+MERGE_LIMIT = 4096        # и только если вместе они влезают в одно сообщение
+MERGE_SEPARATOR = "\n\n"
+CHAT_BUCKETS_MAX = 10000  # сколько чатов помнить (LRU) для ограничения частоты
+
+_no_merge: contextvars.ContextVar[bool] = contextvars.ContextVar("outbound_no_merge", default=False)
+
+
+@contextmanager
+def editable():
+    """Отправленные внутри сообщения не склеиваются с соседними (их будут редактировать)."""
+    token = _no_merge.set(True)
+    try:
+        yield
+    finally:
+        _no_merge.reset(token)
+
+
+class _Job:
+    __slots__ = ("method", "make_request", "future", "mergeable")
+
+    def __init__(self, method, make_request, future, mergeable: bool):
+        self.method = method
+        self.make_request = make_request
+        self.future = future
+        self.mergeable = mergeable
+
+
+def _can_merge(method) -> bool:
+    return (
+        isinstance(method, SendMessage)
+        and len(method.text) <= MERGE_MAX_LEN
+        and method.entities is None
+        and method.reply_to_message_id is None
+        and method.message_thread_id is None
+    )
+
+
+def _same_format(a: SendMessage, b: SendMessage) -> bool:
+    return (
+        a.parse_mode == b.parse_mode
+        and a.disable_web_page_preview == b.disable_web_page_preview
+        and a.disable_notification == b.disable_notification
+        and a.protect_content == b.protect_content
+    )
+
+
+def _merge(methods: List[SendMessage]) -> SendMessage:
+    # клавиатура может быть только у последнего сообщения группы (см. _take_group)
+    return methods[0].model_copy(update={
+        "text": MERGE_SEPARATOR.join(m.text for m in methods),
+        "reply_markup": methods[-1].reply_markup,
+    })
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Per-chat очереди + глобальный лимит. Подключается в main.create_bot()."""
+
+    def __init__(
+        self,
+        global_rps: float = TG_GLOBAL_RPS,
+        chat_rps: float = TG_CHAT_RPS,
+        group_rpm: float = TG_GROUP_RPM,
+    ):
+        self.global_bucket = TokenBucket(rate=global_rps, capacity=global_rps)
+        self.chat_rps = chat_rps
+        self.group_rpm = group_rpm
+        self._queues: dict = {}
+        self._buckets: "OrderedDict[Any, TokenBucket]" = OrderedDict()
+        self.sent = 0          # запросов отправлено
+        self.merged = 0        # сообщений склеено с предыдущими
+        self.retried = 0       # повторов после RetryAfter
+
+    def stats(self) -> dict:
+        return {
+            "queued": sum(len(q) for q in self._queues.values()),
+            "chats": len(self._queues),
+            "sent": self.sent,
+            "merged": self.merged,
+            "retried": self.retried,
+        }
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rpm / 60.0 if group else self.chat_rps
+            bucket = self._buckets[chat_id] = TokenBucket(rate=rate, capacity=CHAT_BURST)
+            if len(self._buckets) > CHAT_BUCKETS_MAX:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(chat_id)
+        return bucket
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        # в трассе апдейта — время запроса вместе с ожиданием своей очереди
+        with span(f"telegram.{type(method).__name__}"):
+            if chat_id is None:
+                return await make_request(bot, method)
+
+            future = asyncio.get_running_loop().create_future()
+            job = _Job(method, make_request, future, mergeable=not _no_merge.get() and _can_merge(method))
+            queue = self._queues.get(chat_id)
+            if queue is None:
+                queue = self._queues[chat_id] = deque()
+                queue.append(job)
+                asyncio.create_task(self._drain(chat_id, queue, bot))
+            else:
+                queue.append(job)
+            return await future
+
+    # ── очередь чата ──
+    async def _wait_turn(self, chat_bucket: TokenBucket):
+        while True:
+            wait = max(chat_bucket.wait_time(), self.global_bucket.wait_time())
+            if wait <= 0:
+                chat_bucket.take()
+                self.global_bucket.take()
+                return
+            await asyncio.sleep(wait)
+
+    def _take_group(self, queue: Deque[_Job]) -> List[_Job]:
+        """Голова очереди + идущие за ней короткие сообщения, которые можно склеить."""
+        group = [queue.popleft()]
+        head = group[0]
+        if not head.mergeable:
+            return group
+        length = len(head.method.text)
+        while queue and head.method.reply_markup is None:
+            nxt = queue[0]
+            if not (nxt.mergeable and _same_format(head.method, nxt.method)):
+                break
+            length += len(MERGE_SEPARATOR) + len(nxt.method.text)
+            if length > MERGE_LIMIT:
+                break
+            group.append(queue.popleft())
+            head = nxt
+        return group
+
+    async def _drain(self, chat_id, queue: Deque[_Job], bot):
+        try:
+            while queue:
+                await self._wait_turn(self._chat_bucket(chat_id))
+                # за время ожидания в очередь могли добавиться сообщения — склеиваем
+                group = [job for job in self._take_group(queue) if not job.future.cancelled()]
+                if not group:
+                    continue
+                if len(group) == 1:
+                    method = group[0].method
+                else:
+                    method = _merge([job.method for job in group])
+                    self.merged += len(group) - 1
+                await self._send(chat_id, group, method, bot)
+        finally:
+            self._queues.pop(chat_id, None)
+
+    async def _send(self, chat_id, group: List[_Job], method, bot):
+        result: Optional[Any] = None
+        error: Optional[BaseException] = None
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                result = await group[0].make_request(bot, method)
+                self.sent += 1
+                break
+            except TelegramRetryAfter as e:
+                if attempt == MAX_RETRIES:
+                    error = e
+                    break
+                self.retried += 1
+                logger.warning(f"Telegram просит подождать {e.retry_after}с (чат {chat_id}), повторяю")
+                # пауза только для этого чата; остальные очереди продолжают работу
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                error = e
+                break
+        for job in group:
+            if job.future.done():
+                continue
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+
+outbound = OutboundScheduler()
@@ -21,6 +21,7 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 
 from bot.utils import ALL_TOPICS
+from bot.services.metrics import timed
 
 # ───────── Палитра ─────────
 CLR_ORANGE     = "#f5c679"   # светлооранжевый (бренд)
@@ -34,7 +35,7 @@ _THIS_DIR     = os.path.dirname(__file__)                    # bot/services
 _PROJECT_ROOT = os.path.normpath(os.path.join(_THIS_DIR, "..", ".."))
 FONTS_DIR     = os.path.join(_PROJECT_ROOT, "Fonts")
 # важно: shared/test_answers.db лежит в корне проекта рядом с папкой bot
-DB_ANSWERS    = os.path.join(_PROJECT_ROOT, "shared", "test_answers.db")
+DB_ANSWERS    = os.getenv("ANSWERS_DB") or os.path.join(_PROJECT_ROOT, "shared", "test_answers.db")
 LOGO_PATH     = os.path.join(FONTS_DIR, "Logo_Low.png")      # путь к логотипу (если есть)
 
 # ───────── Тестовый режим (заглушки) ─────────
@@ -349,6 +350,7 @@ def _load_test_stats(user_id: int) -> Dict[int, Tuple[int, int]]:
     return stats
 
 
+@timed("pdf_generator.make_report")
 def make_report(user_id: int, fullname: str, records: List[dict], filename: str = "report.pdf") -> str:
     """
     Собирает PDF-отчёт:
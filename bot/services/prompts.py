@@ -0,0 +1,193 @@
+# bot/services/prompts.py
+"""
+Промпты для gpt-4o: сборка сообщений и подсчёт токенов.
+
+  - токены считаются локально: tiktoken (если установлен; словарь gpt-4o),
+    иначе оценка ~3 символа на токен для русского текста;
+  - статичные инструкции — всегда первыми и байт-в-байт одинаковые (system),
+    всё, что меняется от запроса к запросу (тема, учебник, ответ ученика), —
+    в конце, в сообщении user. Кэш промптов OpenAI от этого не включится:
+    он работает с 1024 токенов общего префикса, а наши инструкции — пара сотен
+    токенов. Сколько взято из кэша, всё равно считаем (cached_tokens) — по
+    данным API;
+  - контекст учебника обрезается по бюджету: не больше PROMPT_CONTEXT_TOKENS
+    и так, чтобы весь промпт уложился в PROMPT_MAX_TOKENS;
+  - расход каждого запроса — в лог и в метрики по операции:
+
+        🧮 analyze_answer: промпт 1830 ток. (из кэша 0), ответ 212 ток.
+        bot_prompt_tokens{name="analyze_answer"} 183000
+"""
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from typing import Optional
+
+from bot.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "6000"))          # весь промпт одного запроса
+PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", "1500"))  # контекст учебника в нём
+CLASSIFY_TRANSCRIPT_TOKENS = 1000   # теме хватает начала ответа
+
+CHARS_PER_TOKEN = 3      # оценка без tiktoken
+MESSAGE_OVERHEAD = 4     # служебные токены на сообщение в chat-формате
+REPLY_PRIMING = 3        # и на начало ответа ассистента
+
+try:
+    import tiktoken
+except ImportError:  # не обязателен: без него — оценка по длине
+    tiktoken = None
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding
+    if tiktoken is None:
+        return None
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                _encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:  # старый tiktoken или словарь не скачать
+                logger.warning(f"tiktoken недоступен ({e}), токены считаются по длине текста")
+                _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def count_messages(messages: list[dict]) -> int:
+    """Токены промпта в chat-формате (как их посчитает API, с точностью до пары токенов)."""
+    return sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD for m in messages) + REPLY_PRIMING
+
+
+_BOUNDARY_RE = re.compile(r"(?:\n\s*\n|[.!?…]\s)")
+
+
+def trim_tokens(text: str, budget: int) -> str:
+    """
+    Обрезает текст до budget токенов. Режет по концу абзаца или предложения,
+    если он не слишком далеко от границы бюджета, иначе — ровно по бюджету.
+    """
+    if budget <= 0:
+        return ""
+    if count_tokens(text) <= budget:
+        return text
+    encoding = _get_encoding()
+    if encoding is not None:
+        cut = encoding.decode(encoding.encode(text)[:budget])
+    else:
+        cut = text[: budget * CHARS_PER_TOKEN]
+    ends = [m.end() for m in _BOUNDARY_RE.finditer(cut)]
+    if ends and ends[-1] >= len(cut) * 2 // 3:
+        cut = cut[: ends[-1]]
+    return cut.rstrip()
+
+
+# ───────── Статичные инструкции (префикс промпта) ─────────
+ANALYZE_SYSTEM = (
+    "Ты — учитель органической химии и проверяешь устный ответ ученика. "
+    "Тебе дадут тему, текст учебника по ней и ответ ученика. "
+    "Сверь ответ с учебником: отметь, где он точно повторил текст, "
+    "где допустил неточности или упустил важное. Ответь тёплым комментарием от учителя."
+)
+
+TEACH_SYSTEM = (
+    "Ты — опытный преподаватель по органической химии."
+    "Твоя задача — объяснять теорию простыми словами,,без приветствий, без сложных терминов, с примерами из жизни, как если бы рассказывал ученику на уроке."
+    "Преобразуй данный фрагмент учебника в связную, логичную часть большой лекции по теме, для подготовки к ЕГЭ по химии, чтобы все части курса, прочитанные подряд, легко складывались в одно целое и не повторялись."
+    "Пиши дружелюбно, последовательно, избегай длинных и сложных предложений."
+    "Текст будет отправлен через Телеграм."
+    ""
+    "ОФОРМЛЕНИЕ:"
+    "— Делай короткие абзацы (максимум 3–4 строки)."
+    "— Формулы и химические реакции выделяй отдельно, в отдельной строке, между пустыми строками."
+    "— Формулы пиши в моноширинном стиле: обрами их тройными обратными кавычками (```)."
+    "— Важные мысли отмечай эмодзи, например: 📌, 🔥, ⚡, 💡."
+    "— Не делай простыню — разбивай объяснение на блоки: определение, пример, вывод, реакция."
+    "— Если встречаются сложные термины — объясняй их простым языком."
+    "В конце спроси: Всё ли понятно? Если остались вопросы — обязательно спрашивай!"
+)
+
+QUESTION_SYSTEM = (
+    "Ты — преподаватель органической химии. Ученик проходит курс и задаёт "
+    "вопрос по текущей теме. Отвечай очень понятно и коротко."
+)
+
+CLASSIFY_PREFIX = "Определи тему по органической химии из этого ответа:\n\n"
+
+
+# ───────── Сборка сообщений ─────────
+def analyze_messages(transcript: str, topic: str, textbook_context: str) -> list[dict]:
+    """Проверка ответа: инструкции в system, учебник и ответ — в user, учебник по бюджету."""
+    transcript = trim_tokens(transcript, PROMPT_MAX_TOKENS // 2)
+    head = f"Тема: «{topic}»\n\nТекст учебника:\n\n"
+    tail = f"\n\nОтвет ученика:\n\"{transcript}\""
+    fixed = count_messages([
+        {"role": "system", "content": ANALYZE_SYSTEM},
+        {"role": "user", "content": head + tail},
+    ])
+    budget = min(PROMPT_CONTEXT_TOKENS, PROMPT_MAX_TOKENS - fixed)
+    context = trim_tokens(textbook_context, budget)
+    if len(context) < len(textbook_context):
+        logger.info(f"✂️ Контекст учебника обрезан до {budget} токенов")
+    return [
+        {"role": "system", "content": ANALYZE_SYSTEM},
+        {"role": "user", "content": head + context + tail},
+    ]
+
+
+def teach_messages(chunk: str) -> list[dict]:
+    return [
+        {"role": "system", "content": TEACH_SYSTEM},
+        {"role": "user", "content": trim_tokens(chunk, PROMPT_MAX_TOKENS - count_tokens(TEACH_SYSTEM))},
+    ]
+
+
+def question_messages(topic: str, question: str) -> list[dict]:
+    # тема — в user: system один на все темы
+    question = trim_tokens(question, PROMPT_MAX_TOKENS // 2)
+    return [
+        {"role": "system", "content": QUESTION_SYSTEM},
+        {"role": "user", "content": f"Тема: «{topic}»\n\nВопрос: {question}"},
+    ]
+
+
+def classify_messages(transcript: str) -> list[dict]:
+    return [{"role": "user", "content": CLASSIFY_PREFIX + trim_tokens(transcript, CLASSIFY_TRANSCRIPT_TOKENS)}]
+
+
+# ───────── Учёт расхода ─────────
+prompt_tokens: Counter = Counter()       # операция -> токенов промпта
+cached_tokens: Counter = Counter()       # операция -> из них взято из кэша провайдера
+completion_tokens: Counter = Counter()   # операция -> токенов ответа
+
+
+def record_usage(op: str, prompt: int, completion: int, cached: int = 0, usage: Optional[dict] = None):
+    """
+    Учесть расход запроса. usage — resp.usage из API (точные числа), без него
+    (стрим) — локальный подсчёт prompt/completion.
+    """
+    if usage:
+        prompt = usage.get("prompt_tokens", prompt)
+        completion = usage.get("completion_tokens", completion)
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", cached)
+    prompt_tokens[op] += prompt
+    cached_tokens[op] += cached
+    completion_tokens[op] += completion
+    logger.info(f"🧮 {op}: промпт {prompt} ток. (из кэша {cached}), ответ {completion} ток.")
+
+
+registry.gauge("bot_prompt_tokens", "Токенов в промптах к GPT с запуска, по операциям", lambda: dict(prompt_tokens))
+registry.gauge("bot_prompt_cached_tokens", "Из них взято из кэша промптов OpenAI", lambda: dict(cached_tokens))
+registry.gauge("bot_completion_tokens", "Токенов в ответах GPT с запуска, по операциям", lambda: dict(completion_tokens))
@@ -0,0 +1,112 @@
+# bot/services/question_bank.py
+"""
+Банк вопросов тестов (tests1.db) в памяти.
+
+Вопросы читаются один раз при старте, дальше показ вопроса, проверка
+ответа и подсказка — поиск в словаре. Если файл базы поменялся (залили
+новые задания), банк перечитывается при следующем обращении, а version
+увеличивается — по нему сбрасываются готовые клавиатуры и карточки
+(bot/keyboards/keyboards.py).
+"""
+import os
+import time
+import sqlite3
+import logging
+from typing import Dict, List, Optional
+
+from bot.services import test_sql
+
+logger = logging.getLogger(__name__)
+
+CHECK_INTERVAL = 5.0  # секунд между проверками mtime файла базы
+
+
+class QuestionBank:
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._by_id: Dict[int, dict] = {}
+        self._by_type: Dict[object, List[int]] = {}
+        self._types: list = []
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._version = 0
+
+    def _db_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.db_file).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        """Перечитать все вопросы из базы."""
+        mtime = self._db_mtime()
+        try:
+            if mtime is None:
+                types, questions = [], []
+            else:
+                types, questions = test_sql.get_all_tests_types(), test_sql.get_all_questions()
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Не удалось прочитать вопросы тестов: {e}")
+            types, questions = [], []
+        by_type: Dict[object, List[int]] = {}
+        for q in questions:
+            by_type.setdefault(_type_key(q["type"]), []).append(q["id"])
+        # подменяем целиком: load() может идти в фоновом потоке (предзагрузка)
+        self._types = types
+        self._by_id = {q["id"]: q for q in questions}
+        self._by_type = by_type
+        self._mtime = mtime
+        self._checked_at = time.monotonic()
+        self._version += 1
+        logger.info(f"📝 Загружено вопросов тестов: {len(self._by_id)} (тестов: {len(self._types)})")
+
+    def invalidate(self):
+        """Сбросить кэш: вопросы перечитаются при следующем обращении."""
+        self._checked_at = 0.0
+        self._mtime = -1.0
+
+    def _refresh_if_changed(self):
+        now = time.monotonic()
+        if now - self._checked_at < CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        if self._db_mtime() != self._mtime:
+            self.load()
+
+    @property
+    def version(self) -> int:
+        """Номер загрузки банка: меняется, когда вопросы перечитаны."""
+        self._refresh_if_changed()
+        return self._version
+
+    def types(self) -> list:
+        """Номера тестов по порядку (как get_all_tests_types)."""
+        self._refresh_if_changed()
+        return self._types
+
+    def question(self, q_id: int) -> Optional[dict]:
+        """Вопрос по id (как get_question_by_id). Словарь общий — не изменять!"""
+        self._refresh_if_changed()
+        return self._by_id.get(q_id)
+
+    def question_ids(self, test_type) -> List[int]:
+        """id вопросов теста по порядку."""
+        self._refresh_if_changed()
+        return list(self._by_type.get(_type_key(test_type), []))
+
+    def __len__(self):
+        return len(self._by_id)
+
+
+def _type_key(value):
+    """
+    Номер теста как ключ: в базе type может лежать текстом ("12"), а хендлеры
+    спрашивают числом (12). SQL-запрос это прощал, словарь — нет.
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+question_bank = QuestionBank(test_sql.DB_FILE)
@@ -0,0 +1,258 @@
+# bot/services/quotas.py
+"""
+Лимиты ученика на дорогие ИИ-операции: голосовые (Whisper), проверку
+ответов и вопросы по курсу (GPT). Один ученик, который засыпает бота
+голосовыми, не должен съесть бюджет OpenAI и воркеров заданий за всех.
+
+Хендлер помечается флагом (для кнопок — router.button(..., quota=...)):
+
+    @router.message(lambda m: m.voice is not None, flags={"quota": "voice"})
+    @router.message(..., flags={"quota": "gpt"})
+
+и QuotaMiddleware перед вызовом проверяет:
+  - частоту — token bucket на ученика: RATE запросов в минуту, подряд
+    не больше BURST;
+  - дневные квоты — секунды голосовых и токены GPT. Секунды списываются
+    при приёме голосового (длительность известна сразу), токены — по факту
+    расхода (gpt_service вызывает charge_tokens по resp.usage).
+
+Лимит исчерпан — хендлер не вызывается, ученик получает ответ, когда
+можно снова. Дневные счётчики — в таблице quota_usage базы ответов
+(переживают перезапуск), в памяти — только сегодняшние: апдейты и задания
+ученика обрабатывает один процесс (см. bot/webhook.py). Счётчики пишет свой
+фоновый поток (quota-writer), а не общий db_writer: списание на каждый запрос
+не должно задерживать flush() хендлеров тестов.
+
+Лимиты по ролям: QUOTA_<РОЛЬ>_<ЛИМИТ>, например QUOTA_STUDENT_GPT_TOKENS=100000,
+0 — без ограничения. Роль — по TEACHER_IDS / ADMIN_IDS (id через запятую),
+остальные — student.
+"""
+import atexit
+import logging
+import os
+import sqlite3
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from bot.services.answer_db import DB_FILE
+from bot.services.db_writer import DBWriter
+from bot.services.metrics import registry
+from bot.services.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+_DEFAULTS = {
+    #            запросов/мин  подряд  секунд голосовых/день  токенов GPT/день
+    "student": {"rate": 6,  "burst": 3,  "voice_seconds": 1800,     "gpt_tokens": 100_000},
+    "teacher": {"rate": 30, "burst": 10, "voice_seconds": 4 * 3600, "gpt_tokens": 500_000},
+    "admin":   {"rate": 0,  "burst": 0,  "voice_seconds": 0,        "gpt_tokens": 0},
+}
+LIMITS = {
+    role: {name: float(os.getenv(f"QUOTA_{role.upper()}_{name.upper()}", default)) for name, default in limits.items()}
+    for role, limits in _DEFAULTS.items()
+}
+QUOTA_KEEP_DAYS = int(os.getenv("QUOTA_KEEP_DAYS", "30"))   # сколько дней хранить счётчики
+
+
+def _ids(name: str) -> set:
+    return {int(x) for x in os.getenv(name, "").replace(" ", "").split(",") if x}
+
+
+_writer = DBWriter("quota-writer")
+atexit.register(_writer.close)
+
+ADMIN_IDS = _ids("ADMIN_IDS")
+TEACHER_IDS = _ids("TEACHER_IDS")
+
+RATE_LIMITED = "⏳ Не так быстро — слишком много запросов подряд. Можно снова через {wait} с."
+VOICE_EXHAUSTED = (
+    "🎙 На сегодня осталось {left} голосовых из {limit}, а это сообщение длиннее. "
+    "Запиши покороче или ответь текстом — лимит обновится в полночь."
+)
+GPT_EXHAUSTED = (
+    "🤖 Проверки и вопросы к ИИ на сегодня закончились — лимит обновится в полночь. "
+    "А пока можно пройти тесты 📝"
+)
+
+
+def role_of(user_id: int) -> str:
+    if user_id in ADMIN_IDS:
+        return "admin"
+    if user_id in TEACHER_IDS:
+        return "teacher"
+    return "student"
+
+
+def _today() -> str:
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def _minutes(seconds: float) -> str:
+    return f"{int(seconds // 60)} мин" if seconds >= 60 else f"{int(seconds)} с"
+
+
+# ========================
+#   SQLite
+# ========================
+def init_quota_table():
+    """
+    Создаёт таблицу дневных счётчиков, если её ещё нет.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS quota_usage (
+                user_id INTEGER,
+                day TEXT,
+                voice_seconds REAL DEFAULT 0,
+                gpt_tokens INTEGER DEFAULT 0,
+                requests INTEGER DEFAULT 0,
+                PRIMARY KEY (user_id, day)
+            )
+        ''')
+        conn.commit()
+
+
+def _add_usage(user_id: int, day: str, voice_seconds: float, gpt_tokens: int, requests: int):
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.execute('''
+            INSERT INTO quota_usage (user_id, day, voice_seconds, gpt_tokens, requests)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, day) DO UPDATE SET
+                voice_seconds = voice_seconds + excluded.voice_seconds,
+                gpt_tokens = gpt_tokens + excluded.gpt_tokens,
+                requests = requests + excluded.requests
+        ''', (user_id, day, voice_seconds, gpt_tokens, requests))
+        conn.commit()
+
+
+def _load_day(day: str) -> Dict[int, List[float]]:
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute("SELECT user_id, voice_seconds, gpt_tokens, requests FROM quota_usage WHERE day=?", (day,))
+        return {uid: [voice, tokens, requests] for uid, voice, tokens, requests in c.fetchall()}
+
+
+def _purge(before: str):
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.execute("DELETE FROM quota_usage WHERE day < ?", (before,))
+        conn.commit()
+
+
+# ========================
+#   Лимиты
+# ========================
+class Quotas:
+    def __init__(self, limits: Dict[str, Dict[str, float]] = LIMITS):
+        self.limits = limits
+        self.rejected: Counter = Counter()        # причина -> сколько запросов отклонено
+        self._day: Optional[str] = None
+        self._usage: Dict[int, List[float]] = {}  # user_id -> [секунд голосовых, токенов GPT, запросов] за сегодня
+        self._buckets: Dict[int, TokenBucket] = {}
+
+    def load(self):
+        """Поднять сегодняшние счётчики из базы (при старте бота)."""
+        init_quota_table()
+        self._day = _today()
+        self._usage = _load_day(self._day)
+        self._buckets = {}
+        _purge((datetime.now() - timedelta(days=QUOTA_KEEP_DAYS)).strftime("%Y-%m-%d"))
+
+    def _today(self, user_id: int) -> List[float]:
+        if self._day is None:
+            self.load()
+        elif self._day != _today():   # полночь: счётчики с нуля
+            self._day = _today()
+            self._usage = {}
+            self._buckets = {}
+        return self._usage.setdefault(user_id, [0.0, 0, 0])
+
+    def _add(self, user_id: int, voice_seconds: float = 0.0, gpt_tokens: int = 0, requests: int = 0):
+        usage = self._today(user_id)
+        usage[0] += voice_seconds
+        usage[1] += gpt_tokens
+        usage[2] += requests
+        _writer.submit(_add_usage, user_id, self._day, voice_seconds, gpt_tokens, requests)
+
+    def usage(self, user_id: int) -> Dict[str, float]:
+        voice, tokens, requests = self._today(user_id)
+        return {"voice_seconds": voice, "gpt_tokens": tokens, "requests": requests}
+
+    def check(self, user_id: int, kind: str, voice_seconds: float = 0.0) -> Optional[str]:
+        """
+        Пропустить запрос вида kind ("voice" | "gpt") или вернуть текст отказа.
+        Пропущенный запрос сразу списывается: одна попытка из ведра, секунды голосового.
+        """
+        limits = self.limits[role_of(user_id)]
+        voice, tokens, _ = self._today(user_id)
+        if limits["gpt_tokens"] and tokens >= limits["gpt_tokens"]:
+            return self._reject("gpt_tokens", GPT_EXHAUSTED)
+        if kind == "voice" and limits["voice_seconds"] and voice + voice_seconds > limits["voice_seconds"]:
+            left = max(0.0, limits["voice_seconds"] - voice)
+            return self._reject("voice_seconds", VOICE_EXHAUSTED.format(
+                left=_minutes(left), limit=_minutes(limits["voice_seconds"])
+            ))
+        if limits["rate"]:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = TokenBucket(limits["rate"] / 60.0, max(1.0, limits["burst"]))
+            wait = bucket.wait_time(1)
+            if wait > 0:
+                return self._reject("rate", RATE_LIMITED.format(wait=int(wait) + 1))
+            bucket.take(1)
+        self._add(user_id, voice_seconds=voice_seconds if kind == "voice" else 0.0, requests=1)
+        return None
+
+    def charge_tokens(self, user_id: Optional[int], tokens: int):
+        """Списать фактический расход GPT (вызывается из gpt_service). Без ученика — не считаем."""
+        if user_id is None or tokens <= 0:
+            return
+        self._add(user_id, gpt_tokens=tokens)
+
+    def _reject(self, reason: str, text: str) -> str:
+        self.rejected[reason] += 1
+        return text
+
+
+quotas = Quotas()
+registry.gauge("bot_quota_rejected", "Запросов к ИИ, отклонённых лимитами, по причинам", lambda: dict(quotas.rejected))
+registry.gauge("bot_quota_writer_pending", "Записей счётчиков лимитов в очереди", lambda: _writer.pending)
+
+
+# ========================
+#   Middleware aiogram
+# ========================
+class QuotaMiddleware:
+    """
+    Inner-middleware: для хендлеров с флагом quota проверяет лимиты ученика и
+    при отказе отвечает ему вместо вызова хендлера. (Без наследования от
+    aiogram.BaseMiddleware — как MetricsMiddleware.)
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        target = data.get("button_handler") or data.get("handler")
+        kind = (getattr(target, "flags", None) or {}).get("quota")
+        user = getattr(event, "from_user", None)
+        if kind is None or user is None:
+            return await handler(event, data)
+        voice = getattr(event, "voice", None)
+        refusal = quotas.check(user.id, kind, voice.duration if voice is not None else 0.0)
+        if refusal is not None:
+            logger.info(f"🚦 Лимит ученика {user.id} ({kind}): запрос отклонён")
+            await event.answer(refusal)
+            return None
+        return await handler(event, data)
+
+
+def install_quotas(dp) -> QuotaMiddleware:
+    """Подключить QuotaMiddleware к диспетчеру (после install_metrics — отказы тоже в метриках)."""
+    middleware = QuotaMiddleware()
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)
+    return middleware
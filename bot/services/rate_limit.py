@@ -0,0 +1,55 @@
+# bot/services/rate_limit.py
+"""
+Token bucket — общий примитив для ограничения частоты (OpenAI, Telegram и т.п.).
+"""
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Ведро на capacity токенов, пополняется со скоростью rate токенов в секунду.
+    Уровень может уйти в минус (долг), если реальный расход оказался больше оценки.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    @classmethod
+    def per_minute(cls, limit: float) -> "TokenBucket":
+        """Ведро под лимит вида «N в минуту» (RPM/TPM), полный запас — на минуту."""
+        return cls(rate=limit / 60.0, capacity=limit)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float = 1.0, reserve: float = 0.0) -> float:
+        """
+        Сколько секунд ждать, чтобы после списания amount в ведре осталось
+        не меньше reserve * capacity. 0 — можно списывать сразу.
+        """
+        self._refill()
+        amount = min(amount, self.capacity)
+        need = amount + reserve * self.capacity - self.tokens
+        if need <= 0:
+            return 0.0
+        return need / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, amount: float = 1.0):
+        """Списать токены без ожидания (может увести уровень в минус)."""
+        self._refill()
+        self.tokens -= amount
+
+    async def acquire(self, amount: float = 1.0):
+        """Дождаться наличия amount токенов и списать их."""
+        while True:
+            wait = self.wait_time(amount)
+            if wait <= 0:
+                self.take(amount)
+                return
+            await asyncio.sleep(wait)
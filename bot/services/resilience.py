@@ -0,0 +1,239 @@
+# bot/services/resilience.py
+"""
+Устойчивость к сбоям внешних API (OpenAI, Whisper, Google Sheets).
+
+Когда провайдер тормозит, хендлеры не должны ждать его бесконечно и копить
+запросы. Каждый внешний вызов идёт через Policy:
+
+    SHEETS = Policy("sheets", deadline=10, attempts=3, retryable=_sheets_retryable)
+    rows = SHEETS.call_sync(sheet.get_all_records)
+    resp = await GPT.call(openai.ChatCompletion.acreate, ..., deadline=30)
+
+  - deadline — общий срок на все попытки вместе с паузами;
+  - повторы с экспоненциальной паузой и full jitter (не все клиенты
+    повторяют одновременно);
+  - retry budget — повторов не больше RETRY_RATIO от числа запросов, чтобы
+    при аварии провайдера повторы не умножали нагрузку;
+  - circuit breaker — после BREAKER_FAILURES сбоев подряд вызовы сразу
+    падают с CircuitOpen, через BREAKER_RESET секунд пропускается одна
+    пробная попытка.
+
+Исчерпав всё это, Policy бросает ServiceUnavailable — вызывающий код
+переходит на запасной вариант (кэш ответов, отложенная проверка через
+очередь заданий, локальная копия таблицы).
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from bot.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))   # сбоев подряд до размыкания
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", "30"))      # секунд до пробной попытки
+RETRY_RATIO = float(os.getenv("RETRY_RATIO", "0.2"))         # повторов на один запрос (в среднем)
+RETRY_MIN_TOKENS = 10.0   # запас повторов, когда запросов мало
+
+T = TypeVar("T")
+
+
+class ServiceUnavailable(Exception):
+    """Внешний сервис не ответил за отведённое время / попытки — нужен запасной вариант."""
+
+    def __init__(self, service: str, message: str = "", retry_after: float = 0.0):
+        super().__init__(f"{service}: {message}" if message else service)
+        self.service = service
+        self.retry_after = retry_after   # через сколько секунд имеет смысл пробовать снова
+
+
+class CircuitOpen(ServiceUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """closed → (BREAKER_FAILURES сбоев подряд) → open → (BREAKER_RESET с) → half_open → closed / open."""
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset_timeout: float = BREAKER_RESET):
+        self.name = name
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.opened = 0             # сколько раз размыкался
+        self._streak = 0
+        self._opened_at = 0.0
+        self._probe_at = 0.0        # когда ушла пробная попытка (0 — не идёт)
+        self._lock = threading.Lock()  # Sheets вызываются из потоков
+
+    def retry_after(self) -> float:
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def fail_fast(self):
+        """CircuitOpen, если предохранитель разомкнут и до пробы ещё далеко (пробу не занимает)."""
+        if self.state == "open" and self.retry_after() > 0:
+            raise CircuitOpen(self.name, "circuit open", self.retry_after())
+
+    def check(self):
+        """Пропустить вызов или бросить CircuitOpen."""
+        with self._lock:
+            if self.state == "closed":
+                return
+            now = time.monotonic()
+            if self.state == "open" and now - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probe_at = 0.0
+            # проба, которая так и не отчиталась (отменили), через reset_timeout уступает место новой
+            if self.state == "half_open" and now - self._probe_at >= self.reset_timeout:
+                self._probe_at = now
+                return
+        raise CircuitOpen(self.name, "circuit open", self.retry_after())
+
+    def success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"🔌 {self.name}: сервис снова отвечает")
+            self.state = "closed"
+            self._streak = 0
+            self._probe_at = 0.0
+
+    def failure(self):
+        with self._lock:
+            self._streak += 1
+            if self.state == "half_open" or (self.state == "closed" and self._streak >= self.failures):
+                if self.state == "closed":
+                    logger.warning(f"🔌 {self.name}: {self._streak} сбоев подряд, вызовы отключены на {self.reset_timeout:.0f} с")
+                self.state = "open"
+                self.opened += 1
+                self._opened_at = time.monotonic()
+                self._probe_at = 0.0
+
+
+class RetryBudget:
+    """Каждый запрос добавляет ratio токена, каждый повтор тратит один."""
+
+    def __init__(self, ratio: float = RETRY_RATIO, cap: float = RETRY_MIN_TOKENS):
+        self.ratio = ratio
+        self.cap = cap
+        self.tokens = cap
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.cap, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Full jitter: случайная пауза от 0 до base·2^attempt (не больше cap)."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class Policy:
+    def __init__(
+        self,
+        name: str,
+        deadline: float,
+        attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        retryable: Callable[[BaseException], bool] = lambda e: True,
+    ):
+        self.name = name
+        self.deadline = deadline
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retryable = retryable
+        self.breaker = CircuitBreaker(name)
+        self.budget = RetryBudget()
+        _policies[name] = self
+
+    def _next_delay(self, attempt: int, error: BaseException, end: float) -> Optional[float]:
+        """Пауза перед следующей попыткой или None — больше не пробуем."""
+        if attempt + 1 >= self.attempts or self.breaker.state == "open":
+            return None
+        delay = max(backoff(attempt, self.base_delay, self.max_delay), getattr(error, "retry_after", 0) or 0)
+        if time.monotonic() + delay >= end or not self.budget.withdraw():
+            return None
+        return delay
+
+    def _give_up(self, error: BaseException) -> ServiceUnavailable:
+        if isinstance(error, ServiceUnavailable):
+            return error
+        return ServiceUnavailable(self.name, f"{type(error).__name__}: {error}", self.breaker.retry_after())
+
+    async def call(self, fn: Callable[..., Awaitable[T]], *args, deadline: Optional[float] = None, **kwargs) -> T:
+        """Вызвать async fn(*args, **kwargs) с дедлайном, повторами и предохранителем."""
+        end = time.monotonic() + (self.deadline if deadline is None else deadline)
+        self.breaker.check()
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                result = await asyncio.wait_for(fn(*args, **kwargs), max(0.0, end - time.monotonic()))
+            except asyncio.TimeoutError as e:
+                error = e
+            except ServiceUnavailable:
+                raise  # fn сам не дошёл до сервиса (например, очередь планировщика) — это не ответ сервиса
+            except Exception as e:
+                if not self.retryable(e):
+                    self.breaker.success()  # сервис ответил (ошибкой запроса, а не сбоем)
+                    raise
+                error = e
+            else:
+                self.breaker.success()
+                return result
+            self.breaker.failure()
+            delay = self._next_delay(attempt, error, end)
+            if delay is None:
+                raise self._give_up(error) from error
+            logger.warning(f"{self.name}: {type(error).__name__}, повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def call_sync(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """
+        То же для синхронных клиентов (gspread). Прервать идущий HTTP-запрос
+        нельзя, поэтому у клиента должен быть свой таймаут на запрос, а
+        дедлайн здесь ограничивает повторы.
+        """
+        end = time.monotonic() + self.deadline
+        self.breaker.check()
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not self.retryable(e):
+                    self.breaker.success()  # сервис ответил (ошибкой запроса, а не сбоем)
+                    raise
+                error = e
+            else:
+                self.breaker.success()
+                return result
+            self.breaker.failure()
+            delay = self._next_delay(attempt, error, end)
+            if delay is None:
+                raise self._give_up(error) from error
+            logger.warning(f"{self.name}: {type(error).__name__}, повтор через {delay:.1f} с")
+            time.sleep(delay)
+            attempt += 1
+
+
+_policies: Dict[str, Policy] = {}
+_STATES = {"closed": 0, "half_open": 1, "open": 2}
+registry.gauge("bot_circuit_state", "Предохранитель внешнего API: 0 — закрыт, 1 — проба, 2 — разомкнут",
+               lambda: {n: _STATES[p.breaker.state] for n, p in _policies.items()})
+registry.gauge("bot_circuit_opened", "Сколько раз предохранитель размыкался",
+               lambda: {n: p.breaker.opened for n, p in _policies.items()})
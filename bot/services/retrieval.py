@@ -0,0 +1,145 @@
+# bot/services/retrieval.py
+"""
+Поиск релевантных порций учебника для проверки ответа ученика (BM25).
+
+Индекс строится один раз при импорте по всем порциям из bot/textbooks/*.json.
+retrieve_context() возвращает лучшие по BM25 порции под ответ ученика,
+уложенные в бюджет токенов.
+"""
+import math
+import re
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from bot.utils import TEXTBOOK_CONTENT
+from bot.services.prompts import PROMPT_CONTEXT_TOKENS, count_tokens, trim_tokens
+
+logger = logging.getLogger(__name__)
+
+# ───────── Параметры поиска ─────────
+BM25_K1 = 1.5
+BM25_B = 0.75
+TOPIC_BOOST = 0.5          # бонус порциям выбранной темы (+50% к score)
+STEM_LEN = 6               # грубый «стемминг»: обрезаем слово до 6 букв
+DEFAULT_TOP_K = 3
+DEFAULT_MAX_TOKENS = PROMPT_CONTEXT_TOKENS  # бюджет токенов на контекст учебника
+
+_WORD_RE = re.compile(r"[a-zа-яё0-9]+")
+_HYPHEN_BREAK_RE = re.compile(r"-\s*\n\s*")
+
+_STOP_WORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по
+только ее мне было вот от меня еще нет о из ему теперь когда даже ну вдруг ли если
+уже или ни быть был него до вас нибудь опять уж вам ведь там потом себя ничего ей
+может они тут где есть надо ней для мы тебя их чем была сам чтоб без будто чего раз
+тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь этом
+один почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при наконец
+два об другой хоть после над больше тот через эти нас про всего них какая много разве
+три эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им более
+всегда конечно всю между это эта также т е стр
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Разбивает текст на термы: нижний регистр, склейка переносов «опреде-\\nленное»,
+    выкидывание стоп-слов, обрезка до STEM_LEN букв (русская морфология без словарей).
+    """
+    text = _HYPHEN_BREAK_RE.sub("", text.lower())
+    return [
+        w[:STEM_LEN]
+        for w in _WORD_RE.findall(text)
+        if w not in _STOP_WORDS and (len(w) > 1 or w.isdigit())
+    ]
+
+
+class BM25Index:
+    """
+    Инвертированный индекс по порциям учебника.
+    docs[i] = (тема, номер порции, текст); postings[терм] = [(i, tf), ...]
+    """
+
+    def __init__(self, docs: List[Tuple[str, int, str]]):
+        self.docs = docs
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.doc_len: List[int] = []
+        for doc_id, (_, _, text) in enumerate(docs):
+            terms = tokenize(text)
+            self.doc_len.append(len(terms))
+            tf: Dict[str, int] = defaultdict(int)
+            for t in terms:
+                tf[t] += 1
+            for t, cnt in tf.items():
+                self.postings[t].append((doc_id, cnt))
+        n = len(docs)
+        self.avg_len = (sum(self.doc_len) / n) if n else 0.0
+        self.idf = {
+            t: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5))
+            for t, p in self.postings.items()
+        }
+
+    @classmethod
+    def from_textbooks(cls, content: Dict[str, List[str]]) -> "BM25Index":
+        docs = [
+            (topic, idx, chunk)
+            for topic, chunks in content.items()
+            for idx, chunk in enumerate(chunks)
+        ]
+        return cls(docs)
+
+    def search(self, query: str, topic: Optional[str] = None, k: int = DEFAULT_TOP_K) -> List[Tuple[float, int]]:
+        """
+        Возвращает до k пар (score, doc_id) по убыванию score.
+        Порции выбранной темы получают бонус TOPIC_BOOST.
+        """
+        scores: Dict[int, float] = defaultdict(float)
+        for t in set(tokenize(query)):
+            postings = self.postings.get(t)
+            if not postings:
+                continue
+            idf = self.idf[t]
+            for doc_id, tf in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[doc_id] / self.avg_len)
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        if topic:
+            for doc_id in scores:
+                if self.docs[doc_id][0] == topic:
+                    scores[doc_id] *= 1 + TOPIC_BOOST
+        ranked = sorted(((s, d) for d, s in scores.items()), reverse=True)
+        return ranked[:k]
+
+
+# Индекс собирается один раз при старте бота
+INDEX = BM25Index.from_textbooks(TEXTBOOK_CONTENT)
+
+
+def retrieve_context(
+    transcript: str,
+    topic: Optional[str] = None,
+    k: int = DEFAULT_TOP_K,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+) -> str:
+    """
+    Собирает контекст учебника для analyze_answer: до k порций, наиболее близких
+    к ответу ученика, суммарно не больше max_tokens (последняя порция обрезается).
+    Если ничего не нашлось — берёт начало главы по теме, как раньше.
+    """
+    hits = [INDEX.docs[doc_id] for _, doc_id in INDEX.search(transcript, topic, k)]
+    if not hits and topic in TEXTBOOK_CONTENT:
+        hits = [(topic, i, c) for i, c in enumerate(TEXTBOOK_CONTENT[topic][:k])]
+
+    parts: List[str] = []
+    used = 0
+    for _, _, text in hits:
+        left = max_tokens - used
+        cost = count_tokens(text)
+        if cost > left:
+            if left > 50:
+                parts.append(trim_tokens(text, left))
+                used = max_tokens
+            break
+        parts.append(text)
+        used += cost
+    logger.info(f"📖 Контекст учебника: {len(parts)} порц., ~{used} токенов")
+    return "\n\n".join(parts)
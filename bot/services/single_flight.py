@@ -0,0 +1,86 @@
+# bot/services/single_flight.py
+"""
+Защита от повторных нажатий: нетерпеливый ученик жмёт «📈 Получить отчёт»
+три раза или «👍 Понятно» пять раз подряд.
+
+    flights.do(key, fn)           — single-flight: пока fn по ключу key
+                                    выполняется, повторные вызовы не запускают
+                                    её заново, а ждут и получают тот же результат
+    flights.coalesce(key, window) — True только для первого вызова с ключом
+                                    за window секунд (повторы отбрасываются)
+
+Ключ — пользователь + операция, например ("report", user_id). Всё в памяти
+процесса: апдейты одного пользователя всегда приходят в один процесс
+(см. bot/webhook.py), между процессами дубли отсекает dedupe_key очереди
+заданий (bot/services/jobs.py).
+"""
+import asyncio
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+from bot.services.metrics import registry
+
+T = TypeVar("T")
+
+_PRUNE_EVERY = 4096       # вызовов coalesce между чистками старых ключей
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._last: Dict[Hashable, float] = {}   # ключ -> когда coalesce последний раз ответил True
+        self._max_window = 0.0
+        self._since_prune = 0
+        self.deduped: Counter = Counter()         # операция (key[0]) -> сколько повторов отсеяно
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Выполнить fn() один раз на ключ; параллельные вызовы получают тот же результат (или исключение)."""
+        running = self._calls.get(key)
+        if running is not None:
+            self.deduped[_op(key)] += 1
+            # shield: отмена одного из ждущих не отменяет общий вызов
+            return await asyncio.shield(running)
+        future = asyncio.get_running_loop().create_future()
+        # исключение, которое никто из повторов не забрал, — не ошибка
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    def coalesce(self, key: Hashable, window: float) -> bool:
+        """True — первый вызов с ключом за последние window секунд, False — повтор."""
+        now = time.monotonic()
+        last = self._last.get(key)
+        if last is not None and now - last < window:
+            self.deduped[_op(key)] += 1
+            return False
+        self._last[key] = now
+        self._max_window = max(self._max_window, window)
+        self._since_prune += 1
+        if self._since_prune >= _PRUNE_EVERY:
+            self._since_prune = 0
+            self._last = {k: t for k, t in self._last.items() if now - t < self._max_window}
+        return True
+
+
+def _op(key: Any) -> str:
+    return str(key[0] if isinstance(key, tuple) and key else key)
+
+
+flights = SingleFlight()
+registry.gauge("bot_deduped", "Повторных нажатий, не запустивших работу заново", lambda: dict(flights.deduped))
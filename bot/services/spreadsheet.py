@@ -1,29 +1,171 @@
+"""
+Ответы устного зачёта в Google Sheets + их локальная копия (sheet_mirror в
+базе ответов).
+
+Каждый ответ сначала пишется в копию, потом в таблицу через Policy
+(bot/services/resilience.py: таймаут, повторы, предохранитель). Если
+таблица недоступна, строка остаётся в копии с synced=0 и дописывается в
+таблицу после следующей удачной записи. Чтение при недоступной таблице
+идёт из копии (там есть всё, что записано с момента её появления).
+"""
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from datetime import datetime
+import logging
 import os
+import sqlite3
+import threading
+import requests
+from oauth2client.service_account import ServiceAccountCredentials
+from datetime import datetime, timedelta
+
+from bot.services.answer_db import DB_FILE
+from bot.services.metrics import timed
+from bot.services.resilience import Policy, ServiceUnavailable
+
+logger = logging.getLogger(__name__)
 
 SPREADSHEET_NAME = "Ответы по химии"
 CREDENTIALS_FILE = "credentials.json"
 SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+COLUMNS = ("Имя", "Telegram ID", "Тема", "Ответ", "Комментарий GPT", "Дата и время")
+
+SHEETS_TIMEOUT = float(os.getenv("SHEETS_TIMEOUT", "10"))     # на один HTTP-запрос к Google
+SHEETS_DEADLINE = float(os.getenv("SHEETS_DEADLINE", "20"))   # на операцию вместе с повторами
+SYNC_BATCH = 20           # отложенных строк, дописываемых за одну удачную запись
+
+
+def _retryable(e: BaseException) -> bool:
+    if isinstance(e, gspread.exceptions.APIError):
+        status = e.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(e, (requests.exceptions.RequestException, OSError))
+
+
+SHEETS = Policy("sheets", deadline=SHEETS_DEADLINE, attempts=3, retryable=_retryable)
+_sync_lock = threading.Lock()   # отложенные строки дописывает один поток за раз
+
 
 def _get_sheet():
     creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, SCOPE)
     client = gspread.authorize(creds)
+    client.set_timeout(SHEETS_TIMEOUT)
     return client.open(SPREADSHEET_NAME).sheet1
 
+
+# ========================
+#   ЛОКАЛЬНАЯ КОПИЯ
+# ========================
+def init_sheet_mirror():
+    """
+    Создаёт таблицу локальной копии ответов, если её ещё нет.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS sheet_mirror (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                fullname TEXT,
+                topic TEXT,
+                transcript TEXT,
+                feedback TEXT,
+                created_at TEXT,
+                synced INTEGER DEFAULT 0
+            )
+        ''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_sheet_mirror_user ON sheet_mirror (user_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_sheet_mirror_synced ON sheet_mirror (synced)")
+        conn.commit()
+
+
+def _mirror_insert(row: list) -> int:
+    fullname, user_id, topic, transcript, feedback, created_at = row
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute('''
+            INSERT INTO sheet_mirror (user_id, fullname, topic, transcript, feedback, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (int(user_id), fullname, topic, transcript, feedback, created_at))
+        conn.commit()
+        return c.lastrowid
+
+
+def _mirror_mark_synced(ids: list):
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.executemany("UPDATE sheet_mirror SET synced=1 WHERE id=?", [(i,) for i in ids])
+        conn.commit()
+
+
+def _mirror_pending(limit: int) -> list:
+    # только строки старше дедлайна записи: свежие, возможно, прямо сейчас пишет другой поток
+    cutoff = (datetime.now() - timedelta(seconds=SHEETS_DEADLINE)).strftime("%Y-%m-%d %H:%M:%S")
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute('''
+            SELECT id, fullname, user_id, topic, transcript, feedback, created_at
+            FROM sheet_mirror WHERE synced=0 AND created_at < ? ORDER BY id LIMIT ?
+        ''', (cutoff, limit))
+        return c.fetchall()
+
+
+def _mirror_records(user_id: int) -> list[dict]:
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute('''
+            SELECT fullname, user_id, topic, transcript, feedback, created_at
+            FROM sheet_mirror WHERE user_id=? ORDER BY id
+        ''', (int(user_id),))
+        return [dict(zip(COLUMNS, row)) for row in c.fetchall()]
+
+
+def _sync_pending(sheet):
+    """Дописать в таблицу строки, которые не ушли туда, пока она была недоступна."""
+    if not _sync_lock.acquire(blocking=False):
+        return
+    done = []
+    try:
+        for mirror_id, *row in _mirror_pending(SYNC_BATCH):
+            row[1] = str(row[1])
+            SHEETS.call_sync(sheet.append_row, row)
+            done.append(mirror_id)
+    finally:
+        _mirror_mark_synced(done)
+        _sync_lock.release()
+    if done:
+        logger.info(f"📄 В таблицу дописано отложенных ответов: {len(done)}")
+
+
+# ========================
+#   GOOGLE SHEETS
+# ========================
+@timed("spreadsheet.save_answer")
 def save_answer(user_id: int, fullname: str, topic: str, transcript: str, feedback: str):
-    sheet = _get_sheet()
-    sheet.append_row([
+    row = [
         fullname,
         str(user_id),
         topic,
         transcript,
         feedback,
         datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    ])
+    ]
+    mirror_id = _mirror_insert(row)
+    try:
+        sheet = SHEETS.call_sync(_get_sheet)
+        SHEETS.call_sync(sheet.append_row, row)
+    except ServiceUnavailable as e:
+        logger.warning(f"Google Sheets недоступна ({e}), ответ сохранён локально и уйдёт в таблицу позже")
+        return
+    _mirror_mark_synced([mirror_id])
+    try:
+        _sync_pending(sheet)
+    except ServiceUnavailable as e:
+        logger.warning(f"Отложенные ответы пока не дописаны в таблицу: {e}")
 
+@timed("spreadsheet.fetch_user_records")
 def fetch_user_records(user_id: int) -> list[dict]:
-    sheet = _get_sheet()
-    rows = sheet.get_all_records()
+    try:
+        sheet = SHEETS.call_sync(_get_sheet)
+        rows = SHEETS.call_sync(sheet.get_all_records)
+    except ServiceUnavailable as e:
+        logger.warning(f"Google Sheets недоступна ({e}), отчёт строится по локальной копии")
+        return _mirror_records(user_id)
     return [r for r in rows if str(r["Telegram ID"]) == str(user_id)]
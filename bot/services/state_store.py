@@ -0,0 +1,495 @@
+# bot/services/state_store.py
+"""
+Хранилище состояний пользователей (курс, устный зачёт, тесты, FSM aiogram —
+см. bot/services/fsm_storage.py).
+
+Один API — StateDict: ведёт себя как обычный dict {user_id: состояние},
+но каждое изменение сохраняется в бэкенд, а чтения идут из кэша в памяти
+процесса. Запись в постоянный бэкенд — в фоновом потоке (WriteBehind):
+хендлер не ждёт ни диска, ни сети до Redis, повторные изменения одного
+ключа, не дошедшие до базы, склеиваются в одну запись. Бэкенд выбирается
+переменной окружения:
+    STATE_BACKEND=sqlite  (по умолчанию) — файл STATE_DB (bot_state.db)
+    STATE_BACKEND=redis   — REDIS_URL (redis://localhost:6379/0), подходит
+                            любой Redis-совместимый сервер (KeyDB, Dragonfly…)
+    STATE_BACKEND=memory  — как раньше, всё теряется при перезапуске
+"""
+import os
+import json
+import sqlite3
+import time
+import logging
+import atexit
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+STATE_DB = os.getenv("STATE_DB", "bot_state.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "govor")
+
+
+# ───────── Бэкенды: хранят строки (JSON) по паре (namespace, key) ─────────
+class MemoryBackend:
+    persistent = False
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, str]] = {}
+
+    def get(self, ns: str, key: str) -> Optional[str]:
+        return self._data.get(ns, {}).get(key)
+
+    def set(self, ns: str, key: str, value: str, touched: float = 0.0):
+        self._data.setdefault(ns, {})[key] = value
+
+    def delete(self, ns: str, key: str):
+        self._data.get(ns, {}).pop(key, None)
+
+    def keys(self, ns: str) -> list:
+        return list(self._data.get(ns, {}))
+
+    def expired(self, ns: str, before: float) -> list:
+        return []  # после перезапуска в памяти ничего нет
+
+
+class SQLiteBackend:
+    persistent = True
+
+    def __init__(self, path: str):
+        # одно соединение на процесс: состояние меняется на каждом шаге пользователя
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_state (
+                ns TEXT,
+                key TEXT,
+                value TEXT,
+                touched REAL,
+                PRIMARY KEY (ns, key)
+            )
+        ''')
+        # миграция: время последнего обращения (для ttl после перезапуска)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(user_state)")]
+        if "touched" not in columns:
+            self._conn.execute("ALTER TABLE user_state ADD COLUMN touched REAL")
+            # старым записям — полный ttl с момента обновления
+            self._conn.execute("UPDATE user_state SET touched=?", (time.time(),))
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_user_state_touched ON user_state (ns, touched)")
+
+    def get(self, ns: str, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM user_state WHERE ns=? AND key=?", (ns, key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, ns: str, key: str, value: str, touched: float = 0.0):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO user_state (ns, key, value, touched) VALUES (?, ?, ?, ?)",
+                (ns, key, value, touched or time.time()),
+            )
+
+    def delete(self, ns: str, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM user_state WHERE ns=? AND key=?", (ns, key))
+
+    def keys(self, ns: str) -> list:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT key FROM user_state WHERE ns=?", (ns,))]
+
+    def expired(self, ns: str, before: float) -> list:
+        """[(key, value)] записей, к которым не обращались с момента before."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, value FROM user_state WHERE ns=? AND touched < ?", (ns, before)
+            ).fetchall()
+
+
+class RedisBackend:
+    """
+    Каждый namespace — hash «<prefix>:<ns>» и sorted set «<prefix>:<ns>:touched»
+    (ключ -> время последнего обращения). Нужен пакет redis.
+    """
+    persistent = True
+
+    def __init__(self, url: str, prefix: str = REDIS_PREFIX):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("Для STATE_BACKEND=redis установи пакет: pip install redis") from e
+        self._r = redis.Redis.from_url(url, decode_responses=True)
+        self._prefix = prefix
+
+    def _hash(self, ns: str) -> str:
+        return f"{self._prefix}:{ns}"
+
+    def get(self, ns: str, key: str) -> Optional[str]:
+        return self._r.hget(self._hash(ns), key)
+
+    def set(self, ns: str, key: str, value: str, touched: float = 0.0):
+        pipe = self._r.pipeline()
+        pipe.hset(self._hash(ns), key, value)
+        pipe.zadd(f"{self._hash(ns)}:touched", {key: touched or time.time()})
+        pipe.execute()
+
+    def delete(self, ns: str, key: str):
+        pipe = self._r.pipeline()
+        pipe.hdel(self._hash(ns), key)
+        pipe.zrem(f"{self._hash(ns)}:touched", key)
+        pipe.execute()
+
+    def keys(self, ns: str) -> list:
+        return list(self._r.hkeys(self._hash(ns)))
+
+    def expired(self, ns: str, before: float) -> list:
+        keys = self._r.zrangebyscore(f"{self._hash(ns)}:touched", "-inf", f"({before}")
+        if not keys:
+            return []
+        return [(k, v) for k, v in zip(keys, self._r.hmget(self._hash(ns), keys)) if v is not None]
+
+
+_DELETED = object()   # отложенное удаление в WriteBehind
+WRITE_RETRY_DELAY = 1.0  # пауза перед повтором записи, если бэкенд недоступен
+
+
+class WriteBehind:
+    """
+    Обёртка постоянного бэкенда: set/delete кладут запись в очередь и сразу
+    возвращаются, один фоновый поток пишет в бэкенд. В очереди хранится
+    последнее значение ключа, так что get видит ещё не записанное, а
+    несколько изменений подряд уходят одной записью. Если бэкенд недоступен,
+    запись остаётся в очереди и повторяется.
+    """
+    persistent = True
+
+    def __init__(self, store):
+        self.store = store
+        self._pending: "OrderedDict[tuple, Any]" = OrderedDict()  # (ns, key) -> значение | _DELETED
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def get(self, ns: str, key: str) -> Optional[str]:
+        with self._cond:
+            value = self._pending.get((ns, key))
+        if value is _DELETED:
+            return None
+        return value[0] if value is not None else self.store.get(ns, key)
+
+    def set(self, ns: str, key: str, value: str, touched: float = 0.0):
+        self._put((ns, key), (value, touched or time.time()))
+
+    def delete(self, ns: str, key: str):
+        self._put((ns, key), _DELETED)
+
+    def keys(self, ns: str) -> list:
+        with self._cond:
+            pending = {k: v for (n, k), v in self._pending.items() if n == ns}
+        keys = set(self.store.keys(ns)) | set(pending)
+        return [k for k in keys if pending.get(k) is not _DELETED]
+
+    def expired(self, ns: str, before: float) -> list:
+        with self._cond:
+            pending = {k for (n, k) in self._pending if n == ns}
+        # ключи с записью в очереди только что трогали
+        return [(k, v) for k, v in self.store.expired(ns, before) if k not in pending]
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _put(self, item: tuple, value):
+        with self._cond:
+            self._pending[item] = value
+            self._cond.notify()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="state-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                (ns, key), value = next(iter(self._pending.items()))
+            try:
+                if value is _DELETED:
+                    self.store.delete(ns, key)
+                else:
+                    self.store.set(ns, key, *value)
+            except Exception:
+                logger.exception(f"Не удалось сохранить состояние {ns}:{key}, повтор через {WRITE_RETRY_DELAY:.0f} с")
+                time.sleep(WRITE_RETRY_DELAY)
+                continue
+            with self._cond:
+                if self._pending.get((ns, key), _DELETED) is value:
+                    del self._pending[(ns, key)]
+                elif (ns, key) in self._pending:
+                    self._pending.move_to_end((ns, key))  # изменилось во время записи — в конец очереди
+                self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Дождаться записи всего, что в очереди (остановка бота). False — не успели за timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending:
+                if self._thread is None or not self._thread.is_alive():
+                    return False
+                left = None if deadline is None else deadline - time.monotonic()
+                if left is not None and left <= 0:
+                    return False
+                self._cond.wait(left)
+        return True
+
+
+def make_backend(kind: str = STATE_BACKEND):
+    if kind == "memory":
+        return MemoryBackend()
+    if kind == "sqlite":
+        return WriteBehind(SQLiteBackend(STATE_DB))
+    if kind == "redis":
+        return WriteBehind(RedisBackend(REDIS_URL))
+    raise ValueError(f"Неизвестный STATE_BACKEND: {kind}")
+
+
+_backend = None
+_backend_pid: Optional[int] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Бэкенд текущего процесса, открывается при первом обращении: соединение
+    SQLite нельзя наследовать через fork, у каждого воркера должно быть своё.
+    """
+    global _backend, _backend_pid
+    with _backend_lock:
+        if _backend is None or _backend_pid != os.getpid():
+            _backend = make_backend()
+            _backend_pid = os.getpid()
+            if isinstance(_backend, WriteBehind):
+                atexit.register(_backend.flush, 5.0)
+        return _backend
+
+
+# ───────── StateDict: dict поверх бэкенда с кэшем в памяти ─────────
+_instances: list = []  # все StateDict процесса — для purge_expired()
+_MISSING = object()  # «в бэкенде нет» — тоже кэшируем, чтобы фильтры не ходили в базу
+
+
+class _TrackedDict(dict):
+    """Состояние пользователя: любое изменение ключа сразу сохраняется (st["index"] += 1)."""
+
+    def __init__(self, owner: "StateDict", key, data: dict):
+        super().__init__(data)
+        self._owner = owner
+        self._key = key
+
+    def _save(self):
+        self._owner.persist(self._key)
+
+    def __setitem__(self, k, v):
+        super().__setitem__(k, v)
+        self._save()
+
+    def __delitem__(self, k):
+        super().__delitem__(k)
+        self._save()
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self._save()
+        return result
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._save()
+
+    def setdefault(self, k, default=None):
+        result = super().setdefault(k, default)
+        self._save()
+        return result
+
+
+class StateDict(MutableMapping):
+    """
+    {user_id: состояние} с записью в бэкенд при каждом изменении.
+    Кэш процесса считается источником правды для своих пользователей:
+    при работе в несколько процессов апдейты одного пользователя должны
+    попадать в один и тот же процесс (см. шардирование по user_id).
+
+    Кэш ограничен (LRU по последнему обращению):
+      ttl     — сессия, к которой не обращались ttl секунд, завершается:
+                вызывается on_evict(key, value) и запись удаляется из бэкенда.
+                Время обращения хранится и в бэкенде, так что сессии, не
+                тронутые после перезапуска, завершает purge_expired() при старте;
+      maxsize — при переполнении самая давняя сессия вытесняется из памяти
+                (в постоянном бэкенде она остаётся; в memory — завершается
+                так же, как по ttl).
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        store=None,
+        key_type=int,
+        ttl: Optional[float] = None,
+        maxsize: Optional[int] = None,
+        on_evict: Optional[Callable[[Any, Any], None]] = None,
+    ):
+        self.namespace = namespace
+        self._store = store
+        self.key_type = key_type
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        # key -> (value, время последнего обращения, time.time() записи в бэкенд);
+        # порядок — от давних к свежим
+        self._cache: "OrderedDict[Any, tuple]" = OrderedDict()
+        # ключи, которых нет в бэкенде — отдельно, чтобы не вытеснять живые сессии
+        self._absent: "OrderedDict[Any, None]" = OrderedDict()
+        self.evicted_ttl = 0     # завершено по простою
+        self.evicted_lru = 0     # вытеснено по размеру
+        _instances.append(self)
+
+    @property
+    def backend(self):
+        return self._store or get_backend()
+
+    @property
+    def live(self) -> int:
+        """Сессий в памяти процесса."""
+        return len(self._cache)
+
+    def stats(self) -> Dict[str, int]:
+        return {"live": self.live, "evicted_ttl": self.evicted_ttl, "evicted_lru": self.evicted_lru}
+
+    def _wrap(self, key, value):
+        return _TrackedDict(self, key, value) if isinstance(value, dict) else value
+
+    # ── кэш ──
+    def _put(self, key, value):
+        if value is _MISSING:
+            self._cache.pop(key, None)
+            self._absent[key] = None
+            self._absent.move_to_end(key)
+            if self.maxsize is not None and len(self._absent) > self.maxsize:
+                self._absent.popitem(last=False)
+            return
+        self._absent.pop(key, None)
+        entry = self._cache.get(key)
+        self._cache[key] = (value, time.monotonic(), entry[2] if entry else time.time())
+        self._cache.move_to_end(key)
+        self._evict()
+
+    def _drop(self, key, expired: bool):
+        value = self._cache.pop(key)[0]
+        if expired:
+            self.evicted_ttl += 1
+        else:
+            self.evicted_lru += 1
+        if expired or not self.backend.persistent:
+            if self.on_evict:
+                try:
+                    self.on_evict(key, value)
+                except Exception:
+                    logger.exception(f"Не удалось сохранить вытесненную сессию {self.namespace}:{key}")
+            self.backend.delete(self.namespace, str(key))
+            self._absent[key] = None
+
+    def _evict(self):
+        if self.ttl is not None:
+            deadline = time.monotonic() - self.ttl
+            while self._cache:
+                key, (_, touched, _) = next(iter(self._cache.items()))
+                if touched > deadline:
+                    break
+                self._drop(key, expired=True)
+        if self.maxsize is not None:
+            while len(self._cache) > self.maxsize:
+                self._drop(next(iter(self._cache)), expired=False)
+
+    def _load(self, key):
+        self._evict()
+        entry = self._cache.get(key)
+        if entry is not None:
+            self._cache[key] = (entry[0], time.monotonic(), entry[2])
+            self._cache.move_to_end(key)
+            # только читают (листают курс) — время обращения в бэкенде всё равно освежаем
+            if self.ttl is not None and time.time() - entry[2] > self.ttl / 4:
+                self.persist(key)
+            return entry[0]
+        if key in self._absent:
+            return _MISSING
+        raw = self.backend.get(self.namespace, str(key))
+        value = _MISSING if raw is None else self._wrap(key, json.loads(raw))
+        self._put(key, value)
+        if value is not _MISSING and self.ttl is not None:
+            self.persist(key)  # обращение после перезапуска — тоже обращение
+        return value
+
+    def persist(self, key):
+        """Записать в бэкенд текущее значение из кэша."""
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] is not _MISSING:
+            now = time.time()
+            self._cache[key] = (entry[0], entry[1], now)
+            self.backend.set(self.namespace, str(key), json.dumps(entry[0], ensure_ascii=False), now)
+
+    def purge_expired(self) -> int:
+        """
+        Завершить сессии из бэкенда, к которым не обращались дольше ttl
+        (бот был выключен или сессию больше не трогали): on_evict и удаление.
+        """
+        if self.ttl is None or not self.backend.persistent:
+            return 0
+        purged = 0
+        for raw_key, raw in self.backend.expired(self.namespace, time.time() - self.ttl):
+            key = self.key_type(raw_key)
+            if key in self._cache:
+                continue
+            if self.on_evict:
+                try:
+                    self.on_evict(key, self._wrap(key, json.loads(raw)))
+                except Exception:
+                    logger.exception(f"Не удалось сохранить просроченную сессию {self.namespace}:{key}")
+            self.backend.delete(self.namespace, str(raw_key))
+            self.evicted_ttl += 1
+            purged += 1
+        return purged
+
+    def __getitem__(self, key):
+        value = self._load(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._put(key, self._wrap(key, value))
+        self.persist(key)
+
+    def __delitem__(self, key):
+        if self._load(key) is _MISSING:
+            raise KeyError(key)
+        self._put(key, _MISSING)
+        self.backend.delete(self.namespace, str(key))
+
+    def __iter__(self) -> Iterator:
+        return (self.key_type(k) for k in self.backend.keys(self.namespace))
+
+    def __len__(self) -> int:
+        return len(self.backend.keys(self.namespace))
+
+
+def purge_expired() -> int:
+    """Завершить просроченные сессии всех StateDict (при старте бота)."""
+    total = sum(d.purge_expired() for d in _instances)
+    if total:
+        logger.info(f"🧹 Завершено сессий, просроченных за время простоя: {total}")
+    return total
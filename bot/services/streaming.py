@@ -0,0 +1,114 @@
+# bot/services/streaming.py
+"""
+Постепенный вывод ответа GPT в Telegram: сначала отправляем заглушку,
+потом редактируем её по мере прихода токенов (edit_message_text).
+
+Telegram ограничивает частоту правок одного сообщения, поэтому правки
+троттлятся: не чаще EDIT_INTERVAL секунд и только если текст заметно вырос.
+Текст сразу конвертируется в HTML для Telegram и режется на части по 4096
+символов: когда ответ перерастает сообщение, продолжение уходит новым.
+"""
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, List
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+from bot.utils import clean_html, to_telegram_html, split_html
+from bot.services.outbound import editable
+
+logger = logging.getLogger(__name__)
+
+EDIT_INTERVAL = 1.2      # секунд между правками одного сообщения
+MIN_GROWTH = 40          # символов, без которых правка не имеет смысла
+PLACEHOLDER = "✍️ Пишу ответ…"
+CURSOR = " ▌"
+
+
+class _StreamedReply:
+    """Одно или несколько сообщений, в которые выводится ответ."""
+
+    def __init__(self, first: Message):
+        self.messages: List[Message] = [first]
+        self.shown: List[str] = [first.text or ""]
+
+    async def _edit(self, i: int, text: str) -> bool:
+        """
+        Правит i-е сообщение, глотая «message is not modified».
+        Возвращает False, если Telegram попросил подождать (правку пропускаем).
+        """
+        try:
+            await self.messages[i].edit_text(text, parse_mode="HTML")
+        except TelegramRetryAfter as e:
+            logger.warning(f"Telegram просит подождать {e.retry_after}с перед правкой")
+            await asyncio.sleep(e.retry_after)
+            return False
+        except TelegramBadRequest as e:
+            if "not modified" in str(e):
+                pass
+            elif "parse" in str(e):
+                # на всякий случай: HTML не разобрался — показываем простой текст
+                await self.messages[i].edit_text(clean_html(text), parse_mode=None)
+            else:
+                raise
+        self.shown[i] = text
+        return True
+
+    async def show(self, html_text: str, cursor: str = "") -> bool:
+        parts = split_html(html_text) or [PLACEHOLDER]
+        ok = True
+        for i, part in enumerate(parts):
+            if i + 1 < len(parts):
+                text = part
+            else:
+                text = part + cursor
+            if i < len(self.messages):
+                if self.shown[i] != text:
+                    ok = await self._edit(i, text) and ok
+            else:
+                with editable():
+                    self.messages.append(await self.messages[0].answer(text, parse_mode="HTML"))
+                self.shown.append(text)
+        return ok
+
+
+async def stream_into(msg: Message, chunks: AsyncIterator[str], header: str = "") -> str:
+    """
+    Дописывает в уже отправленное сообщение msg ответ GPT из chunks.
+    header — готовый HTML перед ответом (пользовательский текст в нём должен быть экранирован).
+    Возвращает полный сырой текст от GPT.
+    """
+    reply = _StreamedReply(msg)
+    raw = ""
+    shown = 0
+    last_edit = 0.0
+    async for delta in chunks:
+        raw += delta
+        now = time.monotonic()
+        # первая порция текста — сразу, дальше — не чаще EDIT_INTERVAL
+        if shown and (now - last_edit < EDIT_INTERVAL or len(raw) - shown < MIN_GROWTH):
+            continue
+        if await reply.show(header + to_telegram_html(raw, partial=True), CURSOR):
+            shown = len(raw)
+        last_edit = time.monotonic()
+
+    await reply.show(header + to_telegram_html(raw))
+    return raw.strip()
+
+
+async def stream_reply(
+    bot: Bot,
+    chat_id: int,
+    chunks: AsyncIterator[str],
+    header: str = "",
+    reply_markup=None,
+) -> str:
+    """
+    Отправляет заглушку в чат и потоково заполняет её ответом GPT (см. stream_into).
+    """
+    with editable():
+        msg = await bot.send_message(chat_id, PLACEHOLDER, reply_markup=reply_markup)
+    return await stream_into(msg, chunks, header=header)
@@ -1,8 +1,12 @@
+import os
 import sqlite3
 
+from bot.services.metrics import timed
+
 # Абсолютный путь к базе данных
-DB_FILE = r"C:\Users\Роман\Desktop\govr_bot\bot\tests1.db"
+DB_FILE = os.getenv("TESTS_DB", r"C:\Users\Роман\Desktop\govr_bot\bot\tests1.db")
 
+@timed("test_sql.get_all_tests_types")
 def get_all_tests_types():
     """
     Получает список уникальных типов тестов (например, 1...28)
@@ -13,6 +17,7 @@ def get_all_tests_types():
         # Оставляем только значения, которые не None и не пустые строки
         return [row[0] for row in c.fetchall() if row[0] not in (None, '')]
 
+@timed("test_sql.get_questions_by_type")
 def get_questions_by_type(test_type):
     """
     Получает все вопросы для заданного типа теста (по порядку id)
@@ -38,6 +43,7 @@ def get_questions_by_type(test_type):
             for row in c.fetchall()
         ]
 
+@timed("test_sql.get_question_by_id")
 def get_question_by_id(q_id):
     """
     Получает один вопрос по его id, с detailed_explanation
@@ -65,3 +71,28 @@ def get_question_by_id(q_id):
             return None
 
 
+@timed("test_sql.get_all_questions")
+def get_all_questions():
+    """
+    Получает все вопросы всех тестов (по порядку id) — для кэша в памяти (bot/services/question_bank.py)
+    Возвращает список dict-ов как у get_question_by_id
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT id, type, question, options, correct_answer, explanation, hint, detailed_explanation "
+            "FROM tests ORDER BY id"
+        )
+        return [
+            dict(
+                id=row[0],
+                type=row[1],
+                question=row[2],
+                options=row[3] or "",
+                correct_answer=row[4] or "",
+                explanation=row[5] or "",
+                hint=row[6] or "",
+                detailed_explanation=row[7] or ""
+            )
+            for row in c.fetchall()
+        ]
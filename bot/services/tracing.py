@@ -0,0 +1,196 @@
+# bot/services/tracing.py
+"""
+Трассировка: из чего складывается время ответа на один апдейт.
+
+Корневой спан открывает MetricsMiddleware (один на апдейт, с user и handler),
+дочерние — @timed (GPT, Whisper, SQLite, Sheets, PDF), запросы к Telegram
+(outbound.py) и участки кода, обёрнутые вручную:
+
+    with span("voice.decode", seconds=42):
+        audio = AudioSegment.from_file(path)
+
+Текущий спан хранится в contextvar, поэтому вложенность сохраняется и через
+await, и внутри asyncio.to_thread. Вне апдейта (рассылки, подготовка лекций)
+span() ничего не записывает.
+
+Завершённая трасса не короче TRACE_MIN_MS — одна строка JSON в TRACE_FILE
+(пишет фоновый поток). Когда файл дорастает до TRACE_MAX_MB, он переименовывается
+в <TRACE_FILE>.1 (прежний .1 удаляется) и запись начинается в новый — на диске
+не больше двух файлов:
+
+    {"trace_id": "…", "name": "topics.on_voice", "ts": 1718000000.1, "ms": 40213.5,
+     "tags": {"user": 42}, "error": null,
+     "spans": [{"id": 2, "parent": 1, "name": "voice.download", "at": 0.4, "ms": 812.0, "tags": {}, "error": null}, …]}
+
+Смотреть: python -m bot.trace top / python -m bot.trace show <trace_id>.
+"""
+import atexit
+import contextvars
+import itertools
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from bot.services.db_writer import DBWriter
+
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")      # "" — трассы не пишутся
+TRACE_MIN_MS = float(os.getenv("TRACE_MIN_MS", "1000"))   # писать только трассы не короче
+TRACE_MAX_MB = float(os.getenv("TRACE_MAX_MB", "50"))     # размер файла до ротации; 0 — без ротации
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("trace_span", default=None)
+_sink = DBWriter("trace-writer")
+atexit.register(_sink.close)
+
+
+class _Trace:
+    __slots__ = ("trace_id", "spans", "_ids")
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.spans: List["Span"] = []     # завершённые дочерние спаны (append атомарен — можно из потоков)
+        self._ids = itertools.count(1)
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "tags", "start", "wall", "duration", "error")
+
+    def __init__(self, trace: _Trace, parent_id: Optional[int], name: str, tags: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = next(trace._ids)
+        self.parent_id = parent_id
+        self.name = name
+        self.tags = tags
+        self.start = time.perf_counter()
+        self.wall = time.time()
+        self.duration = 0.0
+        self.error: Optional[str] = None
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.duration = time.perf_counter() - self.start
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"[:300]
+        if self.parent_id is not None:
+            self.trace.spans.append(self)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def start_span(name: str, **tags) -> Optional[Span]:
+    """
+    Дочерний спан текущего, не становящийся текущим (для async-генераторов:
+    между их чанками выполняется чужой код). Закрывать через span.finish().
+    None — если трассы нет.
+    """
+    parent = _current.get()
+    if parent is None:
+        return None
+    return Span(parent.trace, parent.span_id, name, tags)
+
+
+@contextmanager
+def span(name: str, **tags):
+    """Дочерний спан текущей трассы на время блока (вне трассы — ничего не делает)."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    s = Span(parent.trace, parent.span_id, name, tags)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.finish(e)
+        raise
+    else:
+        s.finish()
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def root_span(name: str, **tags):
+    """Новая трасса (один апдейт). По завершении трасса уходит в TRACE_FILE."""
+    root = Span(_Trace(), None, name, tags)
+    token = _current.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.finish(e)
+        raise
+    else:
+        root.finish()
+    finally:
+        _current.reset(token)
+        _emit(root)
+
+
+def _emit(root: Span):
+    if not TRACE_FILE or root.duration * 1000 < TRACE_MIN_MS:
+        return
+    # спаны, которые ещё не закончились (фоновые задачи), в трассу не попадут
+    spans = sorted(root.trace.spans, key=lambda s: s.start)
+    record = {
+        "trace_id": root.trace.trace_id,
+        "name": root.name,
+        "ts": round(root.wall, 3),
+        "ms": round(root.duration * 1000, 1),
+        "tags": root.tags,
+        "error": root.error,
+        "spans": [
+            {
+                "id": s.span_id,
+                "parent": s.parent_id,
+                "name": s.name,
+                "at": round((s.start - root.start) * 1000, 1),
+                "ms": round(s.duration * 1000, 1),
+                "tags": s.tags,
+                "error": s.error,
+            }
+            for s in spans
+        ],
+    }
+    _sink.submit(_write, json.dumps(record, ensure_ascii=False, default=str))
+
+
+def _write(line: str):
+    _rotate()
+    with open(TRACE_FILE, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+def _rotate():
+    if TRACE_MAX_MB <= 0:
+        return
+    try:
+        if os.path.getsize(TRACE_FILE) < TRACE_MAX_MB * 1024 * 1024:
+            return
+    except OSError:
+        return  # файла ещё нет
+    os.replace(TRACE_FILE, TRACE_FILE + ".1")
+
+
+# ───────── Чтение (для python -m bot.trace) ─────────
+def read_traces(path: str = TRACE_FILE) -> List[dict]:
+    """Трассы из файла и его предыдущей части (<path>.1, если есть), старые — первыми."""
+    traces = []
+    paths = [p for p in (path + ".1", path) if os.path.exists(p)]
+    if not paths:
+        raise FileNotFoundError(path)
+    for p in paths:
+        with open(p, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        traces.append(json.loads(line))
+                    except ValueError:
+                        continue  # строка, недописанная при падении
+    return traces
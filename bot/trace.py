@@ -0,0 +1,122 @@
+"""
+Просмотр трасс апдейтов, которые пишет бот (TRACE_FILE, по умолчанию traces.jsonl).
+
+Запуск из корня проекта (там же, где запускается бот):
+    python -m bot.trace top                       # самые медленные апдейты
+    python -m bot.trace top -n 5 --handler on_voice --since 60
+    python -m bot.trace show 3f2a9c                # водопад одной трассы (достаточно начала id)
+    python -m bot.trace stats                      # из чего в среднем складывается время хендлеров
+
+Подробнее о спанах — bot/services/tracing.py.
+"""
+import argparse
+import sys
+import time
+from collections import defaultdict
+
+from bot.services.tracing import TRACE_FILE, read_traces
+
+BAR_WIDTH = 40
+
+
+def _select(traces, handler=None, since=None):
+    if handler:
+        traces = [t for t in traces if handler in t["name"]]
+    if since:
+        border = time.time() - since * 60
+        traces = [t for t in traces if t["ts"] >= border]
+    return traces
+
+
+def _print_top(traces, n):
+    for t in sorted(traces, key=lambda t: t["ms"], reverse=True)[:n]:
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t["ts"]))
+        # самый долгий спан верхнего уровня — обычно он и есть причина
+        top = [s for s in t["spans"] if s["parent"] == 1]
+        worst = max(top, key=lambda s: s["ms"], default=None)
+        hint = f"  ← {worst['name']} {worst['ms'] / 1000:.2f}с" if worst else ""
+        error = "  ✗" if t.get("error") else ""
+        print(f"{t['trace_id']}  {when}  {t['ms'] / 1000:8.2f}с  {t['name']}  user={t['tags'].get('user')}{error}{hint}")
+
+
+def _print_waterfall(t):
+    total = max(t["ms"], 0.1)
+    depth = {1: 0}
+    rows = [(0, t["name"], 0.0, t["ms"], t["tags"], t.get("error"))]
+    for s in t["spans"]:
+        depth[s["id"]] = depth.get(s["parent"], 0) + 1
+        rows.append((depth[s["id"]], s["name"], s["at"], s["ms"], s["tags"], s.get("error")))
+    width = max(len("  " * d + name) for d, name, *_ in rows)
+    when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t["ts"]))
+    print(f"Трасса {t['trace_id']}  {when}  {t['ms'] / 1000:.2f}с")
+    for d, name, at, ms, tags, error in rows:
+        left = int(at / total * BAR_WIDTH)
+        length = max(1, round(ms / total * BAR_WIDTH))
+        bar = " " * left + "█" * min(length, BAR_WIDTH - left)
+        extra = " ".join(f"{k}={v}" for k, v in tags.items() if v is not None)
+        if error:
+            extra += f"  ✗ {error}"
+        print(f"{('  ' * d + name).ljust(width)}  {ms:9.1f}мс  |{bar.ljust(BAR_WIDTH)}|  {extra}".rstrip())
+
+
+def _print_stats(traces):
+    """Для каждого хендлера: сколько в среднем занимает каждый вид спанов."""
+    by_handler = defaultdict(list)
+    for t in traces:
+        by_handler[t["name"]].append(t)
+    for name, items in sorted(by_handler.items(), key=lambda kv: -sum(t["ms"] for t in kv[1])):
+        avg = sum(t["ms"] for t in items) / len(items)
+        print(f"{name}: {len(items)} апдейтов, в среднем {avg:.1f}мс")
+        parts = defaultdict(float)
+        for t in items:
+            for s in t["spans"]:
+                if s["parent"] == 1:
+                    parts[s["name"]] += s["ms"]
+        for part, ms in sorted(parts.items(), key=lambda kv: -kv[1]):
+            print(f"    {part:<40} {ms / len(items):9.1f}мс  {ms / len(items) / avg * 100 if avg else 0:5.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Трассы апдейтов бота")
+    parser.add_argument("--file", default=TRACE_FILE, help=f"файл трасс (по умолчанию {TRACE_FILE})")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    top = sub.add_parser("top", help="самые медленные апдейты")
+    top.add_argument("-n", type=int, default=20)
+    top.add_argument("--handler", help="только хендлеры, в имени которых есть эта строка")
+    top.add_argument("--since", type=float, help="только за последние N минут")
+
+    show = sub.add_parser("show", help="водопад одной трассы")
+    show.add_argument("trace_id")
+
+    stats = sub.add_parser("stats", help="средняя разбивка времени по хендлерам")
+    stats.add_argument("--handler")
+    stats.add_argument("--since", type=float)
+
+    args = parser.parse_args(argv)
+    try:
+        traces = read_traces(args.file)
+    except FileNotFoundError:
+        print(f"Файл {args.file} не найден — бот ещё не писал трассы (или TRACE_FILE пуст)")
+        return 1
+
+    if args.cmd == "top":
+        _print_top(_select(traces, args.handler, args.since), args.n)
+        return 0
+
+    if args.cmd == "show":
+        found = [t for t in traces if t["trace_id"].startswith(args.trace_id)]
+        if not found:
+            print(f"Трасса {args.trace_id} не найдена")
+            return 1
+        for t in found:
+            _print_waterfall(t)
+        return 0
+
+    if args.cmd == "stats":
+        _print_stats(_select(traces, args.handler, args.since))
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
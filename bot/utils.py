@@ -3,8 +3,12 @@
 import os
 import json
 import re
+import html
+from functools import lru_cache
 from typing import Any
 
+from bot.services.state_store import StateDict
+
 # ====== Тестовые темы (режим "Темы") ======
 ALL_TOPICS = [
     "Алканы", "Алкены", "Алкины", "Арены", "Спирты", "Фенол",
@@ -28,90 +32,450 @@ for topic in LEARNING_TOPICS:
     with open(path, encoding="utf-8") as f:
         TEXTBOOK_CONTENT[topic] = json.load(f)
 
-# ====== Состояния пользователей ======
-user_learning_state: dict[int, dict[str, Any]] = {}
-user_topics: dict[int, str] = {}
+# ====== Состояния пользователей (переживают перезапуск, см. bot/services/state_store.py) ======
+# В памяти держим только активных: брошенные сессии завершаются по простою (ttl),
+# а при наплыве пользователей самые давние вытесняются из кэша (maxsize).
+SESSION_MAXSIZE = int(os.getenv("SESSION_MAXSIZE", "10000"))
+LEARNING_TTL = 30 * 24 * 3600   # курс можно продолжить в течение месяца
+TOPIC_TTL = 6 * 3600            # выбранная тема устного зачёта ждёт ответа 6 часов
+
+user_learning_state: dict[int, dict[str, Any]] = StateDict(
+    "learning", ttl=LEARNING_TTL, maxsize=SESSION_MAXSIZE
+)
+user_topics: dict[int, str] = StateDict("topics", ttl=TOPIC_TTL, maxsize=SESSION_MAXSIZE)
 
 
 def clean_html(text: str) -> str:
     """
-    Простая очистка HTML-тегов из ответов GPT.
+    Очистка ответа GPT до простого текста: HTML-теги и Markdown-разметка убираются,
+    списки превращаются в «• пункт». Для отправки с форматированием — to_telegram_html.
+
+    >>> clean_html('costs $5 and $10')
+    'costs $5 and $10'
+    >>> clean_html('формула$CH_4$горит')
+    'формула CH₄ горит'
     """
-    text = text.replace("<p>", "").replace("</p>", "")
-    text = text.replace("<br>", "\n")
-    text = text.replace("<ul>", "").replace("</ul>", "")
-    text = text.replace("<ol>", "").replace("</ol>", "")
-    text = text.replace("<li>", "• ").replace("</li>", "\n")
-    return re.sub(r"<.*?>", "", text)
+    return _render_gpt(text, html_mode=False)
 
 # ====== Конвертация LaTeX- и инлайн-формул в Markdown code-block ======
 
-# подстрочные цифры (₀₁₂…₉)
+# подстрочные символы (₀₁₂…₉, ₊, ₋, ₙ …)
 _SUBSCRIPT = {str(i): chr(0x2080 + i) for i in range(10)}
+_SUBSCRIPT.update({
+    '+': '₊', '-': '₋', '=': '₌', '(': '₍', ')': '₎',
+    'a': 'ₐ', 'e': 'ₑ', 'o': 'ₒ', 'x': 'ₓ', 'h': 'ₕ', 'k': 'ₖ', 'l': 'ₗ',
+    'm': 'ₘ', 'n': 'ₙ', 'p': 'ₚ', 's': 'ₛ', 't': 'ₜ',
+})
 # надстрочные цифры и знаки (¹²³…⁹, ⁺, ⁻)
 _SUPERSCRIPT = {
     '0':'⁰','1':'¹','2':'²','3':'³','4':'⁴',
     '5':'⁵','6':'⁶','7':'⁷','8':'⁸','9':'⁹',
-    '+':'⁺','-':'⁻'
+    '+':'⁺','-':'⁻','=':'⁼','(':'⁽',')':'⁾','n':'ⁿ','−':'⁻',
 }
 
-# Используем raw строку для docstring, чтобы backslashes не интерпретировались
-# pylint: disable=use-xrange
+# команды-символы: \cdot → ·, стрелки, греческие буквы; пустая строка — просто убрать
+_SYMBOLS = {
+    'rightarrow': '→', 'to': '→', 'longrightarrow': '→', 'Rightarrow': '⇒',
+    'leftarrow': '←', 'longleftarrow': '←',
+    'rightleftharpoons': '⇌', 'leftrightarrow': '↔', 'rightleftarrows': '⇄',
+    'uparrow': '↑', 'downarrow': '↓',
+    'equiv': '≡', 'cdot': '·', 'times': '×', 'pm': '±', 'approx': '≈',
+    'ne': '≠', 'neq': '≠', 'le': '≤', 'leq': '≤', 'ge': '≥', 'geq': '≥',
+    'circ': '°', 'degree': '°',
+    'alpha': 'α', 'beta': 'β', 'gamma': 'γ', 'delta': 'δ', 'Delta': 'Δ',
+    'pi': 'π', 'sigma': 'σ', 'lambda': 'λ', 'mu': 'μ', 'nu': 'ν',
+    'quad': ' ', 'qquad': ' ', ',': '', ';': ' ', ':': ' ', '!': '', ' ': ' ',
+    'left': '', 'right': '', 'displaystyle': '',
+}
+# команды, у которых нужно оставить только содержимое аргумента
+_UNWRAP = frozenset({'text', 'mathrm', 'mathbf', 'textbf', 'textit', 'mathit', 'ce', 'operatorname'})
+
+# Формулы ищутся за один проход: блочные \[ ... \] или инлайн $ ... $.
+# Инлайн — только если $ вплотную к содержимому и это не просто число:
+# «цена $5 и $10» — текст, а не формула.
+_FORMULA_RE = re.compile(r'\\\[([\s\S]*?)\\\]|\$(?=\S)(?![\d.,]+\$)([^$\n]+?)(?<=\S)\$(?!\d)')
+# Токены внутри формулы: \команда, \символ, скобки, _ ^ и простой текст
+_TOKEN_RE = re.compile(r'\\[A-Za-z]+|\\.|[{}_^]|[^\\{}_^]+')
+# Индекс без скобок: цифры с зарядом (^2+, ^-) или один символ
+_BARE_SUP_RE = re.compile(r'\d*[+\-−]|\d+|.', re.DOTALL)
+_BARE_SUB_RE = re.compile(r'\d+|.', re.DOTALL)
+
 r"""
 latex_to_codeblock(text: str) -> str
 
 Заменяет LaTeX-блоки (\[...\]) и инлайн-формулы ($...$)
 на Markdown code-block'и с Unicode-формулами.
 
-Особенности замены:
-  - убирает \text{...}
-  - _{n} или _n → подстрочные цифры (₀₁₂...)
-  - ^{n} или ^n → надстрочные цифры (¹²³...)
-  - любые \rightarrow, \to, \longrightarrow, \xrightarrow → стрелка →
-  - \equiv → знак эквивалентности ≡
+Особенности замены (один проход по тексту, формула разбирается токенизатором):
+  - убирает \text{...}, \mathrm{...}, \ce{...} (остаётся содержимое)
+  - _{...} или _n → подстрочные символы (₀₁₂..., ₙ, ₊)
+  - ^{...}, ^n или заряд ^2+ / ^- → надстрочные символы (¹²³..., ⁺, ⁻)
+  - \frac{a}{b} → a/b (составные части — в скобках)
+  - \rightarrow, \to, \longrightarrow → стрелка →; \xrightarrow{t} → —t→
+  - \cdot → ·, \equiv → ≡, греческие буквы и прочие символы — в Unicode
   - удаляет фигурные скобки и лишние слеши
 """
+
+
+class _FormulaParser:
+    """Рекурсивный разбор одной формулы по токенам _TOKEN_RE."""
+
+    def __init__(self, src: str):
+        self.tokens = _TOKEN_RE.findall(src)
+        self.pos = 0
+
+    def render(self, stop_at_brace: bool = False) -> str:
+        out = []
+        tokens = self.tokens
+        while self.pos < len(tokens):
+            tok = tokens[self.pos]
+            self.pos += 1
+            if tok == '}':
+                if stop_at_brace:
+                    break
+                continue
+            if tok == '{':
+                out.append(self.render(stop_at_brace=True))
+            elif tok == '_':
+                out.append(self._script(_SUBSCRIPT, _BARE_SUB_RE))
+            elif tok == '^':
+                out.append(self._script(_SUPERSCRIPT, _BARE_SUP_RE))
+            elif tok[0] == '\\':
+                out.append(self._command(tok[1:]))
+            else:
+                out.append(tok)
+        return ''.join(out)
+
+    def _argument(self) -> str:
+        """Аргумент команды: {группа} или следующий токен."""
+        while self.pos < len(self.tokens) and self.tokens[self.pos].isspace():
+            self.pos += 1
+        if self.pos >= len(self.tokens):
+            return ''
+        if self.tokens[self.pos] == '{':
+            self.pos += 1
+            return self.render(stop_at_brace=True)
+        tok = self.tokens[self.pos]
+        if tok[0] == '\\':
+            self.pos += 1
+            return self._command(tok[1:])
+        # из простого текста берём только первый символ
+        self.tokens[self.pos] = tok[1:]
+        if not self.tokens[self.pos]:
+            self.pos += 1
+        return tok[0]
+
+    def _script(self, table: dict, bare_re: re.Pattern) -> str:
+        """Индекс после _ или ^: {группа}, либо цифры/заряд/один символ без скобок."""
+        if self.pos >= len(self.tokens):
+            return ''
+        tok = self.tokens[self.pos]
+        if tok == '{' or tok[0] == '\\':
+            body = self._argument()
+        else:
+            body = bare_re.match(tok).group(0)
+            rest = tok[len(body):]
+            if rest:
+                self.tokens[self.pos] = rest
+            else:
+                self.pos += 1
+        return ''.join(table.get(ch, ch) for ch in body)
+
+    def _command(self, name: str) -> str:
+        if name in _SYMBOLS:
+            return _SYMBOLS[name]
+        if name in _UNWRAP:
+            return self._argument()
+        if name == 'frac':
+            num, den = self._argument(), self._argument()
+            if len(num) > 1:
+                num = f"({num})"
+            if len(den) > 1:
+                den = f"({den})"
+            return f"{num}/{den}"
+        if name == 'xrightarrow':
+            label = self._argument()
+            return f"—{label}→" if label else '→'
+        # неизвестная команда — оставляем имя без обратного слеша
+        return name
+
+
+@lru_cache(maxsize=4096)
+def render_formula(src: str) -> str:
+    """Одна формула LaTeX → строка с Unicode-индексами и символами (с кэшем)."""
+    return _FormulaParser(src).render().strip()
+
+
+def _convert(match: re.Match) -> str:
+    frm = render_formula(match.group(1) if match.group(1) is not None else match.group(2))
+    # обернуть в Markdown code-block
+    return f"```\n{frm}\n```"
+
+
 def latex_to_codeblock(text: str) -> str:
-    def _convert(match: re.Match) -> str:
-        frm = match.group(1)
-        # убрать \text{...}
-        frm = re.sub(r'\\text\{([^}]*)\}', r'\1', frm)
-        # подстрочные индексы _{digits}
-        frm = re.sub(
-            r'_(?:\{)?(\d+)(?:\})?',
-            lambda m: ''.join(_SUBSCRIPT.get(ch, ch) for ch in m.group(1)),
-            frm
-        )
-        # надстрочные ^{digits} или ^digit
-        frm = re.sub(
-            r'\^(?:\{)?([^}]+)(?:\})?',
-            lambda m: ''.join(_SUPERSCRIPT.get(ch, ch) for ch in m.group(1)),
-            frm
-        )
-        # стрелки и эквивалентность
-        frm = re.sub(r'\\(?:rightarrow|to|longrightarrow|xrightarrow)', '→', frm)
-        frm = re.sub(r'\\equiv', '≡', frm)
-        # удалить фигурные скобки и обратные слеши
-        frm = frm.replace('{', '').replace('}', '')
-        frm = frm.replace('\\,', '')
-        frm = frm.strip()
-        # обернуть в Markdown code-block
-        return f"```\n{frm}\n```"
-
-    # заменить блочные формулы \[ ... \]
-    text = re.sub(r'\\\[([\s\S]*?)\\\]', _convert, text, flags=re.DOTALL)
-    # заменить инлайн-формулы $ ... $
-    text = re.sub(r'\$([^$]+)\$', _convert, text)
-    return text
-
-def get_prepared_lecture(topic, idx):
+    if '$' not in text and '\\[' not in text:
+        return text
+    return _FORMULA_RE.sub(_convert, text)
+
+
+# ====== Ответы GPT → HTML для Telegram ======
+
+TG_MAX_LEN = 4096  # лимит длины одного сообщения Telegram
+
+# Теги, которые понимает Telegram (синонимы сводим к одному имени)
+_TG_TAGS = {
+    'b': 'b', 'strong': 'b', 'i': 'i', 'em': 'i', 'u': 'u', 'ins': 'u',
+    's': 's', 'strike': 's', 'del': 's', 'code': 'code', 'pre': 'pre',
+    'blockquote': 'blockquote', 'a': 'a', 'tg-spoiler': 'tg-spoiler',
+}
+_HEADINGS = frozenset({'h1', 'h2', 'h3', 'h4', 'h5', 'h6'})
+# Теги, которые разбираем: Telegram-теги и вёрстка, которую переводим в текст.
+# Остальное с «<» — текст (a<b и c > d), его экранируем.
+# Атрибуты не разбираем: у <a> допускается только href, у остальных — ничего
+# (иначе «a<b and c > d» читается как тег <b> с атрибутами and и c).
+_KNOWN_TAGS = sorted(set(_TG_TAGS) - {'a'} | _HEADINGS | {'p', 'div', 'br', 'ul', 'ol', 'li'}, key=len, reverse=True)
+_HREF_ATTR = r'\s+href\s*=\s*(?:"[^"<>]*"|\'[^\'<>]*\')'
+# Сущности, которые принимает Telegram; прочие (&nbsp;) экранируем
+_TG_ENTITIES = r'lt|gt|amp|quot|#\d+|#x[0-9a-fA-F]+'
+_HREF_RE = re.compile(r'href\s*=\s*["\']([^"\']*)["\']', re.I)
+
+# Один проход по ответу GPT: блоки кода, теги, Markdown, сущности, текст
+_GPT_TOKEN_RE = re.compile(
+    r'(?P<pre>```[^\n`]*\n?(?P<pre_body>[\s\S]*?)```)'
+    r'|(?P<code>`(?P<code_body>[^`\n]+)`)'
+    r'|(?P<tag><(?P<close>/?)(?:(?P<link>[aA])(?P<attrs>' + _HREF_ATTR + r')?'
+    r'|(?P<name>(?i:' + '|'.join(_KNOWN_TAGS) + r')))\s*/?>)'
+    r'|(?P<heading>^[ \t]*#{1,6}[ \t]+)'
+    r'|(?P<bullet>^[ \t]*[-*•][ \t]+)'
+    r'|(?P<bold>\*\*)'
+    r'|(?P<entity>&(?:' + _TG_ENTITIES + r');)'
+    r'|(?P<newline>\n)'
+    r'|(?P<text>[^<&`*\n]+|.)',
+    re.M,
+)
+_EXTRA_NEWLINES_RE = re.compile(r'\n{3,}')
+_OPEN_TAIL_RE = re.compile(r'<[^<>]*$|```[^`]*$')
+
+
+def _render_gpt(text: str, html_mode: bool = True) -> str:
+    """
+    Общий однопроходный конвертер ответа GPT.
+    html_mode=True  — HTML для Telegram: разрешённые теги сохраняются и балансируются,
+                      Markdown (**жирный**, `код`, ```блок```, # заголовок) → теги,
+                      остальной текст экранируется;
+    html_mode=False — простой текст без разметки.
+    """
+    out: list[str] = []
+    stack: list[str] = []      # открытые теги Telegram
+    lists: list[int] = []      # вложенные списки: 0 — ul, n>0 — номер следующего пункта ol
+    in_heading = False
+
+    def open_tag(name: str, full: str):
+        if html_mode and not ({'code', 'pre'} & set(stack)):
+            out.append(full)
+            stack.append(name)
+
+    def close_tag(name: str):
+        if name not in stack:
+            return
+        while stack:
+            top = stack.pop()
+            if html_mode:
+                out.append(f"</{top}>")
+            if top == name:
+                break
+
+    def literal(s: str):
+        out.append(html.escape(s, quote=False) if html_mode else s)
+
+    def block(body: str, m: re.Match):
+        # блок без тегов (простой текст или внутри <code>): отделяем его от
+        # соседних слов, а не склеиваем с ними
+        sep = "\n" if "\n" in body else " "
+        if m.start() and not src[m.start() - 1].isspace():
+            out.append(sep)
+        literal(body)
+        if m.end() < len(src) and not src[m.end()].isspace():
+            out.append(sep)
+
+    src = latex_to_codeblock(text)
+    for m in _GPT_TOKEN_RE.finditer(src):
+        kind = m.lastgroup
+        if kind == 'text':
+            literal(m.group(0))
+        elif kind == 'newline':
+            if in_heading:
+                close_tag('b')
+                in_heading = False
+            out.append("\n")
+        elif kind == 'pre':
+            body = m.group('pre_body').strip('\n')
+            if html_mode and not stack:
+                out.append(f"<pre>{html.escape(body, quote=False)}</pre>")
+            else:
+                block(body, m)
+        elif kind == 'code':
+            body = m.group('code_body')
+            if html_mode and not ({'code', 'pre'} & set(stack)):
+                out.append(f"<code>{html.escape(body, quote=False)}</code>")
+            else:
+                literal(body)
+        elif kind == 'bold':
+            if 'b' in stack:
+                close_tag('b')
+            else:
+                open_tag('b', '<b>')
+        elif kind == 'heading':
+            if not in_heading:
+                open_tag('b', '<b>')
+                in_heading = 'b' in stack or not html_mode
+        elif kind == 'bullet':
+            out.append("• ")
+        elif kind == 'entity':
+            out.append(m.group(0) if html_mode else html.unescape(m.group(0)))
+        else:  # tag
+            name = (m.group('name') or m.group('link')).lower()
+            closing = bool(m.group('close'))
+            if name in ('p', 'div'):
+                if closing:
+                    out.append("\n\n")
+            elif name == 'br':
+                out.append("\n")
+            elif name in ('ul', 'ol'):
+                if closing:
+                    if lists:
+                        lists.pop()
+                    out.append("\n")
+                else:
+                    lists.append(1 if name == 'ol' else 0)
+            elif name == 'li':
+                if closing:
+                    out.append("\n")
+                elif lists and lists[-1]:
+                    out.append(f"{lists[-1]}. ")
+                    lists[-1] += 1
+                else:
+                    out.append("• ")
+            elif name in _HEADINGS:
+                if closing:
+                    close_tag('b')
+                    out.append("\n")
+                else:
+                    open_tag('b', '<b>')
+            elif name in _TG_TAGS:
+                tg = _TG_TAGS[name]
+                if closing:
+                    close_tag(tg)
+                elif tg == 'a':
+                    href = _HREF_RE.search(m.group('attrs') or "")
+                    if href:
+                        open_tag('a', f'<a href="{html.escape(href.group(1))}">')
+                else:
+                    open_tag(tg, f"<{tg}>")
+            # прочие теги просто выбрасываем
+    while stack:
+        close_tag(stack[-1])
+    return _EXTRA_NEWLINES_RE.sub("\n\n", "".join(out)).strip()
+
+
+def to_telegram_html(text: str, partial: bool = False) -> str:
+    """
+    Ответ GPT (HTML или Markdown) → безопасный HTML для parse_mode="HTML".
+    partial=True — для недописанного текста при стриминге: обрезает
+    незакрытый хвост тега или блока кода, чтобы он не мелькал в сообщении.
+
+    Текст с «<», «>» и «&» — не разметка, он экранируется:
+
+    >>> to_telegram_html('if a<b and c > d then ok')
+    'if a&lt;b and c &gt; d then ok'
+    >>> to_telegram_html('a < b')
+    'a &lt; b'
+    >>> to_telegram_html('x&nbsp;y &amp; z')
+    'x&amp;nbsp;y &amp; z'
+    >>> to_telegram_html('Цена $5 и $10')
+    'Цена $5 и $10'
+    >>> to_telegram_html('<b>Да</b>, <a href="https://t.me">ссылка</a> и $CH_4$')
+    '<b>Да</b>, <a href="https://t.me">ссылка</a> и <pre>CH₄</pre>'
     """
-    Получает готовую лекцию по теме и номеру chunk'а из базы данных.
-    Возвращает текст лекции, либо None если такого нет.
+    if partial:
+        text = _OPEN_TAIL_RE.sub("", text)
+    return _render_gpt(text, html_mode=True)
+
+
+_SPLIT_TAG_RE = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9-]*)[^<>]*>')
+_SPLIT_ATOM_RE = re.compile(r'<[^<>]*>|&[#\w]+;|.', re.S)
+_SPLIT_SEPARATORS = ("\n\n", "\n", " ")
+
+
+def _advance_stack(stack: list, fragment: str) -> list:
+    """Стек открытых тегов [(имя, открывающий тег)] после fragment."""
+    stack = list(stack)
+    for m in _SPLIT_TAG_RE.finditer(fragment):
+        name = m.group(2).lower()
+        if not m.group(1):
+            stack.append((name, m.group(0)))
+            continue
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][0] == name:
+                del stack[i:]
+                break
+    return stack
+
+
+def _closing(stack: list) -> str:
+    return "".join(f"</{name}>" for name, _ in reversed(stack))
+
+
+def split_html(text: str, limit: int = TG_MAX_LEN) -> list[str]:
+    """
+    Режет HTML для Telegram на сообщения не длиннее limit символов:
+    по абзацам, если абзац не влезает — по строкам, потом по словам.
+    Теги, открытые на месте разреза, закрываются в конце части
+    и заново открываются в начале следующей, так что каждая часть сбалансирована.
     """
-    import sqlite3
-    with sqlite3.connect("prepared_lectures.db") as conn:
-        c = conn.cursor()
-        c.execute("SELECT lecture FROM prepared_lectures WHERE topic=? AND chunk_idx=?", (topic, idx))
-        row = c.fetchone()
-        return row[0] if row else None
+    if len(text) <= limit:
+        return [text] if text else []
+    parts: list[str] = []
+    current = ""       # текущая часть (начинается с переоткрытых тегов)
+    stack: list = []   # открытые теги в конце current: [(имя, открывающий тег)]
+    has_body = False
+
+    def flush():
+        nonlocal current, has_body
+        if has_body:
+            parts.append(current.rstrip() + _closing(stack))
+        current = "".join(tag for _, tag in stack)
+        has_body = False
+
+    def append(fragment: str, sep: str) -> bool:
+        nonlocal current, stack, has_body
+        glue = sep if has_body else ""
+        new_stack = _advance_stack(stack, fragment)
+        if len(current) + len(glue) + len(fragment) + len(_closing(new_stack)) > limit:
+            return False
+        current += glue + fragment
+        stack = new_stack
+        has_body = has_body or bool(fragment.strip())
+        return True
+
+    def add(fragment: str, level: int):
+        sep = _SPLIT_SEPARATORS[level]
+        if append(fragment, sep):
+            return
+        flush()
+        if append(fragment, sep):
+            return
+        if level + 1 < len(_SPLIT_SEPARATORS):
+            for piece in fragment.split(_SPLIT_SEPARATORS[level + 1]):
+                add(piece, level + 1)
+            return
+        # одно «слово» длиннее лимита — режем по символам, не ломая теги и сущности
+        for atom in _SPLIT_ATOM_RE.findall(fragment):
+            if not append(atom, ""):
+                flush()
+                append(atom, "")
+
+    for paragraph in text.split(_SPLIT_SEPARATORS[0]):
+        add(paragraph, 0)
+    flush()
+    return parts
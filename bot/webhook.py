@@ -0,0 +1,276 @@
+# bot/webhook.py
+"""
+Webhook-режим (RUN_MODE=webhook): aiohttp-приложение и несколько процессов-воркеров.
+
+    Telegram ──HTTPS──▶ шлюз (WEBHOOK_HOST:WEBHOOK_PORT, WEBHOOK_PATH)
+                          │  консистентный хэш по user_id
+                          ▼
+              воркер 0 … воркер N-1 (127.0.0.1:WORKER_BASE_PORT + i)
+
+Все апдейты одного пользователя всегда попадают в один воркер и обрабатываются
+там строго по очереди, поэтому состояние пользователя в памяти процесса
+(кэш StateDict, кэши клавиатур и т.п.) остаётся корректным. При изменении
+числа воркеров переезжает только ~1/N пользователей.
+
+При WEBHOOK_WORKERS=1 шлюз и диспетчер работают в одном процессе.
+
+Воркеры запускаются через spawn, а не fork: к моменту запуска главный
+процесс уже импортировал бота, и соединения (SQLite состояний и т.п.) не
+должны достаться воркерам по наследству. Базы и кэши каждый воркер
+поднимает сам (bot.main.init()).
+"""
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+from typing import Dict, List
+
+from aiohttp import ClientSession, ClientTimeout, web
+from aiogram.types import Update
+
+from bot.config import (
+    WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_WORKERS, WORKER_BASE_PORT,
+)
+
+logger = logging.getLogger(__name__)
+
+VNODES = 128              # виртуальных точек на воркер в кольце
+WORKER_UPDATE_PATH = "/update"
+FORWARD_TIMEOUT = ClientTimeout(total=10)
+
+# где искать отправителя в апдейте (порядок — как в Update)
+_USER_FIELDS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "inline_query", "chosen_inline_result", "callback_query", "shipping_query",
+    "pre_checkout_query", "poll_answer", "my_chat_member", "chat_member",
+    "chat_join_request",
+)
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Консистентное хэширование: user_id → номер воркера."""
+
+    def __init__(self, nodes: List[int], vnodes: int = VNODES):
+        points = sorted((_hash(f"worker-{n}#{v}"), n) for n in nodes for v in range(vnodes))
+        self._keys = [p for p, _ in points]
+        self._nodes = [n for _, n in points]
+
+    def get(self, user_id: int) -> int:
+        i = bisect.bisect(self._keys, _hash(str(user_id))) % len(self._keys)
+        return self._nodes[i]
+
+
+def extract_user_id(update: dict) -> int:
+    """user_id отправителя апдейта (для poll_answer — user, для постов каналов — chat)."""
+    for field in _USER_FIELDS:
+        event = update.get(field)
+        if not event:
+            continue
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return 0
+
+
+def _check_secret(request: web.Request) -> bool:
+    return not WEBHOOK_SECRET or request.headers.get("X-Telegram-Bot-Api-Secret-Token") == WEBHOOK_SECRET
+
+
+# ───────── Воркер: диспетчер + очередь на каждого пользователя ─────────
+class UserSerialFeeder:
+    """
+    Передаёт апдейты в диспетчер: разные пользователи — параллельно,
+    апдейты одного пользователя — строго по порядку поступления.
+    """
+
+    def __init__(self, dp, bot):
+        self.dp = dp
+        self.bot = bot
+        self._queues: Dict[int, asyncio.Queue] = {}
+
+    def feed(self, user_id: int, update: Update):
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = asyncio.Queue()
+            asyncio.create_task(self._drain(user_id, queue))
+        queue.put_nowait(update)
+
+    async def _drain(self, user_id: int, queue: asyncio.Queue):
+        try:
+            while not queue.empty():
+                update = queue.get_nowait()
+                try:
+                    await self.dp.feed_update(self.bot, update)
+                except Exception:
+                    logger.exception(f"Ошибка при обработке апдейта {update.update_id}")
+        finally:
+            self._queues.pop(user_id, None)
+
+
+def _build_dispatch_app(dp, bot, path: str, check_secret: bool) -> web.Application:
+    """aiohttp-приложение, которое принимает апдейты и кладёт их в UserSerialFeeder."""
+    feeder = UserSerialFeeder(dp, bot)
+
+    async def handle(request: web.Request) -> web.Response:
+        if check_secret and not _check_secret(request):
+            return web.Response(status=401)
+        data = await request.json()
+        update = Update.model_validate(data, context={"bot": bot})
+        feeder.feed(extract_user_id(data), update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    return app
+
+
+def _worker_main(index: int, port: int):
+    """Точка входа процесса-воркера."""
+    from bot.main import init, create_bot, create_dispatcher
+    from bot.services.broadcast import broadcaster
+    from bot.services.metrics import METRICS_PORT, start_metrics_server
+    from bot.services.loop_watchdog import watchdog
+    from bot.services.jobs import job_queue
+
+    logging.basicConfig(level=logging.INFO)
+    init()
+    bot = create_bot()
+    dp = create_dispatcher()
+    app = _build_dispatch_app(dp, bot, WORKER_UPDATE_PATH, check_secret=False)
+
+    async def on_startup(_):
+        if index == 0:  # рассылки отправляет только один процесс
+            broadcaster.start(bot)
+        job_queue.start(bot, shard=index)  # задания учеников этого воркера
+        if METRICS_PORT:  # у каждого воркера свой /metrics: METRICS_PORT + номер
+            await start_metrics_server(METRICS_PORT + index)
+        watchdog.start()
+
+    async def on_shutdown(_):
+        await watchdog.stop()
+        await job_queue.stop()
+        await broadcaster.stop()
+        await bot.session.close()
+
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    logger.info(f"Воркер {index} слушает 127.0.0.1:{port}")
+    web.run_app(app, host="127.0.0.1", port=port, print=None, handle_signals=True)
+
+
+# ───────── Шлюз: принимает webhook от Telegram и раздаёт по воркерам ─────────
+def _build_gateway_app(workers: int) -> web.Application:
+    ring = HashRing(list(range(workers)))
+    app = web.Application()
+
+    async def on_startup(app: web.Application):
+        app["http"] = ClientSession(timeout=FORWARD_TIMEOUT)
+
+    async def on_cleanup(app: web.Application):
+        await app["http"].close()
+
+    async def handle(request: web.Request) -> web.Response:
+        if not _check_secret(request):
+            return web.Response(status=401)
+        data = await request.json()
+        worker = ring.get(extract_user_id(data))
+        url = f"http://127.0.0.1:{WORKER_BASE_PORT + worker}{WORKER_UPDATE_PATH}"
+        try:
+            async with app["http"].post(url, json=data) as resp:
+                status = resp.status
+        except Exception as e:
+            # воркер недоступен — пусть Telegram повторит доставку позже
+            logger.warning(f"Воркер {worker} недоступен: {e}")
+            status = 503
+        return web.Response(status=200 if status == 200 else 503)
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post(WEBHOOK_PATH, handle)
+    return app
+
+
+async def _register_webhook():
+    """Выставить webhook и команды меню (один раз, из главного процесса)."""
+    from bot.main import create_bot, set_bot_commands, create_dispatcher
+
+    bot = create_bot()
+    try:
+        await set_bot_commands(bot)
+        await bot.set_webhook(
+            WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=create_dispatcher().resolve_used_update_types(),
+        )
+    finally:
+        await bot.session.close()
+
+
+def run_webhook():
+    """Запуск webhook-режима: шлюз в текущем процессе + WEBHOOK_WORKERS воркеров."""
+    logging.basicConfig(level=logging.INFO)
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("Для RUN_MODE=webhook задай WEBHOOK_BASE_URL в .env")
+
+    if WEBHOOK_WORKERS <= 1:
+        from bot.main import init, create_bot, create_dispatcher, set_bot_commands
+        from bot.services.broadcast import broadcaster
+        from bot.services.metrics import start_metrics_server
+        from bot.services.loop_watchdog import watchdog
+        from bot.services.jobs import job_queue
+
+        init()
+        bot = create_bot()
+        dp = create_dispatcher()
+        app = _build_dispatch_app(dp, bot, WEBHOOK_PATH, check_secret=True)
+
+        async def on_startup(_):
+            await set_bot_commands(bot)
+            await bot.set_webhook(
+                WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            broadcaster.start(bot)
+            job_queue.start(bot)
+            await start_metrics_server()
+            watchdog.start()
+
+        async def on_shutdown(_):
+            await watchdog.stop()
+            await job_queue.stop()
+            await broadcaster.stop()
+            await bot.session.close()
+
+        app.on_startup.append(on_startup)
+        app.on_shutdown.append(on_shutdown)
+        print("Бот запущен (webhook, 1 процесс)!")
+        web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+        return
+
+    spawn = multiprocessing.get_context("spawn")
+    procs = [
+        spawn.Process(target=_worker_main, args=(i, WORKER_BASE_PORT + i), daemon=True)
+        for i in range(WEBHOOK_WORKERS)
+    ]
+    for p in procs:
+        p.start()
+    try:
+        asyncio.run(_register_webhook())
+        print(f"Бот запущен (webhook, {WEBHOOK_WORKERS} воркеров)!")
+        web.run_app(_build_gateway_app(WEBHOOK_WORKERS), host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()  # SIGTERM: aiohttp корректно закрывает сессию бота
+        for p in procs:
+            p.join(timeout=10)
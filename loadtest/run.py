@@ -0,0 +1,322 @@
+"""
+Нагрузочный тест бота без сети: сколько учеников одновременно выдержит процесс.
+
+Апдейты виртуальных учеников подаются прямо в Dispatcher из bot/main.py
+(те же роутеры, middleware, очереди и база, что в проде); Telegram заменён
+FakeSession, OpenAI/Whisper и Google Sheets — локальными заглушками с
+настраиваемой задержкой (loadtest/stubs.py). Базы тестов, лекций, ответов и
+состояний создаются заново во временной папке.
+
+Запуск из корня проекта (нужны зависимости бота и ffmpeg для голосовых):
+    python -m loadtest.run --students 500 --ramp 30
+    python -m loadtest.run --students 2000 --mix test=5,chapter=3,oral=1 --gpt-latency 2 --json result.json
+
+На выходе — пропускная способность, перцентили времени обработки апдейта
+по шагам сценариев, задержка event loop, самые медленные операции (из
+bot/services/metrics.py), хендлеры, блокировавшие loop (loop_watchdog.py), и
+расход токенов GPT по операциям (prompts.py). С --trace трассы апдейтов пишутся в папку запуска
+(смотреть python -m bot.trace --file <папка>/traces.jsonl top).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from loadtest.telegram import BOT_TOKEN
+
+QUESTIONS_PER_TEST = 8
+TEST_TYPES = 28
+LAG_INTERVAL = 0.05   # шаг замера задержки event loop, с
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# ───────── Окружение и базы ─────────
+def prepare_workdir(args) -> str:
+    """Временная папка запуска + переменные окружения (до импорта bot.*)."""
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="loadtest_"))
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)  # сюда же бот пишет audio_*.ogg и report.pdf
+    os.environ.update({
+        "BOT_TOKEN": BOT_TOKEN,
+        "OPENAI_API_KEY": "loadtest",
+        "ANSWERS_DB": os.path.join(workdir, "answers.db"),
+        "TESTS_DB": os.path.join(workdir, "tests.db"),
+        "LECTURES_DB": os.path.join(workdir, "lectures.db"),
+        "STATE_DB": os.path.join(workdir, "state.db"),
+        "TRACE_FILE": os.path.join(workdir, "traces.jsonl") if args.trace else "",
+        "TRACE_MIN_MS": "0",  # в прогоне нужны все апдейты, не только медленные
+        "METRICS_PORT": "0",
+    })
+    if args.tg_rps:
+        os.environ["TG_GLOBAL_RPS"] = str(args.tg_rps)
+    return workdir
+
+
+def build_fixtures():
+    """Синтетические тесты (TEST_TYPES × QUESTIONS_PER_TEST) и лекции по всем главам учебника."""
+    with sqlite3.connect(os.environ["TESTS_DB"]) as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS tests (
+                id INTEGER PRIMARY KEY, type INTEGER, question TEXT, options TEXT,
+                correct_answer TEXT, explanation TEXT, hint TEXT, detailed_explanation TEXT
+            )
+        ''')
+        conn.execute("DELETE FROM tests")
+        conn.executemany(
+            "INSERT INTO tests VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    t * 100 + i, t,
+                    f"Тест {t}, задание {i + 1}. Из предложенного перечня выберите два вещества, "
+                    f"которые являются структурными изомерами пентана.",
+                    "1) бутан\n2) 2-метилбутан\n3) пентен-1\n4) 2,2-диметилпропан\n5) циклопентан",
+                    "24", "2-метилбутан и 2,2-диметилпропан имеют формулу C5H12.", "Посчитай атомы углерода.", "",
+                )
+                for t in range(1, TEST_TYPES + 1) for i in range(QUESTIONS_PER_TEST)
+            ],
+        )
+    from bot.services import lecture_db
+    from bot.utils import TEXTBOOK_CONTENT
+
+    lecture_db.init_lectures_table()
+    for topic, chunks in TEXTBOOK_CONTENT.items():
+        for idx, chunk in enumerate(chunks):
+            lecture_db.save_lecture(topic, idx, chunk, chunk)
+    return {t: QUESTIONS_PER_TEST for t in range(1, TEST_TYPES + 1)}
+
+
+def make_voice(seconds: int) -> bytes:
+    """OGG-тишина нужной длины (как голосовое из Telegram; pydub + ffmpeg)."""
+    from pydub import AudioSegment
+
+    buf = AudioSegment.silent(duration=seconds * 1000, frame_rate=16000).export(format="ogg")
+    try:
+        return buf.read()
+    finally:
+        buf.close()
+
+
+# ───────── Прогон ─────────
+class Recorder:
+    def __init__(self):
+        self.latency = defaultdict(list)   # метка шага -> [с]
+        self.errors = Counter()
+        self.lag = []
+        self.updates = 0
+
+    async def watch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.lag.append(max(0.0, loop.time() - started - LAG_INTERVAL))
+
+
+async def run(args, tests) -> dict:
+    from loadtest.stubs import Latency, StubServer, StubSheet
+    from loadtest.telegram import FakeSession, Student
+    from loadtest.scenarios import SCENARIOS, parse_mix
+
+    latency = Latency(
+        gpt_first=args.gpt_latency, gpt_chunk=args.gpt_chunk, whisper=args.whisper_latency,
+        sheets=args.sheets_latency,
+    )
+    # в отчёте у каждого ученика уже есть одна сданная тема
+    stubs = StubServer(latency, seed_rows=[
+        (f"Ученик {uid}", uid, "Алканы", "…", "Молодец!", "2025-01-01 10:00:00")
+        for uid in range(1, args.students + 1)
+    ])
+    base_url = stubs.start()
+    os.environ["OPENAI_API_BASE"] = f"{base_url}/v1"
+
+    # импорт бота — только теперь: модули читают окружение при импорте
+    from bot.main import init, create_bot, create_dispatcher
+    from bot.services import spreadsheet
+    from bot.services.db_writer import db_writer
+    from bot.services.jobs import job_queue
+    from bot.services.loop_watchdog import watchdog
+    from bot.services.metrics import registry
+    from bot.services import prompts
+
+    spreadsheet._get_sheet = lambda: StubSheet(base_url)
+    mix = parse_mix(args.mix)
+    voice = b""
+    if "oral" in mix:
+        try:
+            voice = make_voice(args.voice_seconds)
+        except Exception as e:
+            print(f"⚠️ Не удалось сделать голосовое ({e}); нужен ffmpeg. Сценарий oral пропущен.")
+            mix.pop("oral")
+    session = FakeSession(latency=args.tg_latency, voice=voice)
+    bot = create_bot(session=session)
+    init()
+    dp = create_dispatcher()
+    rec = Recorder()
+    rng = random.Random(args.seed)
+    names, weights = list(mix), list(mix.values())
+
+    async def student(uid: int, delay: float):
+        await asyncio.sleep(delay)
+        s = Student(uid, bot)
+        srng = random.Random(rng.random())
+
+        async def feed(label, update):
+            started = time.perf_counter()
+            try:
+                await dp.feed_update(bot, update)
+            except Exception as e:
+                rec.errors[label] += 1
+                if rec.errors[label] <= 3:
+                    logging.warning(f"{label}: {type(e).__name__}: {e}")
+            rec.latency[label].append(time.perf_counter() - started)
+            rec.updates += 1
+
+        async def think():
+            if args.think > 0:
+                await asyncio.sleep(srng.expovariate(1 / args.think))
+
+        for _ in range(args.rounds):
+            name = srng.choices(names, weights)[0]
+            kwargs = {"voice_seconds": args.voice_seconds} if name == "oral" else {}
+            await SCENARIOS[name](s, feed, think, srng, tests, **kwargs)
+
+    watcher = asyncio.create_task(rec.watch_loop())
+    watchdog.start()
+    job_queue.start(bot)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        student(uid, args.ramp * (uid - 1) / max(1, args.students - 1))
+        for uid in range(1, args.students + 1)
+    ))
+    acked = time.perf_counter() - started
+    await job_queue.join()  # проверки и отчёты, поставленные последними учениками
+    wall = time.perf_counter() - started
+    watcher.cancel()
+    await job_queue.stop()
+    await watchdog.stop()
+    await db_writer.flush()
+    await bot.session.close()
+    stubs.stop()
+
+    steps = {
+        label: {
+            "count": len(v),
+            "errors": rec.errors[label],
+            **{f"p{int(q * 100)}": round(_percentile(v, q), 4) for q in (0.5, 0.95, 0.99)},
+            "max": round(max(v), 4),
+        }
+        for label, v in sorted(rec.latency.items())
+    }
+    return {
+        "students": args.students,
+        "updates": rec.updates,
+        "seconds": round(wall, 2),
+        "jobs_tail": round(wall - acked, 2),
+        "throughput": round(rec.updates / wall, 2) if wall else 0.0,
+        "errors": sum(rec.errors.values()),
+        "steps": steps,
+        "loop_lag": {
+            **{f"p{int(q * 100)}": round(_percentile(rec.lag, q), 4) for q in (0.5, 0.95, 0.99)},
+            "max": round(max(rec.lag, default=0.0), 4),
+        },
+        "telegram_calls": dict(session.calls),
+        "stub_calls": stubs.calls,
+        "operations": registry.snapshot("bot_operation_seconds"),
+        "loop_blocked": registry.snapshot("bot_loop_blocked_seconds"),
+        "jobs": registry.snapshot("bot_job_seconds"),
+        "tokens": {
+            op: {"prompt": n, "cached": prompts.cached_tokens[op], "completion": prompts.completion_tokens[op]}
+            for op, n in sorted(prompts.prompt_tokens.items())
+        },
+    }
+
+
+def print_report(result: dict):
+    print()
+    print(
+        f"Учеников: {result['students']}, апдейтов: {result['updates']} за {result['seconds']} с "
+        f"→ {result['throughput']} апд/с, ошибок: {result['errors']}"
+    )
+    print()
+    print(f"{'шаг':<18}{'n':>7}{'p50, с':>10}{'p95, с':>10}{'p99, с':>10}{'max, с':>10}{'ошибок':>8}")
+    for label, s in result["steps"].items():
+        print(f"{label:<18}{s['count']:>7}{s['p50']:>10.3f}{s['p95']:>10.3f}{s['p99']:>10.3f}{s['max']:>10.3f}{s['errors']:>8}")
+    lag = result["loop_lag"]
+    print()
+    print(f"Задержка event loop: p50 {lag['p50'] * 1000:.1f} мс, p99 {lag['p99'] * 1000:.1f} мс, max {lag['max'] * 1000:.1f} мс")
+    calls = ", ".join(f"{k} {v}" for k, v in sorted(result["telegram_calls"].items(), key=lambda kv: -kv[1]))
+    print(f"Запросов к Telegram: {calls}")
+    print("Запросов к заглушкам: " + ", ".join(f"{k} {v}" for k, v in result["stub_calls"].items()))
+    ops = sorted(result["operations"].items(), key=lambda kv: -kv[1]["p95"])[:10]
+    if ops:
+        print()
+        print("Самые медленные операции (p95):")
+        for op, s in ops:
+            print(f"    {op:<40} p95 {s['p95']:.3f} с  ×{s['count']}  ошибок {s['errors']}")
+    if result["jobs"]:
+        print()
+        print(f"Фоновые задания (догонялись {result['jobs_tail']} с после последнего апдейта):")
+        for kind, s in sorted(result["jobs"].items()):
+            print(f"    {kind:<40} p50 {s['p50']:.3f} с  p95 {s['p95']:.3f} с  ×{s['count']}  ошибок {s['errors']}")
+    if result["tokens"]:
+        print()
+        print("Токены GPT по операциям (bot/services/prompts.py):")
+        for op, t in result["tokens"].items():
+            print(f"    {op:<40} промпт {t['prompt']}  из кэша {t['cached']}  ответ {t['completion']}")
+    blocked = sorted(result["loop_blocked"].items(), key=lambda kv: -kv[1]["count"])[:10]
+    if blocked:
+        print()
+        print("Кто блокировал event loop (bot/services/loop_watchdog.py):")
+        for handler, s in blocked:
+            print(f"    {handler:<40} ×{s['count']}  p95 {s['p95']:.3f} с  p99 {s['p99']:.3f} с")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота (без сети)")
+    parser.add_argument("--students", type=int, default=200, help="виртуальных учеников")
+    parser.add_argument("--ramp", type=float, default=10.0, help="за сколько секунд подключаются все ученики")
+    parser.add_argument("--rounds", type=int, default=1, help="сценариев на ученика")
+    parser.add_argument("--mix", default="test=4,chapter=3,oral=2,report=1", help="веса сценариев")
+    parser.add_argument("--think", type=float, default=1.0, help="средняя пауза ученика между действиями, с")
+    parser.add_argument("--voice-seconds", type=int, default=75, help="длина голосового ответа")
+    parser.add_argument("--tg-latency", type=float, default=0.05, help="задержка Bot API, с")
+    parser.add_argument("--tg-rps", type=float, help="общий лимит запросов к Telegram (TG_GLOBAL_RPS)")
+    parser.add_argument("--gpt-latency", type=float, default=0.8, help="до первого токена GPT, с")
+    parser.add_argument("--gpt-chunk", type=float, default=0.03, help="между чанками стрима GPT, с")
+    parser.add_argument("--whisper-latency", type=float, default=1.5, help="на сегмент Whisper, с")
+    parser.add_argument("--sheets-latency", type=float, default=0.3, help="на запрос к Google Sheets, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="папка для баз запуска (по умолчанию временная)")
+    parser.add_argument("--trace", action="store_true", help="писать трассы апдейтов в папку запуска")
+    parser.add_argument("--json", help="сохранить результат в JSON (для сравнения между версиями)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.json:
+        args.json = os.path.abspath(args.json)  # до перехода в папку запуска
+    workdir = prepare_workdir(args)
+    tests = build_fixtures()
+    print(f"Папка запуска: {workdir}")
+    result = asyncio.run(run(args, tests))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
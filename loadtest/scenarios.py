@@ -0,0 +1,73 @@
+"""
+Сценарии виртуальных учеников. Каждый — последовательность апдейтов с
+паузами «на подумать», как у живого ученика:
+
+    test     — открыть тесты, выбрать тест, ответить на все вопросы
+    chapter  — открыть курс, выбрать главу, листать порции, иногда задать вопрос
+    oral     — устный зачёт: тема, голосовой ответ (Whisper + GPT + таблица)
+    report   — PDF-отчёт (таблица + база ответов + ReportLab)
+
+feed(label, update) отдаёт апдейт диспетчеру и замеряет время по метке label,
+think() — пауза ученика.
+"""
+import random
+from typing import Awaitable, Callable, Dict
+
+from bot.utils import ALL_TOPICS, LEARNING_TOPICS
+
+Feed = Callable[[str, object], Awaitable[None]]
+Think = Callable[[], Awaitable[None]]
+
+
+async def test_run(s, feed: Feed, think: Think, rng: random.Random, tests: Dict[int, int]):
+    test_type = rng.choice(sorted(tests))
+    await feed("tests.menu", s.text("📝 Тесты"))
+    await think()
+    await feed("tests.start", s.callback(f"choose_test_{test_type}"))
+    for _ in range(tests[test_type]):
+        await think()
+        await feed("tests.answer", s.text(str(rng.randint(1, 4))))
+
+
+async def chapter(s, feed: Feed, think: Think, rng: random.Random, tests: Dict[int, int]):
+    await feed("course.menu", s.text("🌱 Курс по органике"))
+    await think()
+    await feed("course.chapter", s.callback(f"learn_topic_{rng.randrange(len(LEARNING_TOPICS))}"))
+    for _ in range(rng.randint(2, 6)):
+        await think()
+        await feed("course.next", s.callback("learn_ok"))
+    if rng.random() < 0.3:
+        await feed("course.back", s.callback("learn_back"))
+    if rng.random() < 0.3:
+        await feed("course.ask", s.callback("learn_ask"))
+        await think()
+        await feed("course.question", s.text("А почему алканы не вступают в реакции присоединения?"))
+    await think()
+    await feed("course.stop", s.callback("learn_stop"))
+
+
+async def oral(s, feed: Feed, think: Think, rng: random.Random, tests: Dict[int, int], voice_seconds: int = 75):
+    await feed("oral.menu", s.text("🧪 Устный зачет"))
+    await think()
+    await feed("oral.topic", s.text(rng.choice(ALL_TOPICS)))
+    await think()
+    await feed("oral.voice", s.voice(voice_seconds))
+
+
+async def report(s, feed: Feed, think: Think, rng: random.Random, tests: Dict[int, int]):
+    await feed("report", s.text("📈 Получить отчёт"))
+
+
+SCENARIOS = {"test": test_run, "chapter": chapter, "oral": oral, "report": report}
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """«test=4,chapter=3,oral=2,report=1» → веса сценариев."""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Неизвестный сценарий: {name} (есть: {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1)
+    return mix
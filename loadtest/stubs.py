@@ -0,0 +1,191 @@
+"""
+Локальные заглушки внешних API для нагрузочного теста (один aiohttp-сервер):
+
+    POST /v1/chat/completions        — OpenAI chat (обычный ответ и stream=true)
+    POST /v1/audio/transcriptions    — Whisper
+    POST /sheets/append, GET /sheets/records — Google Sheets (через StubSheet)
+
+Задержки задаются в Latency, сервер работает в своём потоке (StubServer).
+Бот направляется сюда через OPENAI_API_BASE, а spreadsheet._get_sheet
+подменяется на StubSheet (gspread ходит в Google через OAuth, заглушить его
+только адресом нельзя).
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+import urllib.request
+
+from aiohttp import web
+
+TOPIC_ANSWER = "Алканы"
+TRANSCRIPT = (
+    "Алканы — это предельные углеводороды с общей формулой CnH2n+2. "
+    "Их получают гидрированием алкенов и реакцией Вюрца. "
+    "Для алканов характерны реакции замещения, например хлорирование на свету."
+)
+FEEDBACK = (
+    "Хороший ответ! Ты верно назвал общую формулу алканов и привёл реакцию Вюрца. "
+    "Не хватает изомерии: начиная с бутана у алканов есть структурные изомеры. "
+    "В химических свойствах стоит упомянуть горение, крекинг и изомеризацию. "
+    "Обрати внимание: хлорирование идёт по радикальному механизму, и легче всего "
+    "замещается водород у третичного атома углерода. 📌 Повтори номенклатуру ИЮПАК "
+    "и попробуй назвать три изомера пентана."
+)
+SHEET_COLUMNS = ("Имя", "Telegram ID", "Тема", "Ответ", "Комментарий GPT", "Дата и время")
+
+
+class Latency:
+    """Задержки заглушек, секунды (± jitter, доля)."""
+
+    def __init__(self, gpt_first=0.8, gpt_chunk=0.03, gpt_chunks=40, whisper=1.5, sheets=0.3, jitter=0.3):
+        self.gpt_first = gpt_first      # до первого токена / всего ответа
+        self.gpt_chunk = gpt_chunk      # между чанками стрима
+        self.gpt_chunks = gpt_chunks    # чанков в стриме
+        self.whisper = whisper          # на один 60-секундный сегмент
+        self.sheets = sheets            # на запрос к таблице
+        self.jitter = jitter
+
+    def sample(self, value: float) -> float:
+        return max(0.0, value * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+
+def _completion(content: str) -> dict:
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "gpt-4o",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 500, "completion_tokens": len(content) // 3, "total_tokens": 500 + len(content) // 3},
+    }
+
+
+def _chunk(delta: dict, finish=None) -> bytes:
+    data = {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "gpt-4o",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+    }
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+
+def build_stub_app(latency: Latency, seed_rows=()) -> web.Application:
+    app = web.Application(client_max_size=32 * 1024 * 1024)
+    rows = [dict(zip(SHEET_COLUMNS, row)) for row in seed_rows]  # строки «таблицы»
+    app["calls"] = calls = {"chat": 0, "chat_stream": 0, "whisper": 0, "sheets": 0}
+
+    async def chat(request: web.Request):
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        content = TOPIC_ANSWER if prompt.startswith("Определи тему") else FEEDBACK
+        await asyncio.sleep(latency.sample(latency.gpt_first))
+        if not body.get("stream"):
+            calls["chat"] += 1
+            return web.json_response(_completion(content))
+        calls["chat_stream"] += 1
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        await resp.write(_chunk({"role": "assistant"}))
+        step = max(1, len(content) // latency.gpt_chunks)
+        for i in range(0, len(content), step):
+            await resp.write(_chunk({"content": content[i:i + step]}))
+            await asyncio.sleep(latency.sample(latency.gpt_chunk))
+        await resp.write(_chunk({}, finish="stop"))
+        await resp.write(b"data: [DONE]\n\n")
+        await resp.write_eof()
+        return resp
+
+    async def transcriptions(request: web.Request):
+        await request.read()
+        calls["whisper"] += 1
+        await asyncio.sleep(latency.sample(latency.whisper))
+        return web.Response(text=TRANSCRIPT)
+
+    async def sheets_append(request: web.Request):
+        row = await request.json()
+        calls["sheets"] += 1
+        await asyncio.sleep(latency.sample(latency.sheets))
+        rows.append(dict(zip(SHEET_COLUMNS, row)))
+        return web.json_response({"ok": True})
+
+    async def sheets_records(request: web.Request):
+        calls["sheets"] += 1
+        await asyncio.sleep(latency.sample(latency.sheets))
+        # как get_all_records: вся таблица целиком, фильтрует вызывающий
+        return web.json_response(rows)
+
+    app.router.add_post("/v1/chat/completions", chat)
+    app.router.add_post("/v1/audio/transcriptions", transcriptions)
+    app.router.add_post("/sheets/append", sheets_append)
+    app.router.add_get("/sheets/records", sheets_records)
+    return app
+
+
+class StubServer:
+    """
+    Заглушки в отдельном потоке со своим event loop: бот вызывает Sheets
+    синхронно прямо из хендлеров, и сервер в том же loop просто не ответил бы.
+    """
+
+    def __init__(self, latency: Latency, seed_rows=(), host: str = "127.0.0.1"):
+        self.app = build_stub_app(latency, seed_rows)
+        self.host = host
+        self.base_url = ""
+        self._loop = None
+        self._runner = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loadtest-stubs", daemon=True)
+
+    @property
+    def calls(self) -> dict:
+        return dict(self.app["calls"])
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._runner = web.AppRunner(self.app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, 0)
+        self._loop.run_until_complete(site.start())
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{self.host}:{port}"
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+
+    def start(self) -> str:
+        self._thread.start()
+        self._ready.wait()
+        return self.base_url
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=10)
+
+
+class StubSheet:
+    """
+    То же, что gspread Worksheet, но ходит в заглушку (синхронно, как gspread:
+    блокирующие вызовы из хендлеров должны и в тесте блокировать event loop).
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+
+    def append_row(self, row):
+        data = json.dumps(row, ensure_ascii=False).encode()
+        req = urllib.request.Request(
+            f"{self.base_url}/sheets/append", data=data, headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            resp.read()
+
+    def get_all_records(self):
+        with urllib.request.urlopen(f"{self.base_url}/sheets/records", timeout=30) as resp:
+            return json.loads(resp.read())
@@ -0,0 +1,120 @@
+"""
+Фейковый Telegram для нагрузочного теста: сессия aiogram без сети и
+генератор апдейтов от виртуальных учеников.
+
+FakeSession отвечает на любой метод Bot API так, как ответил бы Telegram
+(ответ проходит ту же десериализацию check_response, что и настоящий),
+с задержкой latency секунд. Запросы идут через middleware сессии, так что
+очередь исходящих (bot/services/outbound.py) работает как в проде.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import (
+    AnswerCallbackQuery, EditMessageText, GetFile, SendDocument, SendMessage,
+)
+from aiogram.types import Update
+
+BOT_ID = 123456
+BOT_TOKEN = f"{BOT_ID}:LOADTEST"
+
+
+class FakeSession(BaseSession):
+    def __init__(self, latency: float = 0.05, voice: bytes = b""):
+        super().__init__()
+        self.latency = latency
+        self.voice = voice              # что отдаётся на download_file (ogg)
+        self.calls: Counter = Counter()  # метод Bot API -> сколько раз вызван
+        self._message_ids = itertools.count(1_000_000)
+
+    async def close(self):
+        pass
+
+    def _message(self, chat_id, text: Optional[str] = None, **extra) -> Dict[str, Any]:
+        result = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bot"},
+            **extra,
+        }
+        if text is not None:
+            result["text"] = text
+        return result
+
+    def _result(self, method) -> Any:
+        if isinstance(method, SendMessage):
+            return self._message(method.chat_id, method.text)
+        if isinstance(method, EditMessageText):
+            return self._message(method.chat_id, method.text) if method.chat_id else True
+        if isinstance(method, SendDocument):
+            return self._message(method.chat_id, document={"file_id": "doc", "file_unique_id": "doc"})
+        if isinstance(method, GetFile):
+            return {"file_id": method.file_id, "file_unique_id": method.file_id, "file_path": "voice/file.ogg"}
+        if isinstance(method, AnswerCallbackQuery):
+            return True
+        return True
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        await asyncio.sleep(self.latency)
+        content = json.dumps({"ok": True, "result": self._result(method)})
+        return self.check_response(bot, method, 200, content).result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        await asyncio.sleep(self.latency)
+        for i in range(0, len(self.voice), chunk_size):
+            yield self.voice[i:i + chunk_size]
+
+
+_update_ids = itertools.count(1)
+
+
+class Student:
+    """Виртуальный ученик: собирает апдейты от своего имени."""
+
+    def __init__(self, user_id: int, bot):
+        self.user_id = user_id
+        self.bot = bot
+        self._message_ids = itertools.count(1)
+
+    def _user(self) -> dict:
+        return {"id": self.user_id, "is_bot": False, "first_name": f"Ученик {self.user_id}", "username": f"s{self.user_id}"}
+
+    def _message(self, **fields) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": self.user_id, "type": "private"},
+            "from": self._user(),
+            **fields,
+        }
+
+    def _update(self, **fields) -> Update:
+        return Update.model_validate({"update_id": next(_update_ids), **fields}, context={"bot": self.bot})
+
+    def text(self, text: str) -> Update:
+        return self._update(message=self._message(text=text))
+
+    def voice(self, seconds: int) -> Update:
+        file_id = f"voice{self.user_id}"
+        return self._update(message=self._message(voice={
+            "file_id": file_id, "file_unique_id": file_id, "duration": seconds, "file_size": 16000 * seconds,
+        }))
+
+    def callback(self, data: str) -> Update:
+        # кнопка «висит» под сообщением бота — для хендлеров важны только chat и id
+        message = self._message(text="…")
+        message["from"] = {"id": BOT_ID, "is_bot": True, "first_name": "Bot"}
+        return self._update(callback_query={
+            "id": str(next(_update_ids)),
+            "from": self._user(),
+            "chat_instance": str(self.user_id),
+            "message": message,
+            "data": data,
+        })